@@ -45,6 +45,7 @@ from api.utils.file_utils import filename_type, get_project_base_directory, thum
 from api.utils.web_utils import CONTENT_TYPE_MAP, html2pdf, is_valid_url
 from deepdoc.parser.html_parser import RAGFlowHtmlParser
 from rag.nlp import search
+from rag.utils.retrieval_cache import bump_kb_generation
 from rag.utils.storage_factory import STORAGE_IMPL
 
 
@@ -361,6 +362,7 @@ def change_status():
             status_int = int(status)
             if not settings.docStoreConn.update({"doc_id": doc_id}, {"available_int": status_int}, search.index_name(kb.tenant_id), doc.kb_id):
                 result[doc_id] = {"error": "Database error (docStore update)!"}
+            bump_kb_generation(doc.kb_id)
             result[doc_id] = {"status": status}
         except Exception as e:
             result[doc_id] = {"error": f"Internal server error: {str(e)}"}
@@ -464,6 +466,7 @@ def run():
                 TaskService.filter_delete([Task.doc_id == id])
                 if settings.docStoreConn.indexExist(search.index_name(tenant_id), doc.kb_id):
                     settings.docStoreConn.delete({"doc_id": id}, search.index_name(tenant_id), doc.kb_id)
+                    bump_kb_generation(doc.kb_id)
 
             if str(req["run"]) == TaskStatus.RUNNING.value:
                 doc = doc.to_dict()
@@ -580,6 +583,7 @@ def change_parser():
                 return get_data_error_result(message="Tenant not found!")
             if settings.docStoreConn.indexExist(search.index_name(tenant_id), doc.kb_id):
                 settings.docStoreConn.delete({"doc_id": doc.id}, search.index_name(tenant_id), doc.kb_id)
+                bump_kb_generation(doc.kb_id)
 
         return get_json_result(data=True)
     except Exception as e:
@@ -33,6 +33,7 @@ from api import settings
 from rag.nlp import search
 from api.constants import DATASET_NAME_LIMIT
 from rag.settings import PAGERANK_FLD
+from rag.utils.retrieval_cache import bump_kb_generation
 from rag.utils.storage_factory import STORAGE_IMPL
 
 
@@ -123,6 +124,7 @@ def update():
                 # Elasticsearch requires PAGERANK_FLD be non-zero!
                 settings.docStoreConn.update({"exists": PAGERANK_FLD}, {"remove": PAGERANK_FLD},
                                          search.index_name(kb.tenant_id), kb.id)
+            bump_kb_generation(kb.id)
 
         e, kb = KnowledgebaseService.get_by_id(kb.id)
         if not e:
@@ -290,6 +292,7 @@ def rm_tags(kb_id):
                                      {"remove": {"tag_kwd": t}},
                                      search.index_name(kb.tenant_id),
                                      kb_id)
+    bump_kb_generation(kb_id)
     return get_json_result(data=True)
 
 
@@ -309,6 +312,7 @@ def rename_tags(kb_id):
                                      {"remove": {"tag_kwd": req["from_tag"].strip()}, "add": {"tag_kwd": req["to_tag"]}},
                                      search.index_name(kb.tenant_id),
                                      kb_id)
+    bump_kb_generation(kb_id)
     return get_json_result(data=True)
 
 
@@ -362,7 +366,8 @@ def delete_knowledge_graph(kb_id):
             code=settings.RetCode.AUTHENTICATION_ERROR
         )
     _, kb = KnowledgebaseService.get_by_id(kb_id)
-    settings.docStoreConn.delete({"knowledge_graph_kwd": ["graph", "subgraph", "entity", "relation"]}, search.index_name(kb.tenant_id), kb_id)
+    settings.docStoreConn.delete({"knowledge_graph_kwd": ["graph", "graph_part", "subgraph", "entity", "relation"]}, search.index_name(kb.tenant_id), kb_id)
+    bump_kb_generation(kb_id)
 
     return get_json_result(data=True)
 
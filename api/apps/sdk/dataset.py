@@ -51,6 +51,7 @@ from api.utils.validation_utils import (
 )
 from rag.nlp import search
 from rag.settings import PAGERANK_FLD
+from rag.utils.retrieval_cache import bump_kb_generation
 
 
 @manager.route("/datasets", methods=["POST"])  # noqa: F821
@@ -363,6 +364,7 @@ def update(tenant_id, dataset_id):
             else:
                 # Elasticsearch requires PAGERANK_FLD be non-zero!
                 settings.docStoreConn.update({"exists": PAGERANK_FLD}, {"remove": PAGERANK_FLD}, search.index_name(kb.tenant_id), kb.id)
+            bump_kb_generation(kb.id)
 
         if not KnowledgebaseService.update_by_id(kb.id, req):
             return get_error_data_result(message="Update dataset error.(Database error)")
@@ -522,6 +524,7 @@ def delete_knowledge_graph(tenant_id,dataset_id):
             code=settings.RetCode.AUTHENTICATION_ERROR
         )
     _, kb = KnowledgebaseService.get_by_id(dataset_id)
-    settings.docStoreConn.delete({"knowledge_graph_kwd": ["graph", "subgraph", "entity", "relation"]}, search.index_name(kb.tenant_id), dataset_id)
+    settings.docStoreConn.delete({"knowledge_graph_kwd": ["graph", "graph_part", "subgraph", "entity", "relation"]}, search.index_name(kb.tenant_id), dataset_id)
+    bump_kb_generation(dataset_id)
 
     return get_result(data=True)
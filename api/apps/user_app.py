@@ -29,7 +29,7 @@ from api.db import FileType, UserTenantRole
 from api.db.db_models import TenantLLM
 from api.db.services.file_service import FileService
 from api.db.services.llm_service import get_init_tenant_llm
-from api.db.services.tenant_llm_service import TenantLLMService
+from api.db.services.tenant_llm_service import TenantLLMService, bump_tenant_llm_generation
 from api.db.services.user_service import TenantService, UserService, UserTenantService
 from api.utils import (
     current_timestamp,
@@ -808,6 +808,7 @@ def set_tenant_info():
     try:
         tid = req.pop("tenant_id")
         TenantService.update_by_id(tid, req)
+        bump_tenant_llm_generation(tid)
         return get_json_result(data=True)
     except Exception as e:
         return server_error_response(e)
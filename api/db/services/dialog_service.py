@@ -15,6 +15,7 @@
 #
 import binascii
 import logging
+import os
 import re
 import time
 from copy import deepcopy
@@ -22,7 +23,6 @@ from datetime import datetime
 from functools import partial
 from timeit import default_timer as timer
 import trio
-from langfuse import Langfuse
 from peewee import fn
 from agentic_reasoning import DeepResearcher
 from api import settings
@@ -31,9 +31,8 @@ from api.db.db_models import DB, Dialog
 from api.db.services.common_service import CommonService
 from api.db.services.document_service import DocumentService
 from api.db.services.knowledgebase_service import KnowledgebaseService
-from api.db.services.langfuse_service import TenantLangfuseService
 from api.db.services.llm_service import LLMBundle
-from api.db.services.tenant_llm_service import TenantLLMService
+from api.db.services.tenant_llm_service import TenantLLMService, get_langfuse_tracer
 from api.utils import current_timestamp, datetime_format
 from graphrag.general.mind_map_extractor import MindMapExtractor
 from rag.app.resume import forbidden_select_fields4resume
@@ -45,6 +44,9 @@ from rag.utils import num_tokens_from_string, rmSpace
 from rag.utils.tavily_conn import Tavily
 
 
+PRE_RETRIEVAL_STAGE_TIMEOUT = float(os.environ.get("PRE_RETRIEVAL_STAGE_TIMEOUT", 120))
+
+
 class DialogService(CommonService):
     model = Dialog
 
@@ -319,6 +321,48 @@ def meta_filter(metas: dict, filters: list[dict]):
     return list(doc_ids)
 
 
+def run_stages(stages: dict, timeout: float = PRE_RETRIEVAL_STAGE_TIMEOUT):
+    """
+    Run `stages`, {name: (dependencies, func, fallback)}, as a DAG. Each `func(results)` runs in a
+    worker thread as soon as its dependencies are done; if it takes longer than `timeout` seconds
+    its result is `fallback(results)` instead, and without a fallback it fails with TimeoutError.
+    The first exception raised by a stage cancels the others and is re-raised.
+    Return the results and the (start, end) timestamps of every stage, both keyed by name.
+    """
+    results, timings, errors = {}, {}, []
+    done = {nm: trio.Event() for nm in stages}
+
+    async def run(nursery, nm, deps, func, fallback):
+        st = timer()
+        try:
+            for dep in deps:
+                await done[dep].wait()
+            st = timer()
+            with trio.move_on_after(timeout) as scope:
+                results[nm] = await trio.to_thread.run_sync(func, results, abandon_on_cancel=True)
+            if scope.cancelled_caught:
+                logging.warning(f"Stage {nm} timed out after {timeout}s")
+                if not fallback:
+                    raise TimeoutError(f"{nm.replace('_', ' ').capitalize()} timed out after {timeout:g}s.")
+                results[nm] = fallback(results)
+        except Exception as e:
+            errors.append(e)
+            nursery.cancel_scope.cancel()
+        finally:
+            timings[nm] = (st, timer())
+            done[nm].set()
+
+    async def main():
+        async with trio.open_nursery() as nursery:
+            for nm, (deps, func, fallback) in stages.items():
+                nursery.start_soon(run, nursery, nm, deps, func, fallback)
+
+    trio.run(main)
+    if errors:
+        raise errors[0]
+    return results, timings
+
+
 def chat(dialog, messages, stream=True, **kwargs):
     assert messages[-1]["role"] == "user", "The last content of this conversation is not from user."
     if not dialog.kb_ids and not dialog.prompt_config.get("tavily_api_key"):
@@ -337,15 +381,11 @@ def chat(dialog, messages, stream=True, **kwargs):
 
     check_llm_ts = timer()
 
-    langfuse_tracer = None
     trace_context = {}
-    langfuse_keys = TenantLangfuseService.filter_by_tenant(tenant_id=dialog.tenant_id)
-    if langfuse_keys:
-        langfuse = Langfuse(public_key=langfuse_keys.public_key, secret_key=langfuse_keys.secret_key, host=langfuse_keys.host)
-        if langfuse.auth_check():
-            langfuse_tracer = langfuse
-            trace_id = langfuse_tracer.create_trace_id()
-            trace_context = {"trace_id": trace_id}
+    langfuse_tracer = get_langfuse_tracer(dialog.tenant_id)
+    if langfuse_tracer:
+        trace_id = langfuse_tracer.create_trace_id()
+        trace_context = {"trace_id": trace_id}
 
     check_langfuse_tracer_ts = timer()
     kbs, embd_mdl, rerank_mdl, chat_mdl, tts_mdl = get_models(dialog)
@@ -378,39 +418,102 @@ def chat(dialog, messages, stream=True, **kwargs):
         if p["key"] not in kwargs:
             prompt_config["system"] = prompt_config["system"].replace("{%s}" % p["key"], " ")
 
-    if len(questions) > 1 and prompt_config.get("refine_multiturn"):
-        questions = [full_question(dialog.tenant_id, dialog.llm_id, messages)]
-    else:
-        questions = questions[-1:]
-
-    if prompt_config.get("cross_languages"):
-        questions = [cross_languages(dialog.tenant_id, dialog.llm_id, questions[0], prompt_config["cross_languages"])]
-
-    if dialog.meta_data_filter:
-        metas = DocumentService.get_meta_by_kbs(dialog.kb_ids)
+    tenant_ids = list(set([kb.tenant_id for kb in kbs]))
+    use_knowledge = "knowledge" in [p["key"] for p in prompt_config["parameters"]]
+    reasoning = prompt_config.get("reasoning", False)
+
+    def refine_multiturn(res):
+        if len(questions) > 1 and prompt_config.get("refine_multiturn"):
+            return [full_question(dialog.tenant_id, dialog.llm_id, messages)]
+        return questions[-1:]
+
+    def translate(res):
+        if prompt_config.get("cross_languages"):
+            return [cross_languages(dialog.tenant_id, dialog.llm_id, res["multiturn_refinement"][0], prompt_config["cross_languages"])]
+        return res["multiturn_refinement"]
+
+    def load_metadata(res):
+        return DocumentService.get_meta_by_kbs(dialog.kb_ids) if dialog.meta_data_filter else {}
+
+    def filter_by_metadata(res):
+        if not dialog.meta_data_filter:
+            return attachments
+        metas = res["load_metadata"]
         if dialog.meta_data_filter.get("method") == "auto":
-            filters = gen_meta_filter(chat_mdl, metas, questions[-1])
-            attachments.extend(meta_filter(metas, filters))
-            if not attachments:
-                attachments = None
+            filters = gen_meta_filter(chat_mdl, metas, res["cross_languages"][-1])
+            doc_ids = attachments + meta_filter(metas, filters)
         elif dialog.meta_data_filter.get("method") == "manual":
-            attachments.extend(meta_filter(metas, dialog.meta_data_filter["manual"]))
-            if not attachments:
-                attachments = None
-
-    if prompt_config.get("keyword", False):
-        questions[-1] += keyword_extraction(chat_mdl, questions[-1])
+            doc_ids = attachments + meta_filter(metas, dialog.meta_data_filter["manual"])
+        else:
+            return attachments
+        return doc_ids if doc_ids else None
+
+    def extract_keywords(res):
+        qs = res["cross_languages"]
+        if prompt_config.get("keyword", False):
+            return qs[:-1] + [qs[-1] + keyword_extraction(chat_mdl, qs[-1])]
+        return qs
+
+    def should_retrieve(res):
+        return res["metadata_filter"] is not None and use_knowledge and not reasoning
+
+    def retrieve(res):
+        if not should_retrieve(res) or not embd_mdl:
+            return None
+        question = " ".join(res["keyword_extraction"])
+        return retriever.retrieval(
+            question,
+            embd_mdl,
+            tenant_ids,
+            dialog.kb_ids,
+            1,
+            dialog.top_n,
+            dialog.similarity_threshold,
+            dialog.vector_similarity_weight,
+            doc_ids=res["metadata_filter"],
+            top=dialog.top_k,
+            aggs=False,
+            rerank_mdl=rerank_mdl,
+            rank_feature=label_question(question, kbs),
+        )
 
-    refine_question_ts = timer()
+    def web_search(res):
+        if not should_retrieve(res) or not prompt_config.get("tavily_api_key"):
+            return None
+        return Tavily(prompt_config["tavily_api_key"]).retrieve_chunks(" ".join(res["keyword_extraction"]))
+
+    def kg_retrieve(res):
+        if not should_retrieve(res) or not prompt_config.get("use_kg"):
+            return None
+        return settings.kg_retrievaler.retrieval(" ".join(res["keyword_extraction"]), tenant_ids, dialog.kb_ids, embd_mdl, LLMBundle(dialog.tenant_id, LLMType.CHAT))
+
+    # Each stage starts as soon as the stages it depends on are done. A refinement stage which times
+    # out leaves its input as it was, web search and KG retrieval contribute nothing, and a retrieval
+    # timeout fails the chat rather than answering without the knowledge base.
+    refinement_stages = ["multiturn_refinement", "cross_languages", "load_metadata", "metadata_filter", "keyword_extraction"]
+    stage_results, stage_timings = run_stages(
+        {
+            "multiturn_refinement": ([], refine_multiturn, lambda res: questions[-1:]),
+            "cross_languages": (["multiturn_refinement"], translate, lambda res: res["multiturn_refinement"]),
+            "load_metadata": ([], load_metadata, lambda res: {}),
+            "metadata_filter": (["load_metadata", "cross_languages"], filter_by_metadata, lambda res: attachments),
+            "keyword_extraction": (["cross_languages"], extract_keywords, lambda res: res["cross_languages"]),
+            "retrieval": (["metadata_filter", "keyword_extraction"], retrieve, None),
+            "web_search": (["metadata_filter", "keyword_extraction"], web_search, lambda res: None),
+            "kg_retrieval": (["metadata_filter", "keyword_extraction"], kg_retrieve, lambda res: None),
+        }
+    )
+    questions = stage_results["keyword_extraction"]
+    attachments = stage_results["metadata_filter"]
+    refine_question_ts = max([stage_timings[nm][1] for nm in refinement_stages])
 
     thought = ""
     kbinfos = {"total": 0, "chunks": [], "doc_aggs": []}
     knowledges = []
 
-    if attachments is not None and "knowledge" in [p["key"] for p in prompt_config["parameters"]]:
-        tenant_ids = list(set([kb.tenant_id for kb in kbs]))
+    if attachments is not None and use_knowledge:
         knowledges = []
-        if prompt_config.get("reasoning", False):
+        if reasoning:
             reasoner = DeepResearcher(
                 chat_mdl,
                 prompt_config,
@@ -434,31 +537,15 @@ def chat(dialog, messages, stream=True, **kwargs):
                 elif stream:
                     yield think
         else:
-            if embd_mdl:
-                kbinfos = retriever.retrieval(
-                    " ".join(questions),
-                    embd_mdl,
-                    tenant_ids,
-                    dialog.kb_ids,
-                    1,
-                    dialog.top_n,
-                    dialog.similarity_threshold,
-                    dialog.vector_similarity_weight,
-                    doc_ids=attachments,
-                    top=dialog.top_k,
-                    aggs=False,
-                    rerank_mdl=rerank_mdl,
-                    rank_feature=label_question(" ".join(questions), kbs),
-                )
-            if prompt_config.get("tavily_api_key"):
-                tav = Tavily(prompt_config["tavily_api_key"])
-                tav_res = tav.retrieve_chunks(" ".join(questions))
+            if stage_results["retrieval"]:
+                kbinfos = stage_results["retrieval"]
+            tav_res = stage_results["web_search"]
+            if tav_res:
                 kbinfos["chunks"].extend(tav_res["chunks"])
                 kbinfos["doc_aggs"].extend(tav_res["doc_aggs"])
-            if prompt_config.get("use_kg"):
-                ck = settings.kg_retrievaler.retrieval(" ".join(questions), tenant_ids, dialog.kb_ids, embd_mdl, LLMBundle(dialog.tenant_id, LLMType.CHAT))
-                if ck["content_with_weight"]:
-                    kbinfos["chunks"].insert(0, ck)
+            ck = stage_results["kg_retrieval"]
+            if ck and ck["content_with_weight"]:
+                kbinfos["chunks"].insert(0, ck)
 
             knowledges = kb_prompt(kbinfos, max_tokens)
 
@@ -536,6 +623,11 @@ def chat(dialog, messages, stream=True, **kwargs):
         refine_question_time_cost = (refine_question_ts - bind_models_ts) * 1000
         retrieval_time_cost = (retrieval_ts - refine_question_ts) * 1000
         generate_result_time_cost = (finish_chat_ts - retrieval_ts) * 1000
+        stage_time_costs = {
+            nm: f"    - {nm.replace('_', ' ').capitalize()}: {(ed - st) * 1000:.1f}ms\n" for nm, (st, ed) in stage_timings.items() if ed - st > 0.0001
+        }
+        refinement_time_costs = "".join(cost for nm, cost in stage_time_costs.items() if nm in refinement_stages)
+        retrieval_stage_time_costs = "".join(cost for nm, cost in stage_time_costs.items() if nm not in refinement_stages)
 
         tk_num = num_tokens_from_string(think + answer)
         prompt += "\n\n### Query:\n%s" % " ".join(questions)
@@ -547,7 +639,9 @@ def chat(dialog, messages, stream=True, **kwargs):
             f"  - Check Langfuse tracer: {check_langfuse_tracer_cost:.1f}ms\n"
             f"  - Bind models: {bind_embedding_time_cost:.1f}ms\n"
             f"  - Query refinement(LLM): {refine_question_time_cost:.1f}ms\n"
+            f"{refinement_time_costs}"
             f"  - Retrieval: {retrieval_time_cost:.1f}ms\n"
+            f"{retrieval_stage_time_costs}"
             f"  - Generate answer: {generate_result_time_cost:.1f}ms\n\n"
             "## Token usage:\n"
             f"  - Generated tokens(approximately): {tk_num}\n"
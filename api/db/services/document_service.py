@@ -15,6 +15,7 @@
 #
 import json
 import logging
+import os
 import random
 import re
 from concurrent.futures import ThreadPoolExecutor
@@ -33,13 +34,16 @@ from api.db.db_models import DB, Document, Knowledgebase, Task, Tenant, UserTena
 from api.db.db_utils import bulk_insert_into_db
 from api.db.services.common_service import CommonService
 from api.db.services.knowledgebase_service import KnowledgebaseService
-from api.utils import current_timestamp, get_format_time, get_uuid
+from api.utils import current_timestamp, datetime_format, get_format_time, get_uuid
 from rag.nlp import rag_tokenizer, search
 from rag.settings import get_svr_queue_name, SVR_CONSUMER_GROUP_NAME
 from rag.utils.redis_conn import REDIS_CONN
+from rag.utils.retrieval_cache import bump_kb_generation
 from rag.utils.storage_factory import STORAGE_IMPL
 from rag.utils.doc_store_conn import OrderByExpr
 
+PROGRESS_BATCH_SIZE = int(os.environ.get("PROGRESS_BATCH_SIZE", 500))
+
 
 class DocumentService(CommonService):
     model = Document
@@ -263,11 +267,16 @@ class DocumentService(CommonService):
                 if STORAGE_IMPL.obj_exist(doc.kb_id, doc.thumbnail):
                     STORAGE_IMPL.rm(doc.kb_id, doc.thumbnail)
             settings.docStoreConn.delete({"doc_id": doc.id}, search.index_name(tenant_id), doc.kb_id)
+            bump_kb_generation(doc.kb_id)
 
             graph_source = settings.docStoreConn.getFields(
                 settings.docStoreConn.search(["source_id"], [], {"kb_id": doc.kb_id, "knowledge_graph_kwd": ["graph"]}, [], OrderByExpr(), 0, 1, search.index_name(tenant_id), [doc.kb_id]), ["source_id"]
             )
             if len(graph_source) > 0 and doc.id in list(graph_source.values())[0]["source_id"]:
+                # Only the graph partitions holding the document's nodes or edges are dropped; the next
+                # merge writes them back from the rebuilt graph.
+                settings.docStoreConn.delete({"kb_id": doc.kb_id, "knowledge_graph_kwd": ["graph_part"], "source_id": doc.id},
+                                             search.index_name(tenant_id), doc.kb_id)
                 settings.docStoreConn.update({"kb_id": doc.kb_id, "knowledge_graph_kwd": ["entity", "relation", "graph", "subgraph", "community_report"], "source_id": doc.id},
                                              {"remove": {"source_id": doc.id}},
                                              search.index_name(tenant_id), doc.kb_id)
@@ -597,9 +606,25 @@ class DocumentService(CommonService):
     @DB.connection_context()
     def update_progress(cls):
         docs = cls.get_unfinished_docs()
+        tasks_by_doc = {}
+        for i in range(0, len(docs), PROGRESS_BATCH_SIZE):
+            doc_ids = [d["id"] for d in docs[i:i + PROGRESS_BATCH_SIZE]]
+            tsks = Task.select(Task.doc_id, Task.progress, Task.progress_msg, Task.task_type, Task.priority) \
+                .where(Task.doc_id.in_(doc_ids)).order_by(Task.create_time)
+            for t in tsks:
+                tasks_by_doc.setdefault(t.doc_id, []).append(t)
+
+        queue_lengths = {}
+
+        def queue_length(priority):
+            if priority not in queue_lengths:
+                queue_lengths[priority] = get_queue_length(priority)
+            return queue_lengths[priority]
+
+        updates = []
         for d in docs:
             try:
-                tsks = Task.query(doc_id=d["id"], order_by=Task.create_time)
+                tsks = tasks_by_doc.get(d["id"])
                 if not tsks:
                     continue
                 msg = []
@@ -608,8 +633,7 @@ class DocumentService(CommonService):
                 bad = 0
                 has_raptor = False
                 has_graphrag = False
-                e, doc = DocumentService.get_by_id(d["id"])
-                status = doc.run  # TaskStatus.RUNNING.value
+                status = d["run"]  # TaskStatus.RUNNING.value
                 priority = 0
                 for t in tsks:
                     if 0 <= t.progress < 1:
@@ -640,6 +664,7 @@ class DocumentService(CommonService):
 
                 msg = "\n".join(sorted(msg))
                 info = {
+                    "id": d["id"],
                     "process_duration": datetime.timestamp(
                         datetime.now()) -
                                        d["process_begin_at"].timestamp(),
@@ -649,14 +674,48 @@ class DocumentService(CommonService):
                 if msg:
                     info["progress_msg"] = msg
                     if msg.endswith("created task graphrag") or msg.endswith("created task raptor"):
-                        info["progress_msg"] += "\n%d tasks are ahead in the queue..."%get_queue_length(priority)
+                        info["progress_msg"] += "\n%d tasks are ahead in the queue..."%queue_length(priority)
                 else:
-                    info["progress_msg"] = "%d tasks are ahead in the queue..."%get_queue_length(priority)
-                cls.update_by_id(d["id"], info)
+                    info["progress_msg"] = "%d tasks are ahead in the queue..."%queue_length(priority)
+                updates.append(info)
             except Exception as e:
                 if str(e).find("'0'") < 0:
                     logging.exception("fetch task exception")
 
+        # Documents are updated in bulk, grouped by the set of fields that changed. `run` was
+        # read before the loop, so each batch is re-read (and locked) right before writing and
+        # documents cancelled or stopped meanwhile are skipped instead of being set back to RUNNING.
+        # A failing batch is retried one document at a time so one bad row only loses itself.
+        run_read = {d["id"]: d["run"] for d in docs}
+        groups = {}
+        for info in updates:
+            groups.setdefault(tuple(sorted(info.keys())), []).append(info)
+        for keys, infos in groups.items():
+            fields = [getattr(cls.model, k) for k in keys if k != "id"] + [cls.model.update_time, cls.model.update_date]
+            for i in range(0, len(infos), PROGRESS_BATCH_SIZE):
+                batch = infos[i:i + PROGRESS_BATCH_SIZE]
+                for info in batch:
+                    info["update_time"] = current_timestamp()
+                    info["update_date"] = datetime_format(datetime.now())
+                try:
+                    with DB.atomic():
+                        current = dict(cls.model.select(cls.model.id, cls.model.run)
+                                       .where(cls.model.id.in_([info["id"] for info in batch])).for_update().tuples())
+                        rows = []
+                        for info in batch:
+                            if current.get(info["id"]) == run_read[info["id"]]:
+                                rows.append(cls.model(**info))
+                        if rows:
+                            cls.model.bulk_update(rows, fields=fields)
+                except Exception:
+                    logging.exception("bulk update document progress exception, updating one by one")
+                    for info in batch:
+                        try:
+                            cls.model.update({k: v for k, v in info.items() if k != "id"}).where(
+                                cls.model.id == info["id"], cls.model.run == run_read[info["id"]]).execute()
+                        except Exception:
+                            logging.exception("update document progress exception")
+
     @classmethod
     @DB.connection_context()
     def get_kb_doc_count(cls, kb_id):
@@ -842,6 +901,7 @@ def doc_upload_and_parse(conversation_id, file_objs, user_id):
                     settings.docStoreConn.createIdx(idxnm, kb_id, len(vects[0]))
                 try_create_idx = False
             settings.docStoreConn.insert(cks[b:b + es_bulk_size], idxnm, kb_id)
+        bump_kb_generation(kb_id)
 
         DocumentService.increment_chunk_num(
             doc_id, kb.id, token_counts[doc_id], chunk_counts[doc_id], 0)
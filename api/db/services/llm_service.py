@@ -18,9 +18,13 @@ import logging
 import re
 from functools import partial
 from typing import Generator
+
+import trio
+
 from api.db.db_models import LLM
 from api.db.services.common_service import CommonService
 from api.db.services.tenant_llm_service import LLM4Tenant, TenantLLMService
+from rag.llm.chat_model import chat_in_thread, stream_in_thread
 
 
 class LLMService(CommonService):
@@ -233,6 +237,9 @@ class LLMBundle(LLM4Tenant):
             
         use_kwargs = self._clean_param(chat_partial, **kwargs)
         txt, used_tokens = chat_partial(**use_kwargs)
+        return self._finish_chat(txt, used_tokens, generation if self.langfuse else None)
+
+    def _finish_chat(self, txt, used_tokens, generation=None):
         txt = self._remove_reasoning_content(txt)
 
         if not self.verbose_tool_use:
@@ -241,12 +248,30 @@ class LLMBundle(LLM4Tenant):
         if isinstance(txt, int) and not TenantLLMService.increase_usage(self.tenant_id, self.llm_type, used_tokens, self.llm_name):
             logging.error("LLMBundle.chat can't update token usage for {}/CHAT llm_name: {}, used_tokens: {}".format(self.tenant_id, self.llm_name, used_tokens))
 
-        if self.langfuse:
+        if generation:
             generation.update(output={"output": txt}, usage_details={"total_tokens": used_tokens})
             generation.end()
 
         return txt
 
+    async def async_chat(self, system: str, history: list, gen_conf: dict = {}, **kwargs) -> str:
+        """Like `chat`, but awaits the model's native async client instead of blocking a thread."""
+        generation = None
+        if self.langfuse:
+            generation = self.langfuse.start_generation(trace_context=self.trace_context, name="chat", model=self.llm_name, input={"system": system, "history": history})
+
+        if self.is_tools and self.mdl.is_tools:
+            chat_partial = partial(self.mdl.chat_with_tools, system, history, gen_conf)
+            use_kwargs = self._clean_param(chat_partial, **kwargs)
+            txt, used_tokens = await trio.to_thread.run_sync(lambda: chat_partial(**use_kwargs))
+        elif hasattr(self.mdl, "async_chat"):
+            txt, used_tokens = await self.mdl.async_chat(system, history, gen_conf, **kwargs)
+        else:
+            chat_partial = partial(self.mdl.chat, system, history, gen_conf)
+            use_kwargs = self._clean_param(chat_partial, **kwargs)
+            txt, used_tokens = await chat_in_thread(self.mdl, system, history, gen_conf, **use_kwargs)
+        return self._finish_chat(txt, used_tokens, generation)
+
     def chat_streamly(self, system: str, history: list, gen_conf: dict = {}, **kwargs):
         if self.langfuse:
             generation = self.langfuse.start_generation(trace_context=self.trace_context, name="chat_streamly", model=self.llm_name, input={"system": system, "history": history})
@@ -277,3 +302,39 @@ class LLMBundle(LLM4Tenant):
         if total_tokens > 0:
             if not TenantLLMService.increase_usage(self.tenant_id, self.llm_type, txt, self.llm_name):
                 logging.error("LLMBundle.chat_streamly can't update token usage for {}/CHAT llm_name: {}, content: {}".format(self.tenant_id, self.llm_name, txt))
+
+    async def async_chat_streamly(self, system: str, history: list, gen_conf: dict = {}, **kwargs):
+        """Like `chat_streamly`, as an async generator yielding the accumulated answer."""
+        if self.langfuse:
+            generation = self.langfuse.start_generation(trace_context=self.trace_context, name="chat_streamly", model=self.llm_name, input={"system": system, "history": history})
+
+        ans = ""
+        total_tokens = 0
+        if self.is_tools and self.mdl.is_tools:
+            chat_partial = partial(self.mdl.chat_streamly_with_tools, system, history, gen_conf)
+            stream = stream_in_thread(self.mdl, chat_partial(**self._clean_param(chat_partial, **kwargs)))
+        elif hasattr(self.mdl, "async_chat_streamly"):
+            stream = self.mdl.async_chat_streamly(system, history, gen_conf, **kwargs)
+        else:
+            chat_partial = partial(self.mdl.chat_streamly, system, history, gen_conf)
+            stream = stream_in_thread(self.mdl, chat_partial(**self._clean_param(chat_partial, **kwargs)))
+        async for txt in stream:
+            if isinstance(txt, int):
+                total_tokens = txt
+                if self.langfuse:
+                    generation.update(output={"output": ans})
+                    generation.end()
+                break
+
+            if txt.endswith("</think>"):
+                ans = ans.rstrip("</think>")
+
+            if not self.verbose_tool_use:
+                txt = re.sub(r"<tool_call>.*?</tool_call>", "", txt, flags=re.DOTALL)
+
+            ans += txt
+            yield ans
+
+        if total_tokens > 0:
+            if not TenantLLMService.increase_usage(self.tenant_id, self.llm_type, txt, self.llm_name):
+                logging.error("LLMBundle.async_chat_streamly can't update token usage for {}/CHAT llm_name: {}, content: {}".format(self.tenant_id, self.llm_name, txt))
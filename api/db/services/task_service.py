@@ -32,6 +32,7 @@ from deepdoc.parser.excel_parser import RAGFlowExcelParser
 from rag.settings import get_svr_queue_name
 from rag.utils.storage_factory import STORAGE_IMPL
 from rag.utils.redis_conn import REDIS_CONN
+from rag.utils.retrieval_cache import bump_kb_generation
 from api import settings
 from rag.nlp import search
 
@@ -396,6 +397,7 @@ def queue_tasks(doc: dict, bucket: str, name: str, priority: int):
         if pre_chunk_ids:
             settings.docStoreConn.delete({"id": pre_chunk_ids}, search.index_name(chunking_config["tenant_id"]),
                                          chunking_config["kb_id"])
+            bump_kb_generation(chunking_config["kb_id"])
     DocumentService.update_by_id(doc["id"], {"chunk_num": ck_num})
 
     bulk_insert_into_db(Task, parse_task_array, True)
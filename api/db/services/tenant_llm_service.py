@@ -13,7 +13,15 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import atexit
+import copy
+import json
 import logging
+import os
+import threading
+import time
+
+from cachetools import TTLCache
 from langfuse import Langfuse
 from api import settings
 from api.db import LLMType
@@ -22,6 +30,94 @@ from api.db.services.common_service import CommonService
 from api.db.services.langfuse_service import TenantLangfuseService
 from api.db.services.user_service import TenantService
 from rag.llm import ChatModel, CvModel, EmbeddingModel, RerankModel, Seq2txtModel, TTSModel
+from rag.utils.redis_conn import REDIS_CONN, RedisDistributedLock
+
+LLM_CACHE_SIZE = int(os.environ.get("LLM_CACHE_SIZE", 1024))
+LLM_CACHE_TTL = int(os.environ.get("LLM_CACHE_TTL", 600))
+
+# Resolved model configs, model instances and Langfuse keys are cached in process under the
+# generation of the tenant's LLM settings. Writers call `bump_tenant_llm_generation` whenever a
+# tenant's models, default models or Langfuse keys change.
+_LLM_CACHE = TTLCache(maxsize=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL)
+_LANGFUSE_CLIENTS = TTLCache(maxsize=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL)
+_LLM_CACHE_LOCK = threading.Lock()
+
+# Token usage is staged in a Redis hash with HINCRBY, one field per (tenant, model, factory), and
+# added to tenant_llm.used_tokens in batches every LLM_USAGE_FLUSH_INTERVAL seconds and at exit.
+# A flush first renames the hash, so increments staged meanwhile go to a fresh one. Each field is
+# read, added to tenant_llm, and only subtracted from the hash once that update is committed, so a
+# failed update stays staged for the next flush. A flush which dies between the update and the
+# subtraction makes the next one apply that field again: usage may be counted twice, never lost.
+LLM_USAGE_FLUSH_INTERVAL = float(os.environ.get("LLM_USAGE_FLUSH_INTERVAL", 10))
+LLM_USAGE_KEY = "llm_usage"
+LLM_USAGE_FLUSHING_KEY = "llm_usage:flushing"
+_usage_flusher = None
+_usage_flusher_lock = threading.Lock()
+
+
+def tenant_llm_generation_key(tenant_id: str) -> str:
+    return f"tenant_llm_generation:{tenant_id}"
+
+
+def bump_tenant_llm_generation(tenant_id: str):
+    REDIS_CONN.incr(tenant_llm_generation_key(tenant_id))
+
+
+def cached_tenant_llm_lookup(key: tuple, tenant_id: str, func):
+    """
+    Return `func()`, cached under `key` and the tenant's LLM settings generation.
+    Nothing is cached when the generation can not be read, nor when `func` returns None.
+    """
+    gens = REDIS_CONN.mget([tenant_llm_generation_key(tenant_id)])
+    if gens is None:
+        return func()
+    key = key + (int(gens[0]) if gens[0] else 0,)
+    with _LLM_CACHE_LOCK:
+        if key in _LLM_CACHE:
+            return _LLM_CACHE[key]
+    res = func()
+    if res is not None:
+        with _LLM_CACHE_LOCK:
+            _LLM_CACHE[key] = res
+    return res
+
+
+def _flush_usage_periodically():
+    while True:
+        time.sleep(LLM_USAGE_FLUSH_INTERVAL)
+        try:
+            TenantLLMService.flush_usage()
+        except Exception:
+            logging.exception("TenantLLMService.flush_usage got exception")
+
+
+def start_usage_flusher():
+    global _usage_flusher
+    if _usage_flusher is not None:
+        return
+    with _usage_flusher_lock:
+        if _usage_flusher is not None:
+            return
+        _usage_flusher = threading.Thread(target=_flush_usage_periodically, name="llm_usage_flusher", daemon=True)
+        _usage_flusher.start()
+        atexit.register(TenantLLMService.flush_usage)
+
+
+def get_langfuse_tracer(tenant_id: str):
+    """Return the tenant's Langfuse client if its keys are set and pass `auth_check`, otherwise None."""
+    langfuse_keys = cached_tenant_llm_lookup(("langfuse", tenant_id), tenant_id, lambda: TenantLangfuseService.filter_by_tenant(tenant_id=tenant_id))
+    if not langfuse_keys:
+        return None
+    key = (langfuse_keys.public_key, langfuse_keys.secret_key, langfuse_keys.host)
+    with _LLM_CACHE_LOCK:
+        if key in _LANGFUSE_CLIENTS:
+            return _LANGFUSE_CLIENTS[key] or None
+    langfuse = Langfuse(public_key=langfuse_keys.public_key, secret_key=langfuse_keys.secret_key, host=langfuse_keys.host)
+    if not langfuse.auth_check():
+        langfuse = False
+    with _LLM_CACHE_LOCK:
+        _LANGFUSE_CLIENTS[key] = langfuse
+    return langfuse or None
 
 
 class LLMFactoriesService(CommonService):
@@ -82,8 +178,14 @@ class TenantLLMService(CommonService):
         return model_name, None
 
     @classmethod
-    @DB.connection_context()
     def get_model_config(cls, tenant_id, llm_type, llm_name=None):
+        model_config = cached_tenant_llm_lookup(("config", tenant_id, llm_type, llm_name), tenant_id,
+                                                lambda: cls._get_model_config(tenant_id, llm_type, llm_name))
+        return dict(model_config)
+
+    @classmethod
+    @DB.connection_context()
+    def _get_model_config(cls, tenant_id, llm_type, llm_name=None):
         from api.db.services.llm_service import LLMService
         e, tenant = TenantService.get_by_id(tenant_id)
         if not e:
@@ -130,8 +232,16 @@ class TenantLLMService(CommonService):
         return model_config
 
     @classmethod
-    @DB.connection_context()
     def model_instance(cls, tenant_id, llm_type, llm_name=None, lang="Chinese", **kwargs):
+        # Bundles get a shallow copy, so they share the SDK client but binding tools to one
+        # does not leak into the others.
+        key = ("instance", tenant_id, llm_type, llm_name, lang, json.dumps(kwargs, sort_keys=True, default=str))
+        mdl = cached_tenant_llm_lookup(key, tenant_id, lambda: cls._model_instance(tenant_id, llm_type, llm_name, lang=lang, **kwargs))
+        return copy.copy(mdl) if mdl else mdl
+
+    @classmethod
+    @DB.connection_context()
+    def _model_instance(cls, tenant_id, llm_type, llm_name=None, lang="Chinese", **kwargs):
         model_config = TenantLLMService.get_model_config(tenant_id, llm_type, llm_name)
         kwargs.update({"provider": model_config["llm_factory"]})
         if llm_type == LLMType.EMBEDDING.value:
@@ -168,10 +278,9 @@ class TenantLLMService(CommonService):
             )
 
     @classmethod
-    @DB.connection_context()
     def increase_usage(cls, tenant_id, llm_type, used_tokens, llm_name=None):
-        e, tenant = TenantService.get_by_id(tenant_id)
-        if not e:
+        tenant = cached_tenant_llm_lookup(("tenant", tenant_id), tenant_id, lambda: TenantService.get_by_id(tenant_id)[1])
+        if not tenant:
             logging.error(f"Tenant not found: {tenant_id}")
             return 0
 
@@ -190,7 +299,24 @@ class TenantLLMService(CommonService):
             return 0
 
         llm_name, llm_factory = TenantLLMService.split_model_name_and_factory(mdlnm)
+        if not cached_tenant_llm_lookup(("usage", tenant_id, llm_name, llm_factory), tenant_id, lambda: cls.has_model(tenant_id, llm_name, llm_factory) or None):
+            return 0
+        if not used_tokens:
+            return 1
+
+        if REDIS_CONN.hincrby(LLM_USAGE_KEY, json.dumps([tenant_id, llm_name, llm_factory]), int(used_tokens)) is not None:
+            start_usage_flusher()
+            return 1
+        return cls.add_used_tokens(tenant_id, llm_name, llm_factory, used_tokens)
+
+    @classmethod
+    @DB.connection_context()
+    def has_model(cls, tenant_id, llm_name, llm_factory):
+        return cls.model.select().where(cls.model.tenant_id == tenant_id, cls.model.llm_name == llm_name, cls.model.llm_factory == llm_factory if llm_factory else True).exists()
 
+    @classmethod
+    @DB.connection_context()
+    def add_used_tokens(cls, tenant_id, llm_name, llm_factory, used_tokens, raise_error=False):
         try:
             num = (
                 cls.model.update(used_tokens=cls.model.used_tokens + used_tokens)
@@ -199,10 +325,52 @@ class TenantLLMService(CommonService):
             )
         except Exception:
             logging.exception("TenantLLMService.increase_usage got exception,Failed to update used_tokens for tenant_id=%s, llm_name=%s", tenant_id, llm_name)
+            if raise_error:
+                raise
             return 0
 
         return num
 
+    @classmethod
+    def flush_usage(cls):
+        """Add the token usage staged in Redis to tenant_llm. Return the number of models updated."""
+        if not REDIS_CONN.is_alive():
+            return 0
+        lock = RedisDistributedLock("llm_usage_flush_lock", timeout=60)
+        if not lock.acquire():
+            return 0
+        try:
+            if not REDIS_CONN.exist(LLM_USAGE_FLUSHING_KEY):
+                if not REDIS_CONN.exist(LLM_USAGE_KEY) or not REDIS_CONN.rename(LLM_USAGE_KEY, LLM_USAGE_FLUSHING_KEY):
+                    return 0
+            fields = list(REDIS_CONN.hgetall(LLM_USAGE_FLUSHING_KEY) or {})
+            extended = time.time()
+            for field in fields:
+                if time.time() - extended > lock.timeout / 3:
+                    if not lock.extend():
+                        logging.warning("TenantLLMService.flush_usage lost its lock, leaving the rest to the next flush")
+                        break
+                    extended = time.time()
+                used_tokens = REDIS_CONN.hget(LLM_USAGE_FLUSHING_KEY, field)
+                if used_tokens is None:
+                    continue
+                used_tokens = int(used_tokens)
+                if used_tokens:
+                    tenant_id, llm_name, llm_factory = json.loads(field)
+                    try:
+                        cls.add_used_tokens(tenant_id, llm_name, llm_factory, used_tokens, raise_error=True)
+                    except Exception:
+                        continue
+                left = REDIS_CONN.hincrby(LLM_USAGE_FLUSHING_KEY, field, -used_tokens)
+                if left is None:
+                    logging.error(f"TenantLLMService.flush_usage applied {used_tokens} tokens of {field} but could not unstage them")
+                elif left == 0:
+                    # An empty hash is removed, so the next flush can take the live one.
+                    REDIS_CONN.hdel(LLM_USAGE_FLUSHING_KEY, field)
+            return len(fields)
+        finally:
+            lock.release()
+
     @classmethod
     @DB.connection_context()
     def get_openai_models(cls):
@@ -242,11 +410,7 @@ class LLM4Tenant:
         self.is_tools = model_config.get("is_tools", False)
         self.verbose_tool_use = kwargs.get("verbose_tool_use")
 
-        langfuse_keys = TenantLangfuseService.filter_by_tenant(tenant_id=tenant_id)
-        self.langfuse = None
-        if langfuse_keys:
-            langfuse = Langfuse(public_key=langfuse_keys.public_key, secret_key=langfuse_keys.secret_key, host=langfuse_keys.host)
-            if langfuse.auth_check():
-                self.langfuse = langfuse
-                trace_id = self.langfuse.create_trace_id()
-                self.trace_context = {"trace_id": trace_id}
\ No newline at end of file
+        self.langfuse = get_langfuse_tracer(tenant_id)
+        if self.langfuse:
+            trace_id = self.langfuse.create_trace_id()
+            self.trace_context = {"trace_id": trace_id}
\ No newline at end of file
@@ -15,11 +15,14 @@
 #
 
 import logging
+import multiprocessing
 import os
 import random
 import re
 import sys
+import tempfile
 import threading
+from concurrent.futures import ProcessPoolExecutor
 from copy import deepcopy
 from io import BytesIO
 from timeit import default_timer as timer
@@ -44,6 +47,57 @@ LOCK_KEY_pdfplumber = "global_shared_lock_pdfplumber"
 if LOCK_KEY_pdfplumber not in sys.modules:
     sys.modules[LOCK_KEY_pdfplumber] = threading.Lock()
 
+# Pages are rendered in worker processes, each opening the PDF itself, so no global lock is
+# held and OCR starts on the first pages while later ones are still being rendered.
+# 0 renders in process under LOCK_KEY_pdfplumber as before.
+PDF_RENDER_WORKERS = int(os.environ.get("PDF_RENDER_WORKERS", min(4, os.cpu_count() or 1)))
+PDF_RENDER_PAGES_PER_TASK = int(os.environ.get("PDF_RENDER_PAGES_PER_TASK", 4))
+# Text detection runs once for this many consecutive pages instead of once per page.
+OCR_BATCH_PAGES = int(os.environ.get("OCR_BATCH_PAGES", 4))
+# Born-digital pages whose text layer is clean and covers nearly all the ink of the page image
+# get their boxes straight from the PDF chars, without running OCR.
+PDF_TEXT_LAYER_FAST_PATH = os.environ.get("PDF_TEXT_LAYER_FAST_PATH", "true").lower() in ["true", "1", "yes"]
+PDF_TEXT_LAYER_MIN_CHARS = int(os.environ.get("PDF_TEXT_LAYER_MIN_CHARS", 20))
+PDF_TEXT_LAYER_MIN_COVERAGE = float(os.environ.get("PDF_TEXT_LAYER_MIN_COVERAGE", 0.85))
+PDF_TEXT_LAYER_MAX_GARBLED = float(os.environ.get("PDF_TEXT_LAYER_MAX_GARBLED", 0.02))
+
+_render_pool = None
+_render_pool_lock = threading.Lock()
+
+
+def _get_render_pool() -> ProcessPoolExecutor:
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            _render_pool = ProcessPoolExecutor(max_workers=PDF_RENDER_WORKERS, mp_context=ctx)
+        return _render_pool
+
+
+def _plain(v):
+    # pdfminer may leave PSLiteral/PDFObjRef values in char dicts, which can't cross processes.
+    if v is None or isinstance(v, (str, int, float, bool)):
+        return v
+    if isinstance(v, (tuple, list)):
+        return type(v)(_plain(x) for x in v)
+    return str(v)
+
+
+def _extract_page_chars(fnm, page_from, page_to):
+    with pdfplumber.open(fnm) as pdf:
+        pages = pdf.pages[page_from:page_to]
+        try:
+            return [[{k: _plain(v) for k, v in c.items()} for c in page.dedupe_chars().chars] for page in pages]
+        except Exception as e:
+            logging.warning(f"Failed to extract characters for pages {page_from}-{page_to}: {str(e)}")
+            return [[] for _ in pages]
+
+
+def _render_pages(fnm, page_from, page_to, zoomin):
+    with pdfplumber.open(fnm) as pdf:
+        return [p.to_image(resolution=72 * zoomin, antialias=True).annotated for p in pdf.pages[page_from:page_to]]
+
 
 class RAGFlowPdfParser:
     def __init__(self, **kwargs):
@@ -94,6 +148,13 @@ class RAGFlowPdfParser:
 
         self.page_from = 0
         self.column_num = 1
+        self.timings = {}
+        self.page_paths = {"text_layer": 0, "ocr": 0}
+        self._timings_lock = threading.Lock()
+
+    def _add_timing(self, stage, elapse):
+        with self._timings_lock:
+            self.timings[stage] = self.timings.get(stage, 0) + elapse
 
     def __char_width(self, c):
         return (c["x1"] - c["x0"]) // max(len(c["text"]), 1)
@@ -228,7 +289,9 @@ class RAGFlowPdfParser:
         assert len(self.page_images) == len(tbcnt) - 1
         if not imgs:
             return
+        start = timer()
         recos = self.tbl_det(imgs)
+        self._add_timing("table_structure", timer() - start)
         tbcnt = np.cumsum(tbcnt)
         for i in range(len(tbcnt) - 1):  # for page
             pg = []
@@ -294,10 +357,108 @@ class RAGFlowPdfParser:
                 b["H_right"] = spans[ii]["x1"]
                 b["SP"] = ii
 
-    def __ocr(self, pagenum, img, chars, ZM=3, device_id: int | None = None):
+    @staticmethod
+    def _add_char_spaces(chars):
+        j = 0
+        while j + 1 < len(chars):
+            if chars[j]["text"] and chars[j + 1]["text"] \
+                    and re.match(r"[0-9a-zA-Z,.:;!%]+", chars[j]["text"] + chars[j + 1]["text"]) \
+                    and chars[j + 1]["x0"] - chars[j]["x1"] >= min(chars[j + 1]["width"],
+                                                                   chars[j]["width"]) / 2:
+                chars[j]["text"] += " "
+            j += 1
+
+    @staticmethod
+    def _text_layer_quality(img, chars, ZM=3):
+        """
+        Return (ratio of garbled chars, ratio of the page image's ink covered by chars).
+        """
+        if not chars:
+            return 1., 0.
+        garbled = sum(1 for c in chars if re.search(r"\(cid *: *[0-9]+ *\)|[\ufffd\ue000-\uf8ff]", c["text"]))
+
+        ink = np.asarray(img.convert("L"))[::ZM, ::ZM] < 160
+        total = ink.sum()
+        if not total:
+            return garbled / len(chars), 1.
+        covered = np.zeros_like(ink)
+        h, w = ink.shape
+        for c in chars:
+            top, bott = max(0, int(c["top"]) - 1), min(h, int(np.ceil(c["bottom"])) + 1)
+            left, right = max(0, int(c["x0"]) - 1), min(w, int(np.ceil(c["x1"])) + 1)
+            covered[top:bott, left:right] = True
+        return garbled / len(chars), (ink & covered).sum() / total
+
+    def __is_text_layer_page(self, img, chars, ZM=3):
+        if not PDF_TEXT_LAYER_FAST_PATH or len(chars) < PDF_TEXT_LAYER_MIN_CHARS:
+            return False
+        garbled, coverage = self._text_layer_quality(img, chars, ZM)
+        return garbled <= PDF_TEXT_LAYER_MAX_GARBLED and coverage >= PDF_TEXT_LAYER_MIN_COVERAGE
+
+    def __text_layer(self, pagenum, chars):
+        """
+        Build line boxes from the chars of a clean born-digital page, as `__ocr` would from
+        detected boxes: chars on the same line and close to each other make one box.
+        """
         start = timer()
-        bxs = self.ocr.detect(np.array(img), device_id)
-        logging.info(f"__ocr detecting boxes of a image cost ({timer() - start}s)")
+        chars = [c for c in chars if c["text"]]
+        mh = np.median([c["height"] for c in chars]) if chars else 0
+        bxs = []
+        for c in Recognizer.sort_Y_firstly(chars, mh / 2):
+            b = bxs[-1] if bxs else None
+            if b and min(b["bottom"], c["bottom"]) - max(b["top"], c["top"]) > 0.5 * min(b["bottom"] - b["top"], c["height"]) \
+                    and -mh < c["x0"] - b["x1"] < 1.5 * mh:
+                b["x1"] = max(b["x1"], c["x1"])
+                b["top"] = min(b["top"], c["top"])
+                b["bottom"] = max(b["bottom"], c["bottom"])
+            else:
+                b = {"x0": c["x0"], "x1": c["x1"], "top": c["top"], "bottom": c["bottom"],
+                     "text": "", "page_number": pagenum}
+                bxs.append(b)
+            if c["text"] == " " and b["text"]:
+                if re.match(r"[0-9a-zA-Zа-яА-Я,.?;:!%%]", b["text"][-1]):
+                    b["text"] += " "
+            elif c["text"] != " ":
+                b["text"] += c["text"]
+
+        bxs = [b for b in bxs if b["text"].strip()]
+        if self.mean_height[pagenum-1] == 0 and bxs:
+            self.mean_height[pagenum-1] = np.median([b["bottom"] - b["top"] for b in bxs])
+        self.boxes.append(bxs)
+        self._add_timing("text_layer", timer() - start)
+
+    def __ocr_batch(self, pagenums, imgs, charss, ZM=3, device_id: int | None = None):
+        text_layer = []
+        for pagenum, img, chars in zip(pagenums, imgs, charss):
+            if not chars and self.page_chars[pagenum - 1]:
+                # English pages are OCRed without their chars, but can still take the fast path.
+                chars = deepcopy(self.page_chars[pagenum - 1])
+                self._add_char_spaces(chars)
+            text_layer.append(chars if self.__is_text_layer_page(img, chars, ZM) else None)
+        with self._timings_lock:
+            self.page_paths["text_layer"] += sum(1 for chars in text_layer if chars is not None)
+            self.page_paths["ocr"] += sum(1 for chars in text_layer if chars is None)
+
+        to_ocr = [img for img, chars in zip(imgs, text_layer) if chars is None]
+        detected = []
+        if to_ocr:
+            start = timer()
+            detected = self.ocr.detect_batch([np.array(img) for img in to_ocr], device_id)
+            self._add_timing("detect", timer() - start)
+            logging.info(f"__ocr detecting boxes of {len(to_ocr)} images cost ({timer() - start}s)")
+        detected = iter(detected)
+        for pagenum, img, chars, tl_chars in zip(pagenums, imgs, charss, text_layer):
+            if tl_chars is not None:
+                self.__text_layer(pagenum, tl_chars)
+            else:
+                self.__ocr(pagenum, img, chars, ZM, device_id, bxs=next(detected))
+
+    def __ocr(self, pagenum, img, chars, ZM=3, device_id: int | None = None, bxs=None):
+        if bxs is None:
+            start = timer()
+            bxs = self.ocr.detect(np.array(img), device_id)
+            self._add_timing("detect", timer() - start)
+            logging.info(f"__ocr detecting boxes of a image cost ({timer() - start}s)")
 
         start = timer()
         if not bxs:
@@ -339,6 +500,7 @@ class RAGFlowPdfParser:
                     b["text"] += c["text"]
             del b["chars"]
 
+        self._add_timing("merge_chars", timer() - start)
         logging.info(f"__ocr sorting {len(chars)} chars cost {timer() - start}s")
         start = timer()
         boxes_to_reg = []
@@ -354,6 +516,7 @@ class RAGFlowPdfParser:
         for i in range(len(boxes_to_reg)):
             boxes_to_reg[i]["text"] = texts[i]
             del boxes_to_reg[i]["box_image"]
+        self._add_timing("recognize", timer() - start)
         logging.info(f"__ocr recognize {len(bxs)} boxes cost {timer() - start}s")
         bxs = [b for b in bxs if b["text"]]
         if self.mean_height[pagenum-1] == 0:
@@ -363,8 +526,10 @@ class RAGFlowPdfParser:
 
     def _layouts_rec(self, ZM, drop=True):
         assert len(self.page_images) == len(self.boxes)
+        start = timer()
         self.boxes, self.page_layout = self.layouter(
             self.page_images, self.boxes, ZM, drop=drop)
+        self._add_timing("layout", timer() - start)
         # cumlative Y
         for i in range(len(self.boxes)):
             self.boxes[i]["top"] += \
@@ -1012,6 +1177,39 @@ class RAGFlowPdfParser:
         except Exception:
             logging.exception("total_page_number")
 
+    def __start_rendering(self, fnm, zoomin, page_from, page_to):
+        """
+        Queue char extraction of every page, then rendering of the first pages, on the render pool.
+        Chars are gathered here since the language guess needs all of them before OCR starts.
+        Return a generator of rendering futures in page order, which keeps at most two tasks per
+        worker queued ahead so rendered pages wait for OCR in bounded numbers.
+        """
+        self.total_page = self.total_page_number(fnm)
+        if self.total_page is None:
+            raise Exception(f"Can't open {fnm}")
+        groups = [(s, min(s + PDF_RENDER_PAGES_PER_TASK, page_to, self.total_page))
+                  for s in range(page_from, min(page_to, self.total_page), PDF_RENDER_PAGES_PER_TASK)]
+        pool = _get_render_pool()
+        self.page_images = []
+        char_futs = [pool.submit(_extract_page_chars, fnm, s, e) for s, e in groups]
+
+        window = PDF_RENDER_WORKERS * 2
+        futs = [pool.submit(_render_pages, fnm, s, e, zoomin) for s, e in groups[:window]]
+
+        def rendered():
+            try:
+                for k in range(len(groups)):
+                    if k + window < len(groups):
+                        s, e = groups[k + window]
+                        futs.append(pool.submit(_render_pages, fnm, s, e, zoomin))
+                    yield futs[k]
+            finally:
+                for fut in futs:
+                    fut.cancel()
+
+        self.page_chars = [[c for c in chars if self._has_color(c)] for fut in char_futs for chars in fut.result()]
+        return rendered()
+
     def __images__(self, fnm, zoomin=3, page_from=0,
                    page_to=299, callback=None):
         self.lefted_chars = []
@@ -1022,21 +1220,32 @@ class RAGFlowPdfParser:
         self.page_cum_height = [0]
         self.page_layout = []
         self.page_from = page_from
+        self.timings = {}
+        self.page_paths = {"text_layer": 0, "ocr": 0}
         start = timer()
+        rendered = None
+        tmp_fnm = None
         try:
-            with sys.modules[LOCK_KEY_pdfplumber]:
-                with (pdfplumber.open(fnm) if isinstance(fnm, str) else pdfplumber.open(BytesIO(fnm))) as pdf:
-                    self.pdf = pdf
-                    self.page_images = [p.to_image(resolution=72 * zoomin, antialias=True).annotated for i, p in
-                                        enumerate(self.pdf.pages[page_from:page_to])]
+            if PDF_RENDER_WORKERS > 0:
+                if not isinstance(fnm, str):
+                    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+                        f.write(fnm)
+                        tmp_fnm = f.name
+                rendered = self.__start_rendering(tmp_fnm or fnm, zoomin, page_from, page_to)
+            else:
+                with sys.modules[LOCK_KEY_pdfplumber]:
+                    with (pdfplumber.open(fnm) if isinstance(fnm, str) else pdfplumber.open(BytesIO(fnm))) as pdf:
+                        self.pdf = pdf
+                        self.page_images = [p.to_image(resolution=72 * zoomin, antialias=True).annotated for i, p in
+                                            enumerate(self.pdf.pages[page_from:page_to])]
 
-                    try:
-                        self.page_chars = [[c for c in page.dedupe_chars().chars if self._has_color(c)] for page in self.pdf.pages[page_from:page_to]]
-                    except Exception as e:
-                        logging.warning(f"Failed to extract characters for pages {page_from}-{page_to}: {str(e)}")
-                        self.page_chars = [[] for _ in range(page_to - page_from)]  # If failed to extract, using empty list instead.
+                        try:
+                            self.page_chars = [[c for c in page.dedupe_chars().chars if self._has_color(c)] for page in self.pdf.pages[page_from:page_to]]
+                        except Exception as e:
+                            logging.warning(f"Failed to extract characters for pages {page_from}-{page_to}: {str(e)}")
+                            self.page_chars = [[] for _ in range(page_to - page_from)]  # If failed to extract, using empty list instead.
 
-                    self.total_page = len(self.pdf.pages)
+                        self.total_page = len(self.pdf.pages)
 
         except Exception:
             logging.exception("RAGFlowPdfParser __images__")
@@ -1069,29 +1278,36 @@ class RAGFlowPdfParser:
             random.choices([c["text"] for c in self.page_chars[i]], k=min(100, len(self.page_chars[i]))))) for i in
             range(len(self.page_chars))]
         if sum([1 if e else 0 for e in self.is_english]) > len(
-                self.page_images) / 2:
+                self.page_chars) / 2:
             self.is_english = True
         else:
             self.is_english = False
 
-        async def __img_ocr(i, id, img, chars, limiter):
-            j = 0
-            while j + 1 < len(chars):
-                if chars[j]["text"] and chars[j + 1]["text"] \
-                        and re.match(r"[0-9a-zA-Z,.:;!%]+", chars[j]["text"] + chars[j + 1]["text"]) \
-                        and chars[j + 1]["x0"] - chars[j]["x1"] >= min(chars[j + 1]["width"],
-                                                                       chars[j]["width"]) / 2:
-                    chars[j]["text"] += " "
-                j += 1
+        async def __img_ocr(batch, id, limiter):
+            for _, _, chars in batch:
+                self._add_char_spaces(chars)
 
+            pagenums = [i + 1 for i, _, _ in batch]
+            imgs = [img for _, img, _ in batch]
+            charss = [chars for _, _, chars in batch]
             if limiter:
                 async with limiter:
-                    await trio.to_thread.run_sync(lambda: self.__ocr(i + 1, img, chars, zoomin, id))
+                    await trio.to_thread.run_sync(lambda: self.__ocr_batch(pagenums, imgs, charss, zoomin, id))
             else:
-                self.__ocr(i + 1, img, chars, zoomin, id)
+                self.__ocr_batch(pagenums, imgs, charss, zoomin, id)
 
-            if callback and i % 6 == 5:
-                callback(prog=(i + 1) * 0.6 / len(self.page_images), msg="")
+            if callback and any(i % 6 == 5 for i, _, _ in batch):
+                callback(prog=pagenums[-1] * 0.6 / len(self.page_chars), msg="")
+
+        async def __pages():
+            if rendered is None:
+                for i, img in enumerate(self.page_images):
+                    yield i, img
+                return
+            for fut in rendered:
+                for img in await trio.to_thread.run_sync(fut.result):
+                    self.page_images.append(img)
+                    yield len(self.page_images) - 1, img
 
         async def __img_ocr_launcher():
             def __ocr_preprocess():
@@ -1105,24 +1321,43 @@ class RAGFlowPdfParser:
                 self.page_cum_height.append(img.size[1] / zoomin)
                 return chars
 
+            # Consecutive pages are detected together, OCR_BATCH_PAGES at a time.
+            batch, batch_no = [], 0
             if self.parallel_limiter:
                 async with trio.open_nursery() as nursery:
-                    for i, img in enumerate(self.page_images):
-                        chars = __ocr_preprocess()
-
-                        nursery.start_soon(__img_ocr, i, i % PARALLEL_DEVICES, img, chars,
-                                           self.parallel_limiter[i % PARALLEL_DEVICES])
+                    async for i, img in __pages():
+                        batch.append((i, img, __ocr_preprocess()))
+                        if len(batch) < max(1, OCR_BATCH_PAGES):
+                            continue
+                        nursery.start_soon(__img_ocr, batch, batch_no % PARALLEL_DEVICES,
+                                           self.parallel_limiter[batch_no % PARALLEL_DEVICES])
+                        batch, batch_no = [], batch_no + 1
                         await trio.sleep(0.1)
+                    if batch:
+                        nursery.start_soon(__img_ocr, batch, batch_no % PARALLEL_DEVICES,
+                                           self.parallel_limiter[batch_no % PARALLEL_DEVICES])
             else:
-                for i, img in enumerate(self.page_images):
-                    chars = __ocr_preprocess()
-                    await __img_ocr(i, 0, img, chars, None)
+                async for i, img in __pages():
+                    batch.append((i, img, __ocr_preprocess()))
+                    if len(batch) < max(1, OCR_BATCH_PAGES):
+                        continue
+                    await __img_ocr(batch, 0, None)
+                    batch = []
+                if batch:
+                    await __img_ocr(batch, 0, None)
 
         start = timer()
 
-        trio.run(__img_ocr_launcher)
+        try:
+            trio.run(__img_ocr_launcher)
+        finally:
+            if rendered is not None:
+                rendered.close()
+            if tmp_fnm:
+                os.unlink(tmp_fnm)
 
-        logging.info(f"__images__ {len(self.page_images)} pages cost {timer() - start}s")
+        logging.info(f"__images__ {len(self.page_images)} pages cost {timer() - start}s, "
+                     f"{self.page_paths['text_layer']} from the text layer, {self.page_paths['ocr']} OCRed")
 
         if not self.is_english and not any(
                 [c for c in self.page_chars]) and self.boxes:
@@ -1409,5 +1644,31 @@ class VisionParser(RAGFlowPdfParser):
         return all_docs, []
 
 
+def benchmark_throughput(fnm, zoomin=3, batch_pages=(1, OCR_BATCH_PAGES)):
+    """
+    Pages/s of OCR, layout and table structure recognition on `fnm`, once per OCR batch size
+    in `batch_pages`, with the time spent in each stage.
+    """
+    global OCR_BATCH_PAGES
+    parser = RAGFlowPdfParser()
+    orig = OCR_BATCH_PAGES
+    try:
+        for n in dict.fromkeys(batch_pages):
+            OCR_BATCH_PAGES = n
+            st = timer()
+            parser.__images__(fnm, zoomin)
+            parser._layouts_rec(zoomin)
+            parser._table_transformer_job(zoomin)
+            elapsed = timer() - st
+            pages = len(parser.page_images)
+            stages = " ".join(f"{k}={v:.2f}s" for k, v in parser.timings.items())
+            paths = " ".join(f"{k}_pages={v}" for k, v in parser.page_paths.items())
+            print(f"batch_pages={n} pages={pages} {pages / max(elapsed, 1e-9):.2f} pages/s total={elapsed:.2f}s {paths} {stages}")
+    finally:
+        OCR_BATCH_PAGES = orig
+
+
 if __name__ == "__main__":
-    pass
+    # Usage: python -m deepdoc.parser.pdf_parser --bench-throughput <pdf> [batch_pages ...]
+    if sys.argv[1:2] == ["--bench-throughput"]:
+        benchmark_throughput(sys.argv[2], batch_pages=[int(n) for n in sys.argv[3:]] or (1, OCR_BATCH_PAGES))
@@ -18,6 +18,7 @@ import logging
 import copy
 import time
 import os
+import threading
 
 from huggingface_hub import snapshot_download
 
@@ -67,9 +68,49 @@ def create_operators(op_param_list, global_config=None):
     return ops
 
 
-def load_model(model_dir, nm, device_id: int | None = None):
-    model_file_path = os.path.join(model_dir, nm + ".onnx")
-    model_cached_tag = model_file_path + str(device_id) if device_id is not None else model_file_path
+# Every model is loaded once per process and device, and shared by all the parsers using it.
+# Sessions get their intra-op threads from a CPU budget split between the sessions that may run
+# at the same time: every chunk builder can have its det, rec, layout and tsr sessions busy at
+# once. The PDF render workers are not part of the budget; lower ONNX_CPU_BUDGET to leave them
+# cores of their own.
+ONNX_CPU_BUDGET = int(os.environ.get("ONNX_CPU_BUDGET", os.cpu_count() or 1))
+ONNX_SESSIONS_PER_BUILDER = int(os.environ.get("ONNX_SESSIONS_PER_BUILDER", 4))
+ONNX_CONCURRENT_SESSIONS = int(os.environ.get("ONNX_CONCURRENT_SESSIONS", int(os.environ.get("MAX_CONCURRENT_CHUNK_BUILDERS", 1)) * ONNX_SESSIONS_PER_BUILDER))
+ONNX_INTRA_OP_THREADS = int(os.environ.get("ONNX_INTRA_OP_THREADS", 0)) or max(1, ONNX_CPU_BUDGET // max(1, ONNX_CONCURRENT_SESSIONS))
+ONNX_INTER_OP_THREADS = int(os.environ.get("ONNX_INTER_OP_THREADS", 1))
+# Directory where graph-optimized models are serialized on first load and read back afterwards.
+ONNX_OPTIMIZED_MODEL_DIR = os.environ.get("ONNX_OPTIMIZED_MODEL_DIR", "")
+# "int8" loads <model>.int8.onnx instead of <model>.onnx when it exists, see quantize_model.
+ONNX_MODEL_PRECISION = os.environ.get("ONNX_MODEL_PRECISION", "fp32").lower()
+
+loaded_models_lock = threading.Lock()
+
+
+def model_file(model_dir, nm, precision=None):
+    precision = precision or ONNX_MODEL_PRECISION
+    if precision != "fp32":
+        path = os.path.join(model_dir, f"{nm}.{precision}.onnx")
+        if os.path.exists(path):
+            return path
+        logging.warning(f"load_model {path} not found, falls back to fp32")
+    return os.path.join(model_dir, nm + ".onnx")
+
+
+def quantize_model(model_dir, nm):
+    """
+    Write <model>.int8.onnx next to <model>.onnx with dynamic INT8 quantization of the weights.
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    src = os.path.join(model_dir, nm + ".onnx")
+    dst = os.path.join(model_dir, nm + ".int8.onnx")
+    quantize_dynamic(src, dst, weight_type=QuantType.QUInt8)
+    return dst
+
+
+def load_model(model_dir, nm, device_id: int | None = None, precision: str | None = None):
+    model_file_path = model_file(model_dir, nm, precision)
+    model_cached_tag = (model_file_path, device_id)
 
     global loaded_models
     loaded_model = loaded_models.get(model_cached_tag)
@@ -77,6 +118,16 @@ def load_model(model_dir, nm, device_id: int | None = None):
         logging.info(f"load_model {model_file_path} reuses cached model")
         return loaded_model
 
+    with loaded_models_lock:
+        loaded_model = loaded_models.get(model_cached_tag)
+        if loaded_model:
+            return loaded_model
+        loaded_model = _load_model(model_file_path, device_id)
+        loaded_models[model_cached_tag] = loaded_model
+        return loaded_model
+
+
+def _load_model(model_file_path, device_id: int | None = None):
     if not os.path.exists(model_file_path):
         raise ValueError("not find model file path {}".format(
             model_file_path))
@@ -90,39 +141,51 @@ def load_model(model_dir, nm, device_id: int | None = None):
             return False
         return False
 
+    use_cuda = cuda_is_available()
     options = ort.SessionOptions()
     options.enable_cpu_mem_arena = False
     options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
-    options.intra_op_num_threads = 2
-    options.inter_op_num_threads = 2
+    options.intra_op_num_threads = ONNX_INTRA_OP_THREADS
+    options.inter_op_num_threads = ONNX_INTER_OP_THREADS
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+    sess_path = model_file_path
+    if ONNX_OPTIMIZED_MODEL_DIR:
+        # Optimized graphs may hold provider specific nodes, hence one file per provider.
+        opt_path = os.path.join(ONNX_OPTIMIZED_MODEL_DIR, "{}.{}.opt.onnx".format(
+            os.path.splitext(os.path.basename(model_file_path))[0], "cuda" if use_cuda else "cpu"))
+        if os.path.exists(opt_path) and os.path.getmtime(opt_path) >= os.path.getmtime(model_file_path):
+            sess_path = opt_path
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        else:
+            os.makedirs(ONNX_OPTIMIZED_MODEL_DIR, exist_ok=True)
+            options.optimized_model_filepath = opt_path
 
     # https://github.com/microsoft/onnxruntime/issues/9509#issuecomment-951546580
     # Shrink GPU memory after execution
     run_options = ort.RunOptions()
-    if cuda_is_available():
+    if use_cuda:
         cuda_provider_options = {
             "device_id": device_id, # Use specific GPU
             "gpu_mem_limit": 512 * 1024 * 1024, # Limit gpu memory
             "arena_extend_strategy": "kNextPowerOfTwo",  # gpu memory allocation strategy
         }
         sess = ort.InferenceSession(
-            model_file_path,
+            sess_path,
             options=options,
             providers=['CUDAExecutionProvider'],
             provider_options=[cuda_provider_options]
             )
         run_options.add_run_config_entry("memory.enable_memory_arena_shrinkage", "gpu:" + str(device_id))
-        logging.info(f"load_model {model_file_path} uses GPU")
+        logging.info(f"load_model {sess_path} uses GPU")
     else:
         sess = ort.InferenceSession(
-            model_file_path,
+            sess_path,
             options=options,
             providers=['CPUExecutionProvider'])
         run_options.add_run_config_entry("memory.enable_memory_arena_shrinkage", "cpu")
-        logging.info(f"load_model {model_file_path} uses CPU")
-    loaded_model = (sess, run_options)
-    loaded_models[model_cached_tag] = loaded_model
-    return loaded_model
+        logging.info(f"load_model {sess_path} uses CPU with {ONNX_INTRA_OP_THREADS} intra-op threads")
+    return sess, run_options
 
 
 class TextRecognizer:
@@ -479,6 +542,19 @@ class TextDetector:
         dt_boxes = np.array(dt_boxes_new)
         return dt_boxes
 
+    def run(self, img):
+        input_dict = {}
+        input_dict[self.input_tensor.name] = img
+        for i in range(100000):
+            try:
+                outputs = self.predictor.run(None, input_dict, self.run_options)
+                break
+            except Exception as e:
+                if i >= 3:
+                    raise e
+                time.sleep(5)
+        return outputs
+
     def __call__(self, img):
         ori_im = img.copy()
         data = {'image': img}
@@ -491,16 +567,7 @@ class TextDetector:
         img = np.expand_dims(img, axis=0)
         shape_list = np.expand_dims(shape_list, axis=0)
         img = img.copy()
-        input_dict = {}
-        input_dict[self.input_tensor.name] = img
-        for i in range(100000):
-            try:
-                outputs = self.predictor.run(None, input_dict, self.run_options)
-                break
-            except Exception as e:
-                if i >= 3:
-                    raise e
-                time.sleep(5)
+        outputs = self.run(img)
 
         post_result = self.postprocess_op({"maps": outputs[0]}, shape_list)
         dt_boxes = post_result[0]['points']
@@ -508,6 +575,43 @@ class TextDetector:
 
         return dt_boxes, time.time() - st
 
+    def batch(self, img_list):
+        """
+        Detect text boxes on several images with as few model runs as possible.
+
+        Resized images of the same shape are stacked into one model run; images of different
+        shapes are never padded together, since convolutions near the right and bottom edges
+        would see the padding and could move the boxes. Pages of one document usually share a
+        shape, so the boxes equal those of one `__call__` per image at a fraction of the runs.
+        Models exported with a fixed batch dimension fall back to one run per image.
+        Return a list of (dt_boxes, elapse), elapse being this image's share of the time.
+        """
+        if not isinstance(self.input_tensor.shape[0], str) and self.input_tensor.shape[0] not in (None, -1):
+            return [self(img) for img in img_list]
+
+        st = time.time()
+        res = [(None, 0)] * len(img_list)
+        groups = {}
+        for i, img in enumerate(img_list):
+            data = transform({'image': img}, self.preprocess_op)
+            if data is None or data[0] is None:
+                continue
+            groups.setdefault(data[0].shape, []).append((i, data[0], data[1], img.shape))
+        if not groups:
+            return res
+
+        outputs = []
+        for items in groups.values():
+            maps = self.run(np.stack([im for _, im, _, _ in items]).astype(np.float32))[0]
+            outputs.extend((item, maps[j: j + 1]) for j, item in enumerate(items))
+
+        elapse = (time.time() - st) / len(outputs)
+        for (i, im, shape, ori_shape), pred in outputs:
+            post_result = self.postprocess_op({"maps": pred}, np.expand_dims(shape, axis=0))
+            dt_boxes = self.filter_tag_det_res(post_result[0]['points'], ori_shape)
+            res[i] = (dt_boxes, elapse)
+        return res
+
 
 class OCR:
     def __init__(self, model_dir=None):
@@ -657,6 +761,23 @@ class OCR:
         return zip(self.sorted_boxes(dt_boxes), [
                    ("", 0) for _ in range(len(dt_boxes))])
 
+    def detect_batch(self, img_list, device_id: int | None = None):
+        """
+        Same as `detect` for every image of `img_list`, with the detection model run once
+        for the whole list instead of once per image.
+        """
+        if device_id is None:
+            device_id = 0
+
+        res = []
+        for dt_boxes, _ in self.text_detector[device_id].batch(img_list):
+            if dt_boxes is None:
+                res.append((None, None, {'det': 0, 'rec': 0, 'cls': 0, 'all': 0}))
+                continue
+            res.append(zip(self.sorted_boxes(dt_boxes), [
+                       ("", 0) for _ in range(len(dt_boxes))]))
+        return res
+
     def recognize(self, ori_im, box, device_id: int | None = None):
         if device_id is None:
             device_id = 0
@@ -49,6 +49,10 @@ class Recognizer:
         self.input_names = [node.name for node in self.ort_sess.get_inputs()]
         self.output_names = [node.name for node in self.ort_sess.get_outputs()]
         self.input_shape = self.ort_sess.get_inputs()[0].shape[2:4]
+        # Models taking the image alone and exported with a dynamic batch dimension can run a
+        # whole batch of pages at once; the others (e.g. with a scale_factor input) run per page.
+        batch_dim = self.ort_sess.get_inputs()[0].shape[0]
+        self.batchable = len(self.input_names) == 1 and (isinstance(batch_dim, str) or batch_dim in (None, -1))
         self.label_list = label_list
 
     @staticmethod
@@ -422,6 +426,12 @@ class Recognizer:
             batch_image_list = images[start_index:end_index]
             inputs = self.preprocess(batch_image_list)
             logging.debug("preprocess")
+            if self.batchable and len(inputs) > 1 and len(set(ins[self.input_names[0]].shape for ins in inputs)) == 1:
+                # One run for the whole batch, then post-process the output of each image on its own.
+                outputs = self.ort_sess.run(None, {self.input_names[0]: np.concatenate([ins[self.input_names[0]] for ins in inputs], axis=0)}, self.run_options)[0]
+                for j, ins in enumerate(inputs):
+                    res.append(self.postprocess(outputs[j: j + 1], ins, thr))
+                continue
             for ins in inputs:
                 bb = self.postprocess(self.ort_sess.run(None, {k:v for k,v in ins.items() if k in self.input_names}, self.run_options)[0], ins, thr)
                 res.append(bb)
@@ -0,0 +1,93 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+
+import os
+import sys
+sys.path.insert(
+    0,
+    os.path.abspath(
+        os.path.join(
+            os.path.dirname(
+                os.path.abspath(__file__)),
+            '../../')))
+
+import argparse
+import time
+from difflib import SequenceMatcher
+
+import numpy as np
+
+from api.utils.file_utils import get_project_base_directory
+from deepdoc.vision import OCR, LayoutRecognizer, TableStructureRecognizer, init_in_out
+from deepdoc.vision import ocr as ocr_module
+
+MODELS = ["det", "rec", "layout", "tsr"]
+
+
+def run(precision, images):
+    ocr_module.ONNX_MODEL_PRECISION = precision
+    ocr = OCR()
+    layouter = LayoutRecognizer("layout")
+    tsr = TableStructureRecognizer()
+
+    st = time.perf_counter()
+    texts = []
+    for img in images:
+        bxs = ocr(np.array(img))
+        if not isinstance(bxs, list):
+            bxs = []
+        texts.append("\n".join([t for _, (t, _) in bxs]))
+    ocr_elapsed = time.perf_counter() - st
+
+    st = time.perf_counter()
+    layouts = layouter.forward(images, thr=0.2)
+    layout_elapsed = time.perf_counter() - st
+
+    st = time.perf_counter()
+    tables = tsr(images, thr=0.2)
+    tsr_elapsed = time.perf_counter() - st
+    return (texts, [sorted(b["type"] for b in lts) for lts in layouts], [sorted(b["label"] for b in tbl) for tbl in tables],
+            ocr_elapsed, layout_elapsed, tsr_elapsed)
+
+
+def main(args):
+    model_dir = os.path.join(get_project_base_directory(), "rag/res/deepdoc")
+    for nm in MODELS:
+        if not os.path.exists(os.path.join(model_dir, nm + ".int8.onnx")):
+            print("Quantize {} -> {}".format(nm, ocr_module.quantize_model(model_dir, nm)))
+
+    images, _ = init_in_out(args)
+    fp32_texts, fp32_layouts, fp32_tables, fp32_ocr, fp32_layout, fp32_tsr = run("fp32", images)
+    int8_texts, int8_layouts, int8_tables, int8_ocr, int8_layout, int8_tsr = run("int8", images)
+
+    text_sim = np.mean([SequenceMatcher(None, a, b).ratio() for a, b in zip(fp32_texts, int8_texts)])
+    layout_sim = np.mean([SequenceMatcher(None, a, b).ratio() for a, b in zip(fp32_layouts, int8_layouts)])
+    table_sim = np.mean([SequenceMatcher(None, a, b).ratio() for a, b in zip(fp32_tables, int8_tables)] or [1.0])
+    n = max(len(images), 1)
+    print("fp32 OCR {:.2f} pages/s, layout {:.2f} pages/s, tsr {:.2f} pages/s".format(n / fp32_ocr, n / fp32_layout, n / fp32_tsr))
+    print("int8 OCR {:.2f} pages/s, layout {:.2f} pages/s, tsr {:.2f} pages/s".format(n / int8_ocr, n / int8_layout, n / int8_tsr))
+    print("int8 vs fp32 text similarity {:.4f}, layout similarity {:.4f}, table structure similarity {:.4f}".format(text_sim, layout_sim, table_sim))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--inputs',
+                        help="Directory where to store images or PDFs, or a file path to a single image or PDF",
+                        required=True)
+    parser.add_argument('--output_dir', help="Directory where to store the output images. Default: './quantize_outputs'",
+                        default="./quantize_outputs")
+    args = parser.parse_args()
+    main(args)
@@ -13,10 +13,15 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import bisect
 import logging
-import itertools
+import multiprocessing
 import os
 import re
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from dataclasses import dataclass
 from typing import Any, Callable
 
@@ -34,6 +39,14 @@ DEFAULT_RECORD_DELIMITER = "##"
 DEFAULT_ENTITY_INDEX_DELIMITER = "<|>"
 DEFAULT_RESOLUTION_RESULT_DELIMITER = "&&"
 
+# Blocked pairs are scored in worker processes once there are this many of them.
+ENTITY_RESOLUTION_WORKERS = int(os.environ.get("ENTITY_RESOLUTION_WORKERS", min(4, os.cpu_count() or 1)))
+ENTITY_RESOLUTION_PARALLEL_MIN_PAIRS = int(os.environ.get("ENTITY_RESOLUTION_PARALLEL_MIN_PAIRS", 50000))
+ENTITY_RESOLUTION_PAIRS_PER_TASK = 10000
+
+_pool = None
+_pool_lock = threading.Lock()
+
 
 @dataclass
 class EntityResolutionResult:
@@ -92,7 +105,7 @@ class EntityResolution(Extractor):
 
         candidate_resolution = {entity_type: [] for entity_type in entity_types}
         for k, v in node_clusters.items():
-            candidate_resolution[k] = [(a, b) for a, b in itertools.combinations(v, 2) if (a in subgraph_nodes or b in subgraph_nodes) and self.is_similarity(a, b)]
+            candidate_resolution[k] = await trio.to_thread.run_sync(lambda: score_pairs(block_pairs(v, subgraph_nodes)))
         num_candidates = sum([len(candidates) for _, candidates in candidate_resolution.items()])
         callback(msg=f"Identified {num_candidates} candidate pairs")
         remain_candidates_to_resolve = num_candidates
@@ -173,7 +186,7 @@ class EntityResolution(Extractor):
             try:
                 enable_timeout_assertion = os.environ.get("ENABLE_TIMEOUT_ASSERTION")
                 with trio.move_on_after(280 if enable_timeout_assertion else 1000000000) as cancel_scope:
-                    response = await trio.to_thread.run_sync(self._chat, text, [{"role": "user", "content": "Output:"}], {})
+                    response = await self._chat(text, [{"role": "user", "content": "Output:"}], {})
                 if cancel_scope.cancelled_caught:
                     logging.warning("_resolve_candidate._chat timeout, skipping...")
                     return
@@ -220,7 +233,8 @@ class EntityResolution(Extractor):
 
         return ans_list
 
-    def _has_digit_in_2gram_diff(self, a, b):
+    @staticmethod
+    def _has_digit_in_2gram_diff(a, b):
         def to_2gram_set(s):
             return {s[i:i+2] for i in range(len(s) - 1)}
 
@@ -230,8 +244,9 @@ class EntityResolution(Extractor):
 
         return any(any(c.isdigit() for c in pair) for pair in diff)
 
-    def is_similarity(self, a, b):
-        if self._has_digit_in_2gram_diff(a, b):
+    @staticmethod
+    def is_similarity(a, b):
+        if EntityResolution._has_digit_in_2gram_diff(a, b):
             return False
 
         if is_english(a) and is_english(b):
@@ -246,3 +261,97 @@ class EntityResolution(Extractor):
 
         return len(a & b)*1./max_l >= 0.8
 
+
+
+def block_pairs(names: list[str], subgraph_nodes: set[str]) -> list[tuple[str, str]]:
+    """
+    Return, in `itertools.combinations(names, 2)` order, the pairs involving a node of
+    `subgraph_nodes` that may pass `EntityResolution.is_similarity`, without visiting all pairs.
+
+    Both branches of `is_similarity` imply a minimal number of shared distinct characters, so
+    a pair is only produced when one side holds one of the rarest characters of the other's
+    prefix (prefix filtering), which loses no pair `is_similarity` would accept:
+      - set overlap: |A & B| >= 0.8 * max(|A|, |B|), or >= 2 below 4 distinct chars. Prefixes
+        of both sides are indexed and probed against each other.
+      - edit distance <= k = min(len) // 2: each edit drops at most one distinct char of `a`,
+        so |A & B| >= |A| - k. `a`'s prefix is probed against the full char sets of English
+        names whose length differs by at most k.
+    """
+    sets = [set(n) for n in names]
+    english = [is_english(n) for n in names]
+    df = Counter(ch for st in sets for ch in st)
+    ordered = [sorted(st, key=lambda ch: (df[ch], ch)) for st in sets]
+
+    def set_overlap(i):
+        u = len(sets[i])
+        if u <= 1:
+            return None
+        return 2 if u < 4 else int(0.8 * u)
+
+    # The set overlap branch only decides pairs with a non English side, so English names
+    # look up non English prefixes only.
+    prefix_index = defaultdict(list)
+    non_english_prefix_index = defaultdict(list)
+    full_index = defaultdict(list)
+    for i, chs in enumerate(ordered):
+        o = set_overlap(i)
+        if o is not None:
+            for ch in chs[:len(chs) - o + 1]:
+                prefix_index[ch].append(i)
+                if not english[i]:
+                    non_english_prefix_index[ch].append(i)
+        if english[i]:
+            for ch in chs:
+                full_index[(ch, len(names[i]))].append(i)
+    english_ids = sorted((i for i in range(len(names)) if english[i]), key=lambda i: len(names[i]))
+    english_lens = [len(names[i]) for i in english_ids]
+
+    pairs = set()
+    for i, nm in enumerate(names):
+        if nm not in subgraph_nodes:
+            continue
+        found = set()
+        o = set_overlap(i)
+        if o is not None:
+            index = non_english_prefix_index if english[i] else prefix_index
+            for ch in ordered[i][:len(ordered[i]) - o + 1]:
+                found.update(index[ch])
+        if english[i]:
+            o = len(sets[i]) - len(nm) // 2
+            lo, hi = len(nm) * 2 // 3, len(nm) + len(nm) // 2
+            if o <= 0:
+                en = english_ids[bisect.bisect_left(english_lens, lo): bisect.bisect_right(english_lens, hi)]
+            else:
+                en = {j for ch in ordered[i][:len(ordered[i]) - o + 1] for ln in range(lo, hi + 1) for j in full_index.get((ch, ln), [])}
+            found.update(j for j in en if abs(len(names[j]) - len(nm)) <= min(len(names[j]), len(nm)) // 2)
+        pairs.update((min(i, j), max(i, j)) for j in found if j != i)
+    return [(names[i], names[j]) for i, j in sorted(pairs)]
+
+
+def _similar_pairs(pairs):
+    return [(a, b) for a, b in pairs if EntityResolution.is_similarity(a, b)]
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            _pool = ProcessPoolExecutor(max_workers=ENTITY_RESOLUTION_WORKERS, mp_context=ctx)
+        return _pool
+
+
+def score_pairs(pairs: list[tuple[str, str]]) -> list[tuple[str, str]]:
+    """Keep the pairs accepted by `is_similarity`, in order, scoring large lists in worker processes."""
+    global _pool
+    if ENTITY_RESOLUTION_WORKERS <= 1 or len(pairs) < ENTITY_RESOLUTION_PARALLEL_MIN_PAIRS:
+        return _similar_pairs(pairs)
+    parts = [pairs[i: i + ENTITY_RESOLUTION_PAIRS_PER_TASK] for i in range(0, len(pairs), ENTITY_RESOLUTION_PAIRS_PER_TASK)]
+    try:
+        return [p for part in _get_pool().map(_similar_pairs, parts) for p in part]
+    except BrokenProcessPool:
+        logging.exception("EntityResolution scoring pool broke, score in process")
+        with _pool_lock:
+            _pool = None
+        return _similar_pairs(pairs)
@@ -60,21 +60,22 @@ class Extractor:
         self._entity_types = entity_types or DEFAULT_ENTITY_TYPES
 
     @timeout(60 * 20)
-    def _chat(self, system, history, gen_conf={}):
+    async def _chat(self, system, history, gen_conf={}):
         hist = deepcopy(history)
         conf = deepcopy(gen_conf)
-        response = get_llm_cache(self._llm.llm_name, system, hist, conf)
+        response = await trio.to_thread.run_sync(lambda: get_llm_cache(self._llm.llm_name, system, hist, conf))
         if response:
             return response
         _, system_msg = message_fit_in([{"role": "system", "content": system}], int(self._llm.max_length * 0.92))
         response = ""
         for attempt in range(3):
             try:
-                response = self._llm.chat(system_msg[0]["content"], hist, conf)
+                response = await self._llm.async_chat(system_msg[0]["content"], hist, conf)
                 response = re.sub(r"^.*</think>", "", response, flags=re.DOTALL)
                 if response.find("**ERROR**") >= 0:
                     raise Exception(response)
-                set_llm_cache(self._llm.llm_name, system, response, history, gen_conf)
+                await trio.to_thread.run_sync(lambda: set_llm_cache(self._llm.llm_name, system, response, history, gen_conf))
+                break
             except Exception as e:
                 logging.exception(e)
                 if attempt == 2:
@@ -239,5 +240,5 @@ class Extractor:
         use_prompt = prompt_template.format(**context_base)
         logging.info(f"Trigger summary: {entity_or_relation_name}")
         async with chat_limiter:
-            summary = await trio.to_thread.run_sync(self._chat, "", [{"role": "user", "content": use_prompt}])
+            summary = await self._chat("", [{"role": "user", "content": use_prompt}])
         return summary
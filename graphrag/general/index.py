@@ -87,6 +87,7 @@ async def run_graphrag(
             subgraph,
             embedding_model,
             callback,
+            with_resolution or with_community,
         )
         assert new_graph is not None
 
@@ -195,10 +196,13 @@ async def merge_subgraph(
     subgraph: nx.Graph,
     embedding_model,
     callback,
+    full_graph: bool = True,
 ):
     start = trio.current_time()
     change = GraphChange()
-    old_graph = await get_graph(tenant_id, kb_id, subgraph.graph["source_id"])
+    # Resolution and community detection need the whole graph; merging alone only needs the stored
+    # versions of the subgraph's nodes.
+    old_graph = await get_graph(tenant_id, kb_id, subgraph.graph["source_id"], None if full_graph else list(subgraph.nodes))
     if old_graph is not None:
         logging.info("Merge with an exiting graph...................")
         tidy_graph(old_graph, callback)
@@ -207,7 +211,15 @@ async def merge_subgraph(
         new_graph = subgraph
         change.added_updated_nodes = set(new_graph.nodes())
         change.added_updated_edges = set(new_graph.edges())
+        for node_name, degree in new_graph.degree:
+            new_graph.nodes[node_name]["rank"] = degree
     pr = nx.pagerank(new_graph)
+    partial = new_graph.graph.get("partial")
+    if partial:
+        # Pagerank needs the whole graph: keep the stored scores, and score the new nodes within the
+        # loaded part, rescaled to the size of the whole graph.
+        scale = new_graph.number_of_nodes() / (partial["nodes"] + new_graph.number_of_nodes() - partial["loaded"])
+        pr = {n: v * scale for n, v in pr.items() if "pagerank" not in new_graph.nodes[n]}
     for node_name, pagerank in pr.items():
         new_graph.nodes[node_name]["pagerank"] = pagerank
 
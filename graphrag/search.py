@@ -15,20 +15,64 @@
 #
 import json
 import logging
+import threading
 from collections import defaultdict
 from copy import deepcopy
 import json_repair
 import pandas as pd
 import trio
+from cachetools import TTLCache
 
 from api.utils import get_uuid
 from graphrag.query_analyze_prompt import PROMPTS
-from graphrag.utils import get_entity_type2samples, get_llm_cache, set_llm_cache, get_relation
+from graphrag.utils import get_entity_type2samples, get_llm_cache, set_llm_cache, get_relations
+from rag.settings import RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL
 from rag.utils import num_tokens_from_string, get_float
 from rag.utils.doc_store_conn import OrderByExpr
+from rag.utils.retrieval_cache import get_kb_generations
 
 from rag.nlp.search import Dealer, index_name
 
+# Entity type lookups only change when a knowledge graph is rebuilt, which bumps the generation
+# of its knowledge base, so they are cached in process under the current generations.
+_KB_LOOKUP_CACHE = TTLCache(maxsize=RETRIEVAL_CACHE_SIZE, ttl=RETRIEVAL_CACHE_TTL)
+_KB_LOOKUP_LOCK = threading.Lock()
+
+
+def cached_kb_lookup(name, kb_ids, func, *args):
+    """
+    Return `func(*args)`, cached under `name`, `args` and the generations of `kb_ids`.
+    Nothing is cached when the generations can not be read.
+    """
+    kb_ids = sorted(set(kb_ids or []))
+    gens = get_kb_generations(kb_ids) if kb_ids else []
+    if gens is None:
+        return func(*args)
+    key = (name, tuple(zip(kb_ids, gens)), json.dumps(args, sort_keys=True, default=str))
+    with _KB_LOOKUP_LOCK:
+        if key in _KB_LOOKUP_CACHE:
+            return _KB_LOOKUP_CACHE[key]
+    res = func(*args)
+    with _KB_LOOKUP_LOCK:
+        _KB_LOOKUP_CACHE[key] = res
+    return res
+
+
+def run_concurrently(*funcs):
+    """Run the blocking `funcs` in worker threads at the same time and return their results in order."""
+    results = [None] * len(funcs)
+
+    async def run(i, func):
+        results[i] = await trio.to_thread.run_sync(func)
+
+    async def main():
+        async with trio.open_nursery() as nursery:
+            for i, func in enumerate(funcs):
+                nursery.start_soon(run, i, func)
+
+    trio.run(main)
+    return results
+
 
 class KGSearch(Dealer):
     def _chat(self, llm_bdl, system, history, gen_conf):
@@ -42,7 +86,7 @@ class KGSearch(Dealer):
         return response
 
     def query_rewrite(self, llm, question, idxnms, kb_ids):
-        ty2ents = trio.run(lambda: get_entity_type2samples(idxnms, kb_ids))
+        ty2ents = cached_kb_lookup("ty2ents", kb_ids, lambda idxnms, kb_ids: trio.run(get_entity_type2samples, idxnms, kb_ids), idxnms, kb_ids)
         hint_prompt = PROMPTS["minirag_query2kwd"].format(query=question,
                                                           TYPE_POOL=json.dumps(ty2ents, ensure_ascii=False, indent=2))
         result = self._chat(llm, hint_prompt, [{"role": "user", "content": "Output:"}], {})
@@ -128,14 +172,18 @@ class KGSearch(Dealer):
     def get_relevant_ents_by_types(self, types, filters, idxnms, kb_ids, N=56):
         if not types:
             return {}
-        filters = deepcopy(filters)
-        filters["knowledge_graph_kwd"] = "entity"
-        filters["entity_type_kwd"] = types
-        ordr = OrderByExpr()
-        ordr.desc("rank_flt")
-        es_res = self.dataStore.search(["entity_kwd", "rank_flt"], [], filters, [], ordr, 0, N,
-                                       idxnms, kb_ids)
-        return self._ent_info_from_(es_res, 0)
+
+        def search_by_types(types, filters, idxnms, kb_ids, N):
+            filters = deepcopy(filters)
+            filters["knowledge_graph_kwd"] = "entity"
+            filters["entity_type_kwd"] = types
+            ordr = OrderByExpr()
+            ordr.desc("rank_flt")
+            es_res = self.dataStore.search(["entity_kwd", "rank_flt"], [], filters, [], ordr, 0, N,
+                                           idxnms, kb_ids)
+            return self._ent_info_from_(es_res, 0)
+
+        return cached_kb_lookup("ents_by_types", kb_ids, search_by_types, sorted(types), filters, idxnms, kb_ids, N)
 
     def retrieval(self, question: str,
                tenant_ids: str | list[str],
@@ -155,18 +203,23 @@ class KGSearch(Dealer):
         if isinstance(tenant_ids, str):
             tenant_ids = tenant_ids.split(",")
         idxnms = [index_name(tid) for tid in tenant_ids]
-        ty_kwds = []
-        try:
-            ty_kwds, ents = self.query_rewrite(llm, qst, [index_name(tid) for tid in tenant_ids], kb_ids)
-            logging.info(f"Q: {qst}, Types: {ty_kwds}, Entities: {ents}")
-        except Exception as e:
-            logging.exception(e)
-            ents = [qst]
-            pass
-
-        ents_from_query = self.get_relevant_ents_by_keywords(ents, filters, idxnms, kb_ids, emb_mdl, ent_sim_threshold)
-        ents_from_types = self.get_relevant_ents_by_types(ty_kwds, filters, idxnms, kb_ids, 10000)
-        rels_from_txt = self.get_relevant_relations_by_txt(qst, filters, idxnms, kb_ids, emb_mdl, rel_sim_threshold)
+
+        def rewrite():
+            try:
+                ty_kwds, ents = self.query_rewrite(llm, qst, idxnms, kb_ids)
+                logging.info(f"Q: {qst}, Types: {ty_kwds}, Entities: {ents}")
+                return ty_kwds, ents
+            except Exception as e:
+                logging.exception(e)
+                return [], [qst]
+
+        # The relation search only needs the question, so it runs while the LLM rewrites it.
+        (ty_kwds, ents), rels_from_txt = run_concurrently(
+            rewrite,
+            lambda: self.get_relevant_relations_by_txt(qst, filters, idxnms, kb_ids, emb_mdl, rel_sim_threshold))
+        ents_from_query, ents_from_types = run_concurrently(
+            lambda: self.get_relevant_ents_by_keywords(ents, filters, idxnms, kb_ids, emb_mdl, ent_sim_threshold),
+            lambda: self.get_relevant_ents_by_types(ty_kwds, filters, idxnms, kb_ids, 10000))
         nhop_pathes = defaultdict(dict)
         for _, ent in ents_from_query.items():
             nhops = ent.get("n_hop_ents", [])
@@ -224,6 +277,11 @@ class KGSearch(Dealer):
         rels_from_txt = sorted(rels_from_txt.items(), key=lambda x: x[1]["sim"] * x[1]["pagerank"], reverse=True)[
                         :rel_topn]
 
+        missing = [(f, t) for (f, t), rel in rels_from_txt if not rel.get("description")]
+        rela_by_pair, comm_reports = run_concurrently(
+            lambda: get_relations(tenant_ids, kb_ids, missing),
+            lambda: self._community_retrieval_([n for n, _ in ents_from_query], filters, kb_ids, idxnms, comm_topn, max_token))
+
         ents = []
         relas = []
         for n, ent in ents_from_query:
@@ -239,13 +297,9 @@ class KGSearch(Dealer):
 
         for (f, t), rel in rels_from_txt:
             if not rel.get("description"):
-                for tid in tenant_ids:
-                    rela = get_relation(tid, kb_ids, f, t)
-                    if rela:
-                        break
-                else:
+                if (f, t) not in rela_by_pair:
                     continue
-                rel["description"] = rela["description"]
+                rel["description"] = rela_by_pair[(f, t)]["description"]
             desc = rel["description"]
             try:
                 desc = json.loads(desc).get("description", "")
@@ -274,8 +328,7 @@ class KGSearch(Dealer):
         return {
                 "chunk_id": get_uuid(),
                 "content_ltks": "",
-                "content_with_weight": ents + relas + self._community_retrieval_([n for n, _ in ents_from_query], filters, kb_ids, idxnms,
-                                                        comm_topn, max_token),
+                "content_with_weight": ents + relas + comm_reports,
                 "doc_id": "",
                 "docnm_kwd": "Related content in Knowledge Graph",
                 "kb_id": kb_ids,
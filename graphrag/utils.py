@@ -6,6 +6,7 @@ Reference:
  - [LightRag](https://github.com/HKUDS/LightRAG)
 """
 
+import base64
 import dataclasses
 import html
 import json
@@ -36,6 +37,15 @@ ErrorHandlerFn = Callable[[BaseException | None, str | None, dict | None], None]
 
 chat_limiter = trio.CapacityLimiter(int(os.environ.get("MAX_CONCURRENT_CHATS", 10)))
 
+# The knowledge graph is stored as a small "graph" manifest row (document ids plus the top nodes
+# for display) and GRAPH_PARTITIONS "graph_part" rows, each holding the nodes hashed to it and
+# the edges of their lower-named end. set_graph only rewrites the partitions touched by a
+# GraphChange, and get_graph can load just the partitions of some nodes.
+GRAPH_STORAGE = "partitioned"
+GRAPH_PARTITIONS = int(os.environ.get("GRAPH_PARTITIONS", 1024))
+GRAPH_SNAPSHOT_NODES = int(os.environ.get("GRAPH_SNAPSHOT_NODES", 256))
+GRAPH_BULK_SIZE = int(os.environ.get("GRAPH_BULK_SIZE", 64))
+
 
 @dataclasses.dataclass
 class GraphChange:
@@ -115,26 +125,52 @@ def set_llm_cache(llmnm, txt, v, history, genconf):
     REDIS_CONN.set(k, v.encode("utf-8"), 24 * 3600)
 
 
-def get_embed_cache(llmnm, txt):
+def embed_cache_key(llmnm, txt):
     hasher = xxhash.xxh64()
     hasher.update(str(llmnm).encode("utf-8"))
     hasher.update(str(txt).encode("utf-8"))
+    return hasher.hexdigest()
 
-    k = hasher.hexdigest()
-    bin = REDIS_CONN.get(k)
+
+def encode_embed(arr) -> str:
+    """Pack a vector as base64 float32, about a quarter of its JSON size."""
+    return base64.b64encode(np.asarray(arr, dtype=np.float32).tobytes()).decode("ascii")
+
+
+def decode_embed(bin) -> np.ndarray:
+    if isinstance(bin, bytes):
+        bin = bin.decode("utf-8")
+    if bin.startswith("["):
+        # Written as JSON before vectors were packed.
+        return np.array(json.loads(bin))
+    return np.frombuffer(base64.b64decode(bin), dtype=np.float32)
+
+
+def get_embed_cache(llmnm, txt):
+    bin = REDIS_CONN.get(embed_cache_key(llmnm, txt))
     if not bin:
         return
-    return np.array(json.loads(bin))
+    return decode_embed(bin)
 
 
 def set_embed_cache(llmnm, txt, arr):
-    hasher = xxhash.xxh64()
-    hasher.update(str(llmnm).encode("utf-8"))
-    hasher.update(str(txt).encode("utf-8"))
+    REDIS_CONN.set(embed_cache_key(llmnm, txt), encode_embed(arr), 24 * 3600)
 
-    k = hasher.hexdigest()
-    arr = json.dumps(arr.tolist() if isinstance(arr, np.ndarray) else arr)
-    REDIS_CONN.set(k, arr.encode("utf-8"), 24 * 3600)
+
+def get_embed_cache_batch(llmnm, txts):
+    """Look `txts` up with one MGET; misses and Redis failures come back as None."""
+    if not txts:
+        return []
+    bins = REDIS_CONN.mget([embed_cache_key(llmnm, t) for t in txts])
+    if bins is None:
+        return [None] * len(txts)
+    return [decode_embed(bin) if bin else None for bin in bins]
+
+
+def set_embed_cache_batch(llmnm, txts, arrs, exp=24 * 3600):
+    mapping = {embed_cache_key(llmnm, t): encode_embed(arr) for t, arr in zip(txts, arrs)}
+    if mapping:
+        REDIS_CONN.set_many(mapping, exp)
 
 
 def get_tags_from_cache(kb_ids):
@@ -211,11 +247,13 @@ def graph_merge(g1: nx.Graph, g2: nx.Graph, change: GraphChange):
         # A node's source_id indicates which chunks it came from.
         node["source_id"] += attr["source_id"]
 
+    added_edges = []
     for source, target, attr in g2.edges(data=True):
         change.added_updated_edges.add(get_from_to(source, target))
         edge = g1.get_edge_data(source, target)
         if edge is None:
             g1.add_edge(source, target, **attr)
+            added_edges.append((source, target))
             continue
         edge["weight"] += attr.get("weight", 0)
         edge["description"] += GRAPH_FIELD_SEP + attr["description"]
@@ -223,8 +261,16 @@ def graph_merge(g1: nx.Graph, g2: nx.Graph, change: GraphChange):
         # A edge's source_id indicates which chunks it came from.
         edge["source_id"] += attr["source_id"]
 
-    for node_degree in g1.degree:
-        g1.nodes[str(node_degree[0])]["rank"] = int(node_degree[1])
+    if g1.graph.get("partial"):
+        # Only part of the graph is loaded, so count the new edges onto the stored degrees.
+        for node_name in g2.nodes:
+            g1.nodes[node_name].setdefault("rank", 0)
+        for source, target in added_edges:
+            g1.nodes[source]["rank"] += 1
+            g1.nodes[target]["rank"] += 1
+    else:
+        for node_degree in g1.degree:
+            g1.nodes[str(node_degree[0])]["rank"] = int(node_degree[1])
     # A graph's source_id indicates which documents it came from.
     if "source_id" not in g1.graph:
         g1.graph["source_id"] = []
@@ -301,11 +347,18 @@ def chunk_id(chunk):
     return xxhash.xxh64((chunk["content_with_weight"] + chunk["kb_id"]).encode("utf-8")).hexdigest()
 
 
-async def graph_node_to_chunk(kb_id, embd_mdl, ent_name, meta, chunks):
-    global chat_limiter
-    enable_timeout_assertion = os.environ.get("ENABLE_TIMEOUT_ASSERTION")
+def entity_chunk_id(kb_id, ent_name):
+    return xxhash.xxh64(f"{kb_id}:entity:{ent_name}".encode("utf-8")).hexdigest()
+
+
+def relation_chunk_id(kb_id, from_ent_name, to_ent_name):
+    from_ent_name, to_ent_name = get_from_to(from_ent_name, to_ent_name)
+    return xxhash.xxh64(f"{kb_id}:relation:{from_ent_name}:{to_ent_name}".encode("utf-8")).hexdigest()
+
+
+def graph_node_to_chunk(kb_id, ent_name, meta):
     chunk = {
-        "id": get_uuid(),
+        "id": entity_chunk_id(kb_id, ent_name),
         "important_kwd": [ent_name],
         "title_tks": rag_tokenizer.tokenize(ent_name),
         "entity_kwd": ent_name,
@@ -318,16 +371,7 @@ async def graph_node_to_chunk(kb_id, embd_mdl, ent_name, meta, chunks):
         "available_int": 0,
     }
     chunk["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(chunk["content_ltks"])
-    ebd = get_embed_cache(embd_mdl.llm_name, ent_name)
-    if ebd is None:
-        async with chat_limiter:
-            with trio.fail_after(3 if enable_timeout_assertion else 30000000):
-                ebd, _ = await trio.to_thread.run_sync(lambda: embd_mdl.encode([ent_name]))
-        ebd = ebd[0]
-        set_embed_cache(embd_mdl.llm_name, ent_name, ebd)
-    assert ebd is not None
-    chunk["q_%d_vec" % len(ebd)] = ebd
-    chunks.append(chunk)
+    return chunk
 
 
 @timeout(3, 3)
@@ -352,10 +396,37 @@ def get_relation(tenant_id, kb_id, from_ent_name, to_ent_name, size=1):
     return res
 
 
-async def graph_edge_to_chunk(kb_id, embd_mdl, from_ent_name, to_ent_name, meta, chunks):
-    enable_timeout_assertion = os.environ.get("ENABLE_TIMEOUT_ASSERTION")
+@timeout(3, 3)
+def get_relations(tenant_ids, kb_ids, pairs):
+    """
+    Look up the relations between several entity pairs with one search over all the tenants'
+    indexes. Return {(from, to): relation attributes} for the pairs found, in either direction.
+    """
+    if not pairs:
+        return {}
+    ents = list(set([e for pair in pairs for e in pair]))
+    wanted = {tuple(sorted(pair)): pair for pair in pairs}
+    conds = {"fields": ["content_with_weight", "from_entity_kwd", "to_entity_kwd"], "size": len(ents) * len(ents), "kb_ids": kb_ids,
+             "from_entity_kwd": ents, "to_entity_kwd": ents, "knowledge_graph_kwd": ["relation"]}
+    es_res = settings.retrievaler.search(conds, [search.index_name(tid) for tid in tenant_ids], kb_ids)
+    res = {}
+    for id in es_res.ids:
+        f, t = es_res.field[id].get("from_entity_kwd"), es_res.field[id].get("to_entity_kwd")
+        f = f[0] if isinstance(f, list) else f
+        t = t[0] if isinstance(t, list) else t
+        pair = wanted.get(tuple(sorted([f, t])))
+        if not pair or pair in res:
+            continue
+        try:
+            res[pair] = json.loads(es_res.field[id]["content_with_weight"])
+        except Exception:
+            continue
+    return res
+
+
+def graph_edge_to_chunk(kb_id, from_ent_name, to_ent_name, meta):
     chunk = {
-        "id": get_uuid(),
+        "id": relation_chunk_id(kb_id, from_ent_name, to_ent_name),
         "from_entity_kwd": from_ent_name,
         "to_entity_kwd": to_ent_name,
         "knowledge_graph_kwd": "relation",
@@ -368,17 +439,28 @@ async def graph_edge_to_chunk(kb_id, embd_mdl, from_ent_name, to_ent_name, meta,
         "available_int": 0,
     }
     chunk["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(chunk["content_ltks"])
-    txt = f"{from_ent_name}->{to_ent_name}"
-    ebd = get_embed_cache(embd_mdl.llm_name, txt)
-    if ebd is None:
-        async with chat_limiter:
-            with trio.fail_after(3 if enable_timeout_assertion else 300000000):
-                ebd, _ = await trio.to_thread.run_sync(lambda: embd_mdl.encode([txt + f": {meta['description']}"]))
-        ebd = ebd[0]
-        set_embed_cache(embd_mdl.llm_name, txt, ebd)
-    assert ebd is not None
-    chunk["q_%d_vec" % len(ebd)] = ebd
-    chunks.append(chunk)
+    return chunk
+
+
+async def embed_graph_chunks(embd_mdl, chunks: list[dict], keys: list[str], texts: list[str]):
+    """
+    Set the vector of every entity/relation chunk. Vectors are looked up in the embed cache under
+    `keys` (the entity name, or "from->to" for a relation); the misses are encoded from `texts`
+    in batches kept in flight by the embedding scheduler, then cached.
+    """
+    from rag.utils.embedding_scheduler import get_embedding_scheduler
+
+    vects = await trio.to_thread.run_sync(lambda: get_embed_cache_batch(embd_mdl.llm_name, keys))
+    misses = [i for i, v in enumerate(vects) if v is None]
+    if misses:
+        enable_timeout_assertion = os.environ.get("ENABLE_TIMEOUT_ASSERTION")
+        with trio.fail_after(3 * len(misses) if enable_timeout_assertion else 300000000):
+            mat, _ = await get_embedding_scheduler(embd_mdl).encode(embd_mdl, [texts[i] for i in misses], use_cache=False)
+        for i, v in zip(misses, mat):
+            vects[i] = v
+        await trio.to_thread.run_sync(lambda: set_embed_cache_batch(embd_mdl.llm_name, [keys[i] for i in misses], mat))
+    for chunk, ebd in zip(chunks, vects):
+        chunk["q_%d_vec" % len(ebd)] = ebd
 
 
 async def does_graph_contains(tenant_id, kb_id, doc_id):
@@ -407,18 +489,97 @@ async def get_graph_doc_ids(tenant_id, kb_id) -> list[str]:
     return doc_ids
 
 
-async def get_graph(tenant_id, kb_id, exclude_rebuild=None):
+def graph_partition(ent_name, partitions=GRAPH_PARTITIONS):
+    return xxhash.xxh64(ent_name.encode("utf-8")).intdigest() % partitions
+
+
+def graph_partition_id(kb_id, partition):
+    return xxhash.xxh64(f"{kb_id}:graph_part:{partition}".encode("utf-8")).hexdigest()
+
+
+async def get_graph_partition_rows(tenant_id, kb_id, partitions: int, flds: list[str]) -> dict:
+    # A knowledge base has at most `partitions` partition rows, so one request fetches them all.
+    es_res = await trio.to_thread.run_sync(
+        lambda: settings.docStoreConn.search(flds, [], {"kb_id": kb_id, "knowledge_graph_kwd": ["graph_part"]}, [], OrderByExpr(), 0, partitions, search.index_name(tenant_id), [kb_id])
+    )
+    return settings.docStoreConn.getFields(es_res, flds)
+
+
+async def load_graph_partitions(tenant_id, kb_id, partitions: int, nodes: list[str] | None = None) -> nx.Graph:
+    """
+    Load the graph from its partition rows; with `nodes`, only those nodes and the edges between them.
+    The partitions read are then kept in graph.graph["partial"]["parts"] for set_graph to write back.
+    """
+    graph = nx.Graph()
+    parts = {}
+    if nodes is not None:
+
+        async def get_partition(p):
+            d = await trio.to_thread.run_sync(settings.docStoreConn.get, graph_partition_id(kb_id, p), search.index_name(tenant_id), [kb_id])
+            parts[p] = json.loads(d["content_with_weight"]) if d else {"nodes": [], "edges": []}
+
+        async with trio.open_nursery() as nursery:
+            for p in {graph_partition(n, partitions) for n in nodes}:
+                nursery.start_soon(get_partition, p)
+    else:
+        for i, d in enumerate((await get_graph_partition_rows(tenant_id, kb_id, partitions, ["content_with_weight"])).values()):
+            parts[i] = json.loads(d["content_with_weight"])
+
+    for part in parts.values():
+        for n in part["nodes"]:
+            graph.add_node(n["id"], **{k: v for k, v in n.items() if k != "id"})
+        for e in part["edges"]:
+            graph.add_edge(e["source"], e["target"], **{k: v for k, v in e.items() if k not in ("source", "target")})
+    if nodes is not None:
+        graph = graph.subgraph(nodes).copy()
+        graph.graph["partial"] = {"parts": parts}
+    return graph
+
+
+async def get_graph(tenant_id, kb_id, exclude_rebuild=None, nodes: list[str] | None = None):
+    """
+    Load the knowledge graph of `kb_id`. With `nodes`, a partitioned graph is loaded partially: only
+    those nodes and the edges among them. Legacy and removed graphs are always loaded whole, since
+    set_graph writes them back in full.
+    """
     conds = {"fields": ["content_with_weight", "removed_kwd", "source_id"], "size": 1, "knowledge_graph_kwd": ["graph"]}
     res = await trio.to_thread.run_sync(settings.retrievaler.search, conds, search.index_name(tenant_id), [kb_id])
     if not res.total == 0:
         for id in res.ids:
             try:
                 if res.field[id]["removed_kwd"] == "N":
-                    g = json_graph.node_link_graph(json.loads(res.field[id]["content_with_weight"]), edges="edges")
+                    content = json.loads(res.field[id]["content_with_weight"])
+                    storage = content.get("graph", {})
+                    if storage.get("storage") == GRAPH_STORAGE:
+                        if "nodes" not in storage:
+                            # Manifests without a node count can only be loaded whole.
+                            nodes = None
+                        g = await load_graph_partitions(tenant_id, kb_id, storage["partitions"], nodes)
+                        g.graph["source_id"] = res.field[id]["source_id"]
+                        # The partitions hold this graph, so only changes need to be written back.
+                        g.graph["storage"] = GRAPH_STORAGE
+                        g.graph["partitions"] = storage["partitions"]
+                        if nodes is not None:
+                            # What set_graph needs to update the manifest without the rest of the graph.
+                            g.graph["partial"].update(
+                                {"source_id": list(g.graph["source_id"]), "snapshot": content, "nodes": storage["nodes"], "loaded": g.number_of_nodes()}
+                            )
+                        return g
+                    g = json_graph.node_link_graph(content, edges="edges")
                     if "source_id" not in g.graph:
                         g.graph["source_id"] = res.field[id]["source_id"]
                 else:
                     g = await rebuild_graph(tenant_id, kb_id, exclude_rebuild)
+                    storage = json.loads(res.field[id]["content_with_weight"]).get("graph", {})
+                    if g is not None and storage.get("storage") == GRAPH_STORAGE and sorted(g.graph["source_id"]) == sorted(res.field[id]["source_id"]):
+                        # Removing a document deletes only the partitions holding its nodes or edges,
+                        # so only those are written back.
+                        existing = await get_graph_partition_rows(tenant_id, kb_id, storage["partitions"], ["knowledge_graph_kwd"])
+                        g.graph["storage"] = GRAPH_STORAGE
+                        g.graph["partitions"] = storage["partitions"]
+                        g.graph["missing_partitions"] = {
+                            p for p in {graph_partition(n, storage["partitions"]) for n in g.nodes} if graph_partition_id(kb_id, p) not in existing
+                        }
                 return g
             except Exception:
                 continue
@@ -426,36 +587,69 @@ async def get_graph(tenant_id, kb_id, exclude_rebuild=None):
     return result
 
 
+def graph_snapshot(graph: nx.Graph, partitions: int) -> dict:
+    """The manifest content: storage info and the top nodes by pagerank with the edges between them."""
+    partial = graph.graph.get("partial")
+    if partial:
+        # Rank the loaded nodes together with the previous top nodes; a partial graph only adds nodes.
+        view = json_graph.node_link_graph(partial["snapshot"], edges="edges")
+        view.add_nodes_from(graph.nodes(data=True))
+        view.add_edges_from(graph.edges(data=True))
+        nodes = partial["nodes"] + graph.number_of_nodes() - partial["loaded"]
+    else:
+        view = graph
+        nodes = graph.number_of_nodes()
+    top = sorted(view.nodes, key=lambda n: view.nodes[n].get("pagerank", 0), reverse=True)[:GRAPH_SNAPSHOT_NODES]
+    snapshot = nx.node_link_data(view.subgraph(top), edges="edges")
+    snapshot["graph"] = {"storage": GRAPH_STORAGE, "partitions": partitions, "nodes": nodes, "source_id": graph.graph.get("source_id", [])}
+    return snapshot
+
+
 async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, change: GraphChange, callback):
     global chat_limiter
     start = trio.current_time()
 
-    await trio.to_thread.run_sync(settings.docStoreConn.delete, {"knowledge_graph_kwd": ["graph", "subgraph"]}, search.index_name(tenant_id), kb_id)
+    # Graphs loaded from a legacy blob or rebuilt from subgraphs are written in full once.
+    full = graph.graph.get("storage") != GRAPH_STORAGE
+    partitions = GRAPH_PARTITIONS if full else graph.graph["partitions"]
 
     if change.removed_nodes:
         await trio.to_thread.run_sync(settings.docStoreConn.delete, {"knowledge_graph_kwd": ["entity"], "entity_kwd": sorted(change.removed_nodes)}, search.index_name(tenant_id), kb_id)
 
-    if change.removed_edges:
-
-        async def del_edges(from_node, to_node):
-            async with chat_limiter:
-                await trio.to_thread.run_sync(
-                    settings.docStoreConn.delete, {"knowledge_graph_kwd": ["relation"], "from_entity_kwd": from_node, "to_entity_kwd": to_node}, search.index_name(tenant_id), kb_id
-                )
+    async def del_edges(from_node, to_nodes):
+        async with chat_limiter:
+            await trio.to_thread.run_sync(
+                settings.docStoreConn.delete, {"knowledge_graph_kwd": ["relation"], "from_entity_kwd": from_node, "to_entity_kwd": to_nodes}, search.index_name(tenant_id), kb_id
+            )
 
+    if change.removed_edges:
         async with trio.open_nursery() as nursery:
             for from_node, to_node in change.removed_edges:
                 nursery.start_soon(del_edges, from_node, to_node)
 
+    # Entity and relation rows have stable ids now; drop the rows of updated ones written under random ids.
+    updated_nodes = sorted(change.added_updated_nodes)
+    for b in range(0, len(updated_nodes), 1024):
+        await trio.to_thread.run_sync(settings.docStoreConn.delete, {"knowledge_graph_kwd": ["entity"], "entity_kwd": updated_nodes[b : b + 1024]}, search.index_name(tenant_id), kb_id)
+    # Legacy relation rows may be stored in either direction; one delete per endpoint covers both.
+    updated_edges = defaultdict(set)
+    for from_node, to_node in change.added_updated_edges:
+        updated_edges[from_node].add(to_node)
+        updated_edges[to_node].add(from_node)
+    async with trio.open_nursery() as nursery:
+        for from_node, to_nodes in updated_edges.items():
+            nursery.start_soon(del_edges, from_node, sorted(to_nodes))
+
     now = trio.current_time()
     if callback:
         callback(msg=f"set_graph removed {len(change.removed_nodes)} nodes and {len(change.removed_edges)} edges from index in {now - start:.2f}s.")
     start = now
 
+    snapshot = graph_snapshot(graph, partitions)
     chunks = [
         {
             "id": get_uuid(),
-            "content_with_weight": json.dumps(nx.node_link_data(graph, edges="edges"), ensure_ascii=False),
+            "content_with_weight": json.dumps(snapshot, ensure_ascii=False),
             "knowledge_graph_kwd": "graph",
             "kb_id": kb_id,
             "source_id": graph.graph.get("source_id", []),
@@ -464,10 +658,72 @@ async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, chang
         }
     ]
 
-    # generate updated subgraphs
-    for source in graph.graph["source_id"]:
-        subgraph = graph.subgraph([n for n in graph.nodes if source in graph.nodes[n]["source_id"]]).copy()
-        subgraph.graph["source_id"] = [source]
+    # Rewrite the partitions holding a changed node or edge, or all of them. A partition row carries
+    # the documents of its nodes and edges, so removing a document deletes only the rows it touches.
+    node_parts = {n: graph_partition(n, partitions) for n in graph.nodes}
+    if full:
+        touched = set(range(partitions))
+    else:
+        touched = {graph_partition(n, partitions) for n in change.added_updated_nodes | change.removed_nodes}
+        touched |= {graph_partition(get_from_to(f, t)[0], partitions) for f, t in change.added_updated_edges | change.removed_edges}
+        touched |= graph.graph.get("missing_partitions", set())
+    partial = graph.graph.get("partial")
+    if partial and (change.removed_nodes or change.removed_edges or touched - partial["parts"].keys()):
+        raise ValueError("A partially loaded graph can only change nodes of the partitions it was loaded from.")
+    parts = {p: {"nodes": [], "edges": []} for p in touched}
+    part_sources = defaultdict(set)
+    for n, p in node_parts.items():
+        if p in parts:
+            parts[p]["nodes"].append({"id": n, **graph.nodes[n]})
+            part_sources[p].update(graph.nodes[n].get("source_id", []))
+    for f, t, attrs in graph.edges(data=True):
+        f, t = get_from_to(f, t)
+        p = node_parts[f]
+        if p in parts:
+            parts[p]["edges"].append({"source": f, "target": t, **attrs})
+            part_sources[p].update(attrs.get("source_id", []))
+    if partial:
+        # Keep what the partitions hold beyond the loaded nodes and the edges among them.
+        for p, part in parts.items():
+            stored = partial["parts"][p]
+            part["nodes"].extend(n for n in stored["nodes"] if not graph.has_node(n["id"]))
+            part["edges"].extend(e for e in stored["edges"] if not graph.has_edge(e["source"], e["target"]))
+            for item in stored["nodes"] + stored["edges"]:
+                part_sources[p].update(item.get("source_id", []))
+    empty_parts = sorted(graph_partition_id(kb_id, p) for p, part in parts.items() if not part["nodes"] and not part["edges"])
+    parts = {p: part for p, part in parts.items() if part["nodes"] or part["edges"]}
+    for p, part in parts.items():
+        chunks.append(
+            {
+                "id": graph_partition_id(kb_id, p),
+                "content_with_weight": json.dumps(part, ensure_ascii=False),
+                "knowledge_graph_kwd": "graph_part",
+                "kb_id": kb_id,
+                "source_id": sorted(part_sources[p]),
+                "available_int": 0,
+                "removed_kwd": "N",
+            }
+        )
+
+    # Regenerate the subgraphs of the documents a changed node or edge comes from; rebuild_graph
+    # composes them when a document is removed.
+    if full:
+        sources = set(graph.graph["source_id"])
+    else:
+        sources = {s for n in change.added_updated_nodes if graph.has_node(n) for s in graph.nodes[n]["source_id"]}
+        sources |= {s for f, t in change.added_updated_edges if graph.has_edge(f, t) for s in set(graph.nodes[f]["source_id"]) & set(graph.nodes[t]["source_id"])}
+        sources &= set(graph.graph["source_id"])
+        if partial:
+            # Only the new documents have all their nodes loaded.
+            sources -= set(partial["source_id"])
+    source_nodes = defaultdict(list)
+    for n, attrs in graph.nodes(data=True):
+        for source in attrs["source_id"]:
+            if source in sources:
+                source_nodes[source].append(n)
+    for source in sorted(sources):
+        subgraph = graph.subgraph(source_nodes[source]).copy()
+        subgraph.graph = {"source_id": [source]}
         for n in subgraph.nodes:
             subgraph.nodes[n]["source_id"] = [source]
         chunks.append(
@@ -482,38 +738,57 @@ async def set_graph(tenant_id: str, kb_id: str, embd_mdl, graph: nx.Graph, chang
             }
         )
 
-    async with trio.open_nursery() as nursery:
-        for ii, node in enumerate(change.added_updated_nodes):
-            node_attrs = graph.nodes[node]
-            nursery.start_soon(graph_node_to_chunk, kb_id, embd_mdl, node, node_attrs, chunks)
-            if ii % 100 == 9 and callback:
-                callback(msg=f"Get embedding of nodes: {ii}/{len(change.added_updated_nodes)}")
-
-    async with trio.open_nursery() as nursery:
-        for ii, (from_node, to_node) in enumerate(change.added_updated_edges):
+    await trio.to_thread.run_sync(settings.docStoreConn.delete, {"knowledge_graph_kwd": ["graph"]}, search.index_name(tenant_id), kb_id)
+    if full:
+        await trio.to_thread.run_sync(settings.docStoreConn.delete, {"knowledge_graph_kwd": ["subgraph", "graph_part"]}, search.index_name(tenant_id), kb_id)
+    else:
+        if sources:
+            await trio.to_thread.run_sync(settings.docStoreConn.delete, {"knowledge_graph_kwd": ["subgraph"], "source_id": sorted(sources)}, search.index_name(tenant_id), kb_id)
+        if empty_parts:
+            await trio.to_thread.run_sync(settings.docStoreConn.delete, {"id": empty_parts}, search.index_name(tenant_id), kb_id)
+
+    def build_graph_chunks():
+        ents, keys, texts = [], [], []
+        for node in change.added_updated_nodes:
+            ents.append(graph_node_to_chunk(kb_id, node, graph.nodes[node]))
+            keys.append(node)
+            texts.append(node)
+        for from_node, to_node in change.added_updated_edges:
             edge_attrs = graph.get_edge_data(from_node, to_node)
             if not edge_attrs:
                 # added_updated_edges could record a non-existing edge if both from_node and to_node participate in nodes merging.
                 continue
-            nursery.start_soon(graph_edge_to_chunk, kb_id, embd_mdl, from_node, to_node, edge_attrs, chunks)
-            if ii % 100 == 9 and callback:
-                callback(msg=f"Get embedding of edges: {ii}/{len(change.added_updated_edges)}")
+            ents.append(graph_edge_to_chunk(kb_id, from_node, to_node, edge_attrs))
+            keys.append(f"{from_node}->{to_node}")
+            texts.append(f"{from_node}->{to_node}: {edge_attrs['description']}")
+        return ents, keys, texts
+
+    ents, keys, texts = await trio.to_thread.run_sync(build_graph_chunks)
+    if callback:
+        callback(msg=f"Get embedding of {len(change.added_updated_nodes)} nodes and {len(ents) - len(change.added_updated_nodes)} edges.")
+    await embed_graph_chunks(embd_mdl, ents, keys, texts)
+    chunks.extend(ents)
 
     now = trio.current_time()
     if callback:
-        callback(msg=f"set_graph converted graph change to {len(chunks)} chunks in {now - start:.2f}s.")
+        callback(msg=f"set_graph converted graph change to {len(chunks)} chunks ({len(parts)}/{partitions} partitions, {len(sources)} subgraphs) in {now - start:.2f}s.")
     start = now
 
     enable_timeout_assertion = os.environ.get("ENABLE_TIMEOUT_ASSERTION")
-    es_bulk_size = 4
-    for b in range(0, len(chunks), es_bulk_size):
+    for b in range(0, len(chunks), GRAPH_BULK_SIZE):
         with trio.fail_after(3 if enable_timeout_assertion else 30000000):
-            doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert(chunks[b : b + es_bulk_size], search.index_name(tenant_id), kb_id))
-        if b % 100 == es_bulk_size and callback:
+            doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert(chunks[b : b + GRAPH_BULK_SIZE], search.index_name(tenant_id), kb_id))
+        if b % (GRAPH_BULK_SIZE * 16) == 0 and callback:
             callback(msg=f"Insert chunks: {b}/{len(chunks)}")
         if doc_store_result:
             error_message = f"Insert chunk error: {doc_store_result}, please check log file and Elasticsearch/Infinity status!"
             raise Exception(error_message)
+    graph.graph["storage"] = GRAPH_STORAGE
+    graph.graph["partitions"] = partitions
+    graph.graph.pop("missing_partitions", None)
+    if partial:
+        partial["parts"].update(parts)
+        partial.update({"source_id": list(graph.graph["source_id"]), "snapshot": snapshot, "nodes": snapshot["graph"]["nodes"], "loaded": graph.number_of_nodes()})
     now = trio.current_time()
     if callback:
         callback(msg=f"set_graph added/updated {len(change.added_updated_nodes)} nodes and {len(change.added_updated_edges)} edges from index in {now - start:.2f}s.")
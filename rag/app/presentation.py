@@ -23,7 +23,7 @@ from PIL import Image
 from api.db import LLMType
 from api.db.services.llm_service import LLMBundle
 from deepdoc.parser.pdf_parser import VisionParser
-from rag.nlp import tokenize, is_english
+from rag.nlp import tokenize_batch, is_english
 from rag.nlp import rag_tokenizer
 from deepdoc.parser import PdfParser, PptParser, PlainParser
 from PyPDF2 import PdfReader as pdf2_read
@@ -114,6 +114,7 @@ def chunk(filename, binary=None, from_page=0, to_page=100000,
     }
     doc["title_sm_tks"] = rag_tokenizer.fine_grained_tokenize(doc["title_tks"])
     res = []
+    txts = []
     if re.search(r"\.pptx?$", filename, re.IGNORECASE):
         ppt_parser = Ppt()
         for pn, (txt, img) in enumerate(ppt_parser(
@@ -125,8 +126,9 @@ def chunk(filename, binary=None, from_page=0, to_page=100000,
             d["page_num_int"] = [pn + 1]
             d["top_int"] = [0]
             d["position_int"] = [(pn + 1, 0, img.size[0], 0, img.size[1])]
-            tokenize(d, txt, eng)
             res.append(d)
+            txts.append(txt)
+        tokenize_batch(res, txts, eng)
         return res
     elif re.search(r"\.pdf$", filename, re.IGNORECASE):
         layout_recognizer = parser_config.get("layout_recognize", "DeepDOC")
@@ -152,8 +154,9 @@ def chunk(filename, binary=None, from_page=0, to_page=100000,
             d["page_num_int"] = [pn + 1]
             d["top_int"] = [0]
             d["position_int"] = [(pn + 1, 0, img.size[0] if img else 0, 0, img.size[1] if img else 0)]
-            tokenize(d, txt, eng)
             res.append(d)
+            txts.append(txt)
+        tokenize_batch(res, txts, eng)
         return res
 
     raise NotImplementedError(
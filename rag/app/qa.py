@@ -264,13 +264,14 @@ def rmPrefix(txt):
         r"^(问题|答案|回答|user|assistant|Q|A|Question|Answer|问|答)[\t:： ]+", "", txt.strip(), flags=re.IGNORECASE)
 
 
-def beAdocPdf(d, q, a, eng, image, poss):
+def beAdocPdf(d, q, a, eng, image, poss, tokenize=True):
     qprefix = "Question: " if eng else "问题："
     aprefix = "Answer: " if eng else "回答："
     d["content_with_weight"] = "\t".join(
         [qprefix + rmPrefix(q), aprefix + rmPrefix(a)])
-    d["content_ltks"] = rag_tokenizer.tokenize(q)
-    d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
+    if tokenize:
+        d["content_ltks"] = rag_tokenizer.tokenize(q)
+        d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
     if image:
         d["image"] = image
         d["doc_type_kwd"] = "image"
@@ -278,13 +279,14 @@ def beAdocPdf(d, q, a, eng, image, poss):
     return d
 
 
-def beAdocDocx(d, q, a, eng, image, row_num=-1):
+def beAdocDocx(d, q, a, eng, image, row_num=-1, tokenize=True):
     qprefix = "Question: " if eng else "问题："
     aprefix = "Answer: " if eng else "回答："
     d["content_with_weight"] = "\t".join(
         [qprefix + rmPrefix(q), aprefix + rmPrefix(a)])
-    d["content_ltks"] = rag_tokenizer.tokenize(q)
-    d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
+    if tokenize:
+        d["content_ltks"] = rag_tokenizer.tokenize(q)
+        d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
     if image:
         d["image"] = image
         d["doc_type_kwd"] = "image"
@@ -293,18 +295,28 @@ def beAdocDocx(d, q, a, eng, image, row_num=-1):
     return d
 
 
-def beAdoc(d, q, a, eng, row_num=-1):
+def beAdoc(d, q, a, eng, row_num=-1, tokenize=True):
     qprefix = "Question: " if eng else "问题："
     aprefix = "Answer: " if eng else "回答："
     d["content_with_weight"] = "\t".join(
         [qprefix + rmPrefix(q), aprefix + rmPrefix(a)])
-    d["content_ltks"] = rag_tokenizer.tokenize(q)
-    d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
+    if tokenize:
+        d["content_ltks"] = rag_tokenizer.tokenize(q)
+        d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
     if row_num >= 0:
         d["top_int"] = [row_num]
     return d
 
 
+def tokenize_questions(res, qs):
+    """Tokenize the questions of the docs built with `tokenize=False`, the last len(qs) of `res`, in one batch."""
+    docs = res[len(res) - len(qs):]
+    for d, (ltks, sm_ltks) in zip(docs, rag_tokenizer.tokenize_batch(qs, fine_grained=True)):
+        d["content_ltks"] = ltks
+        d["content_sm_ltks"] = sm_ltks
+    return res
+
+
 def mdQuestionLevel(s):
     match = re.match(r'#*', s)
     return (len(match.group(0)), s.lstrip('#').lstrip()) if match else (0, s)
@@ -324,6 +336,7 @@ def chunk(filename, binary=None, from_page=0, to_page=100000, lang="Chinese", ca
     """
     eng = lang.lower() == "english"
     res = []
+    qs = []
     doc = {
         "docnm_kwd": filename,
         "title_tks": rag_tokenizer.tokenize(re.sub(r"\.[a-zA-Z]+$", "", filename))
@@ -332,8 +345,9 @@ def chunk(filename, binary=None, from_page=0, to_page=100000, lang="Chinese", ca
         callback(0.1, "Start to parse.")
         excel_parser = Excel()
         for ii, (q, a) in enumerate(excel_parser(filename, binary, callback)):
-            res.append(beAdoc(deepcopy(doc), q, a, eng, ii))
-        return res
+            res.append(beAdoc(deepcopy(doc), q, a, eng, ii, tokenize=False))
+            qs.append(q)
+        return tokenize_questions(res, qs)
 
     elif re.search(r"\.(txt)$", filename, re.IGNORECASE):
         callback(0.1, "Start to parse.")
@@ -359,7 +373,8 @@ def chunk(filename, binary=None, from_page=0, to_page=100000, lang="Chinese", ca
                     fails.append(str(i+1))
             elif len(arr) == 2:
                 if question and answer:
-                    res.append(beAdoc(deepcopy(doc), question, answer, eng, i))
+                    res.append(beAdoc(deepcopy(doc), question, answer, eng, i, tokenize=False))
+                    qs.append(question)
                 question, answer = arr
             i += 1
             if len(res) % 999 == 0:
@@ -367,12 +382,13 @@ def chunk(filename, binary=None, from_page=0, to_page=100000, lang="Chinese", ca
                     f"{len(fails)} failure, line: %s..." % (",".join(fails[:3])) if fails else "")))
 
         if question:
-            res.append(beAdoc(deepcopy(doc), question, answer, eng, len(lines)))
+            res.append(beAdoc(deepcopy(doc), question, answer, eng, len(lines), tokenize=False))
+            qs.append(question)
 
         callback(0.6, ("Extract Q&A: {}".format(len(res)) + (
             f"{len(fails)} failure, line: %s..." % (",".join(fails[:3])) if fails else "")))
 
-        return res
+        return tokenize_questions(res, qs)
 
     elif re.search(r"\.(csv)$", filename, re.IGNORECASE):
         callback(0.1, "Start to parse.")
@@ -393,18 +409,20 @@ def chunk(filename, binary=None, from_page=0, to_page=100000, lang="Chinese", ca
                     fails.append(str(i + 1))
             elif len(row) == 2:
                 if question and answer:
-                    res.append(beAdoc(deepcopy(doc), question, answer, eng, i))
+                    res.append(beAdoc(deepcopy(doc), question, answer, eng, i, tokenize=False))
+                    qs.append(question)
                 question, answer = row
             if len(res) % 999 == 0:
                 callback(len(res) * 0.6 / len(lines), ("Extract Q&A: {}".format(len(res)) + (
                     f"{len(fails)} failure, line: %s..." % (",".join(fails[:3])) if fails else "")))
 
         if question:
-            res.append(beAdoc(deepcopy(doc), question, answer, eng, len(list(reader))))
+            res.append(beAdoc(deepcopy(doc), question, answer, eng, len(list(reader)), tokenize=False))
+            qs.append(question)
 
         callback(0.6, ("Extract Q&A: {}".format(len(res)) + (
             f"{len(fails)} failure, line: %s..." % (",".join(fails[:3])) if fails else "")))
-        return res
+        return tokenize_questions(res, qs)
 
     elif re.search(r"\.pdf$", filename, re.IGNORECASE):
         callback(0.1, "Start to parse.")
@@ -412,8 +430,9 @@ def chunk(filename, binary=None, from_page=0, to_page=100000, lang="Chinese", ca
         qai_list, tbls = pdf_parser(filename if not binary else binary,
                                     from_page=from_page, to_page=to_page, callback=callback)
         for q, a, image, poss in qai_list:
-            res.append(beAdocPdf(deepcopy(doc), q, a, eng, image, poss))
-        return res
+            res.append(beAdocPdf(deepcopy(doc), q, a, eng, image, poss, tokenize=False))
+            qs.append(q)
+        return tokenize_questions(res, qs)
 
     elif re.search(r"\.(md|markdown)$", filename, re.IGNORECASE):
         callback(0.1, "Start to parse.")
@@ -435,7 +454,8 @@ def chunk(filename, binary=None, from_page=0, to_page=100000, lang="Chinese", ca
                 if last_answer.strip():
                     sum_question = '\n'.join(question_stack)
                     if sum_question:
-                        res.append(beAdoc(deepcopy(doc), sum_question, markdown(last_answer, extensions=['markdown.extensions.tables']), eng, index))
+                        res.append(beAdoc(deepcopy(doc), sum_question, markdown(last_answer, extensions=['markdown.extensions.tables']), eng, index, tokenize=False))
+                        qs.append(sum_question)
                     last_answer = ''
 
                 i = question_level
@@ -447,8 +467,9 @@ def chunk(filename, binary=None, from_page=0, to_page=100000, lang="Chinese", ca
         if last_answer.strip():
             sum_question = '\n'.join(question_stack)
             if sum_question:
-                res.append(beAdoc(deepcopy(doc), sum_question, markdown(last_answer, extensions=['markdown.extensions.tables']), eng, index))
-        return res
+                res.append(beAdoc(deepcopy(doc), sum_question, markdown(last_answer, extensions=['markdown.extensions.tables']), eng, index, tokenize=False))
+                qs.append(sum_question)
+        return tokenize_questions(res, qs)
 
     elif re.search(r"\.docx$", filename, re.IGNORECASE):
         docx_parser = Docx()
@@ -456,8 +477,9 @@ def chunk(filename, binary=None, from_page=0, to_page=100000, lang="Chinese", ca
                                     from_page=0, to_page=10000, callback=callback)
         res = tokenize_table(tbls, doc, eng)
         for i, (q, a, image) in enumerate(qai_list):
-            res.append(beAdocDocx(deepcopy(doc), q, a, eng, image, i))
-        return res
+            res.append(beAdocDocx(deepcopy(doc), q, a, eng, image, i, tokenize=False))
+            qs.append(q)
+        return tokenize_questions(res, qs)
 
     raise NotImplementedError(
         "Excel, csv(txt), pdf, markdown and docx format files are supported.")
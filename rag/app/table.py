@@ -27,7 +27,7 @@ from dateutil.parser import parse as datetime_parse
 
 from api.db.services.knowledgebase_service import KnowledgebaseService
 from deepdoc.parser.utils import get_text
-from rag.nlp import rag_tokenizer, tokenize
+from rag.nlp import rag_tokenizer, tokenize_batch
 from deepdoc.parser import ExcelParser
 
 
@@ -369,8 +369,10 @@ def chunk(filename, binary=None, from_page=0, to_page=10000000000, lang="Chinese
         clmns_map = [(py_clmns[i].lower() + fieds_map[clmn_tys[i]], str(clmns[i]).replace("_", " ")) for i in range(len(clmns))]
 
         eng = lang.lower() == "english"  # is_english(txts)
+        title_tks = rag_tokenizer.tokenize(re.sub(r"\.[a-zA-Z]+$", "", filename))
+        docs, row_txts = [], []
         for ii, row in df.iterrows():
-            d = {"docnm_kwd": filename, "title_tks": rag_tokenizer.tokenize(re.sub(r"\.[a-zA-Z]+$", "", filename))}
+            d = {"docnm_kwd": filename, "title_tks": title_tks}
             row_txt = []
             for j in range(len(clmns)):
                 if row[clmns[j]] is None:
@@ -384,8 +386,10 @@ def chunk(filename, binary=None, from_page=0, to_page=10000000000, lang="Chinese
                 row_txt.append("{}:{}".format(clmns[j], row[clmns[j]]))
             if not row_txt:
                 continue
-            tokenize(d, "; ".join(row_txt), eng)
-            res.append(d)
+            docs.append(d)
+            row_txts.append("; ".join(row_txt))
+        tokenize_batch(docs, row_txts, eng)
+        res.extend(docs)
 
         KnowledgebaseService.update_parser_config(kwargs["kb_id"], {"field_map": {k: v for k, v in clmns_map}})
     callback(0.35, "")
@@ -19,14 +19,15 @@ import csv
 from copy import deepcopy
 
 from deepdoc.parser.utils import get_text
-from rag.app.qa import Excel
+from rag.app.qa import Excel, tokenize_questions
 from rag.nlp import rag_tokenizer
 
 
-def beAdoc(d, q, a, eng, row_num=-1):
+def beAdoc(d, q, a, eng, row_num=-1, tokenize=True):
     d["content_with_weight"] = q
-    d["content_ltks"] = rag_tokenizer.tokenize(q)
-    d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
+    if tokenize:
+        d["content_ltks"] = rag_tokenizer.tokenize(q)
+        d["content_sm_ltks"] = rag_tokenizer.fine_grained_tokenize(d["content_ltks"])
     d["tag_kwd"] = [t.strip().replace(".", "_") for t in a.split(",") if t.strip()]
     if row_num >= 0:
         d["top_int"] = [row_num]
@@ -47,6 +48,7 @@ def chunk(filename, binary=None, lang="Chinese", callback=None, **kwargs):
     """
     eng = lang.lower() == "english"
     res = []
+    qs = []
     doc = {
         "docnm_kwd": filename,
         "title_tks": rag_tokenizer.tokenize(re.sub(r"\.[a-zA-Z]+$", "", filename))
@@ -55,8 +57,9 @@ def chunk(filename, binary=None, lang="Chinese", callback=None, **kwargs):
         callback(0.1, "Start to parse.")
         excel_parser = Excel()
         for ii, (q, a) in enumerate(excel_parser(filename, binary, callback)):
-            res.append(beAdoc(deepcopy(doc), q, a, eng, ii))
-        return res
+            res.append(beAdoc(deepcopy(doc), q, a, eng, ii, tokenize=False))
+            qs.append(q)
+        return tokenize_questions(res, qs)
 
     elif re.search(r"\.(txt)$", filename, re.IGNORECASE):
         callback(0.1, "Start to parse.")
@@ -79,7 +82,8 @@ def chunk(filename, binary=None, lang="Chinese", callback=None, **kwargs):
                 content += "\n" + lines[i]
             elif len(arr) == 2:
                 content += "\n" + arr[0]
-                res.append(beAdoc(deepcopy(doc), content, arr[1], eng, i))
+                res.append(beAdoc(deepcopy(doc), content, arr[1], eng, i, tokenize=False))
+                qs.append(content)
                 content = ""
             i += 1
             if len(res) % 999 == 0:
@@ -89,7 +93,7 @@ def chunk(filename, binary=None, lang="Chinese", callback=None, **kwargs):
         callback(0.6, ("Extract TAG: {}".format(len(res)) + (
             f"{len(fails)} failure, line: %s..." % (",".join(fails[:3])) if fails else "")))
 
-        return res
+        return tokenize_questions(res, qs)
 
     elif re.search(r"\.(csv)$", filename, re.IGNORECASE):
         callback(0.1, "Start to parse.")
@@ -107,7 +111,8 @@ def chunk(filename, binary=None, lang="Chinese", callback=None, **kwargs):
                 content += "\n" + lines[i]
             elif len(row) == 2:
                 content += "\n" + row[0]
-                res.append(beAdoc(deepcopy(doc), content, row[1], eng, i))
+                res.append(beAdoc(deepcopy(doc), content, row[1], eng, i, tokenize=False))
+                qs.append(content)
                 content = ""
             if len(res) % 999 == 0:
                 callback(len(res) * 0.6 / len(lines), ("Extract Tags: {}".format(len(res)) + (
@@ -115,7 +120,7 @@ def chunk(filename, binary=None, lang="Chinese", callback=None, **kwargs):
 
         callback(0.6, ("Extract TAG : {}".format(len(res)) + (
             f"{len(fails)} failure, line: %s..." % (",".join(fails[:3])) if fails else "")))
-        return res
+        return tokenize_questions(res, qs)
 
     raise NotImplementedError(
         "Excel, csv(txt) format files are supported.")
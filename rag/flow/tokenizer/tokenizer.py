@@ -16,20 +16,14 @@ import logging
 import random
 import re
 
-import numpy as np
-import trio
-
 from api.db import LLMType
 from api.db.services.knowledgebase_service import KnowledgebaseService
 from api.db.services.llm_service import LLMBundle
 from api.db.services.user_service import TenantService
-from api.utils.api_utils import timeout
 from rag.flow.base import ProcessBase, ProcessParamBase
 from rag.flow.tokenizer.schema import TokenizerFromUpstream
 from rag.nlp import rag_tokenizer
-from rag.settings import EMBEDDING_BATCH_SIZE
-from rag.svr.task_executor import embed_limiter
-from rag.utils import truncate
+from rag.utils.embedding_scheduler import get_embedding_scheduler
 
 
 class TokenizerParam(ProcessParamBase):
@@ -67,33 +61,18 @@ class Tokenizer(ProcessBase):
                 texts.append(re.sub(r"</?(table|td|caption|tr|th)( [^<>]{0,12})?>", " ", c["text"]))
         vts, c = embedding_model.encode([name])
         token_count += c
-        tts = np.concatenate([vts[0] for _ in range(len(texts))], axis=0)
-
-        @timeout(60)
-        def batch_encode(txts):
-            nonlocal embedding_model
-            return embedding_model.encode([truncate(c, embedding_model.max_length - 10) for c in txts])
-
-        cnts_ = np.array([])
-        for i in range(0, len(texts), EMBEDDING_BATCH_SIZE):
-            async with embed_limiter:
-                vts, c = await trio.to_thread.run_sync(lambda: batch_encode(texts[i : i + EMBEDDING_BATCH_SIZE]))
-            if len(cnts_) == 0:
-                cnts_ = vts
-            else:
-                cnts_ = np.concatenate((cnts_, vts), axis=0)
-            token_count += c
-            if i % 33 == 32:
-                self.callback(i * 1.0 / len(texts) / parts / EMBEDDING_BATCH_SIZE + 0.5 * (parts - 1))
-
-        cnts = cnts_
+        title_vec = vts[0]
         title_w = float(self._param.filename_embd_weight)
-        vects = (title_w * tts + (1 - title_w) * cnts) if len(tts) == len(cnts) else cnts
 
-        assert len(vects) == len(chunks)
-        for i, ck in enumerate(chunks):
-            v = vects[i].tolist()
-            ck["q_%d_vec" % len(v)] = v
+        async def on_batch(start, vts):
+            vects = title_w * title_vec + (1 - title_w) * vts
+            for ck, v in zip(chunks[start: start + len(vts)], vects):
+                v = v.tolist()
+                ck["q_%d_vec" % len(v)] = v
+            self.callback((start + len(vts)) * 1.0 / len(texts) / parts + 0.5 * (parts - 1))
+
+        _, c = await get_embedding_scheduler(embedding_model).encode(embedding_model, texts, on_batch)
+        token_count += c
         return chunks, token_count
 
     async def _invoke(self, **kwargs):
@@ -19,8 +19,10 @@ import logging
 import os
 import random
 import re
+import threading
 import time
 from abc import ABC
+from collections import OrderedDict
 from copy import deepcopy
 from typing import Any, Protocol
 from urllib.parse import urljoin
@@ -28,15 +30,16 @@ from urllib.parse import urljoin
 import json_repair
 import litellm
 import openai
-import requests
-from openai import OpenAI
-from openai.lib.azure import AzureOpenAI
+import trio
+from openai import AsyncOpenAI, OpenAI
+from openai.lib.azure import AsyncAzureOpenAI, AzureOpenAI
 from strenum import StrEnum
 from zhipuai import ZhipuAI
 
 from rag.llm import FACTORY_DEFAULT_BASE_URL, LITELLM_PROVIDER_PREFIX, SupportedLiteLLMProvider
 from rag.nlp import is_chinese, is_english
 from rag.utils import num_tokens_from_string
+from rag.utils import http_session
 
 
 # Error message constants
@@ -64,6 +67,65 @@ ERROR_PREFIX = "**ERROR**"
 LENGTH_NOTIFICATION_CN = "······\n由于大模型的上下文窗口大小限制，回答已经被大模型截断。"
 LENGTH_NOTIFICATION_EN = "...\nThe answer is truncated by your chosen LLM due to its limitation on context length."
 
+LLM_ASYNC_CONCURRENCY = int(os.environ.get("LLM_ASYNC_CONCURRENCY", 32))
+LLM_ASYNC_MAX_CLIENTS = int(os.environ.get("LLM_ASYNC_MAX_CLIENTS", 64))
+
+# Async clients and concurrency limiters only live as long as the trio run that created them,
+# so both are keyed by the run's token and the least recently used ones are dropped. A client is
+# closed when its run ends, so short-lived runs do not leave connection pools behind.
+_ASYNC_CLIENTS = OrderedDict()
+_ASYNC_LIMITERS = OrderedDict()
+_ASYNC_LOCK = threading.Lock()
+
+
+def _get_run_scoped(cache: OrderedDict, key, create):
+    key = (key, trio.lowlevel.current_trio_token())
+    with _ASYNC_LOCK:
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+        cache[key] = obj = create()
+        while len(cache) > LLM_ASYNC_MAX_CLIENTS:
+            cache.popitem(last=False)
+        return obj
+
+
+async def _close_at_run_end(client):
+    try:
+        await trio.sleep_forever()
+    finally:
+        with trio.CancelScope(shield=True):
+            try:
+                await client.close()
+            except Exception:
+                logging.exception("Can't close the async LLM client")
+
+
+def get_async_limiter(mdl) -> trio.CapacityLimiter:
+    """Return the limiter capping the concurrent async calls made to the provider and endpoint of `mdl`."""
+    base_url = getattr(mdl, "base_url", None) or getattr(getattr(mdl, "client", None), "base_url", "")
+    return _get_run_scoped(_ASYNC_LIMITERS, (type(mdl).__name__, str(base_url)), lambda: trio.CapacityLimiter(LLM_ASYNC_CONCURRENCY))
+
+
+async def chat_in_thread(mdl, system, history, gen_conf={}, **kwargs):
+    """Run the blocking `chat` of a provider without a native async client in a worker thread."""
+    async with get_async_limiter(mdl):
+        return await trio.to_thread.run_sync(lambda: mdl.chat(system, history, gen_conf, **kwargs))
+
+
+async def stream_in_thread(mdl, gen):
+    """Drive the blocking generator `gen` of `mdl` from a worker thread, one item at a time."""
+    done = object()
+    try:
+        async with get_async_limiter(mdl):
+            while True:
+                item = await trio.to_thread.run_sync(next, gen, done)
+                if item is done:
+                    return
+                yield item
+    finally:
+        gen.close()
+
 
 class ToolCallSession(Protocol):
     def tool_call(self, name: str, arguments: dict[str, Any]) -> str: ...
@@ -144,7 +206,9 @@ class Base(ABC):
         if self.model_name.lower().find("qwen3") >= 0:
             kwargs["extra_body"] = {"enable_thinking": False}
         response = self.client.chat.completions.create(model=self.model_name, messages=history, **gen_conf, **kwargs)
+        return self._chat_answer(response)
 
+    def _chat_answer(self, response):
         if any([not response.choices, not response.choices[0].message, not response.choices[0].message.content]):
             return "", 0
         ans = response.choices[0].message.content.strip()
@@ -159,35 +223,80 @@ class Base(ABC):
         for resp in response:
             if not resp.choices:
                 continue
-            if not resp.choices[0].delta.content:
-                resp.choices[0].delta.content = ""
-            if kwargs.get("with_reasoning", True) and hasattr(resp.choices[0].delta, "reasoning_content") and resp.choices[0].delta.reasoning_content:
-                ans = ""
-                if not reasoning_start:
-                    reasoning_start = True
-                    ans = "<think>"
-                ans += resp.choices[0].delta.reasoning_content + "</think>"
-            else:
-                reasoning_start = False
-                ans = resp.choices[0].delta.content
+            ans, tol, reasoning_start = self._stream_delta(resp, reasoning_start, kwargs.get("with_reasoning", True))
+            yield ans, tol
 
-            tol = self.total_token_count(resp)
-            if not tol:
-                tol = num_tokens_from_string(resp.choices[0].delta.content)
+    def _stream_delta(self, resp, reasoning_start, with_reasoning=True):
+        if not resp.choices[0].delta.content:
+            resp.choices[0].delta.content = ""
+        if with_reasoning and hasattr(resp.choices[0].delta, "reasoning_content") and resp.choices[0].delta.reasoning_content:
+            ans = ""
+            if not reasoning_start:
+                reasoning_start = True
+                ans = "<think>"
+            ans += resp.choices[0].delta.reasoning_content + "</think>"
+        else:
+            reasoning_start = False
+            ans = resp.choices[0].delta.content
 
-            if resp.choices[0].finish_reason == "length":
-                if is_chinese(ans):
-                    ans += LENGTH_NOTIFICATION_CN
-                else:
-                    ans += LENGTH_NOTIFICATION_EN
-            yield ans, tol
+        tol = self.total_token_count(resp)
+        if not tol:
+            tol = num_tokens_from_string(resp.choices[0].delta.content)
+
+        if resp.choices[0].finish_reason == "length":
+            if is_chinese(ans):
+                ans += LENGTH_NOTIFICATION_CN
+            else:
+                ans += LENGTH_NOTIFICATION_EN
+        return ans, tol, reasoning_start
+
+    def _new_async_client(self):
+        """Return an async client talking to the same endpoint as `self.client`, or None if there is none."""
+        if type(self.client) is not OpenAI:
+            return None
+        return AsyncOpenAI(api_key=self.client.api_key, base_url=self.client.base_url, timeout=self.client.timeout, max_retries=self.client.max_retries)
+
+    def _async_client(self):
+        def create():
+            client = self._new_async_client()
+            if client is not None:
+                trio.lowlevel.spawn_system_task(_close_at_run_end, client)
+            return client
+
+        key = (type(self).__name__, str(getattr(self.client, "base_url", "")), getattr(self.client, "api_key", None))
+        return _get_run_scoped(_ASYNC_CLIENTS, key, create)
+
+    def _has_native_async(self, *methods):
+        """Whether `methods` are Base's OpenAI-compatible ones, so the async client can stand in for them."""
+        cls = type(self)
+        return all(getattr(cls, m) is getattr(Base, m) for m in methods) and self._async_client() is not None
+
+    async def _async_chat(self, history, gen_conf, **kwargs):
+        logging.info("[HISTORY]" + json.dumps(history, ensure_ascii=False, indent=2))
+        if self.model_name.lower().find("qwen3") >= 0:
+            kwargs["extra_body"] = {"enable_thinking": False}
+        async with get_async_limiter(self):
+            response = await self._async_client().chat.completions.create(model=self.model_name, messages=history, **gen_conf, **kwargs)
+        return self._chat_answer(response)
+
+    async def _async_chat_streamly(self, history, gen_conf, **kwargs):
+        logging.info("[HISTORY STREAMLY]" + json.dumps(history, ensure_ascii=False, indent=4))
+        reasoning_start = False
+        async with get_async_limiter(self):
+            response = await self._async_client().chat.completions.create(model=self.model_name, messages=history, stream=True, **gen_conf, stop=kwargs.get("stop"))
+            async for resp in response:
+                if not resp.choices:
+                    continue
+                ans, tol, reasoning_start = self._stream_delta(resp, reasoning_start, kwargs.get("with_reasoning", True))
+                yield ans, tol
 
     def _length_stop(self, ans):
         if is_chinese([ans]):
             return ans + LENGTH_NOTIFICATION_CN
         return ans + LENGTH_NOTIFICATION_EN
 
-    def _exceptions(self, e, attempt):
+    def _error_or_delay(self, e, attempt):
+        """Return the error message to give up with, or None and the delay before the next attempt."""
         logging.exception("OpenAI chat_with_tools")
         # Classify the error
         error_code = self._classify_error(e)
@@ -197,12 +306,24 @@ class Base(ABC):
         # Check if it's a rate limit error or server error and not the last attempt
         should_retry = error_code == LLMErrorCode.ERROR_RATE_LIMIT or error_code == LLMErrorCode.ERROR_SERVER
         if not should_retry:
-            return f"{ERROR_PREFIX}: {error_code} - {str(e)}"
+            return f"{ERROR_PREFIX}: {error_code} - {str(e)}", 0
 
         delay = self._get_delay()
         logging.warning(f"Error: {error_code}. Retrying in {delay:.2f} seconds... (Attempt {attempt + 1}/{self.max_retries})")
+        return None, delay
+
+    def _exceptions(self, e, attempt):
+        err, delay = self._error_or_delay(e, attempt)
+        if err:
+            return err
         time.sleep(delay)
 
+    async def _async_exceptions(self, e, attempt):
+        err, delay = self._error_or_delay(e, attempt)
+        if err:
+            return err
+        await trio.sleep(delay)
+
     def _verbose_tool_use(self, name, args, res):
         return "<tool_call>" + json.dumps({"name": name, "args": args, "result": res}, ensure_ascii=False, indent=2) + "</tool_call>"
 
@@ -441,6 +562,43 @@ class Base(ABC):
 
         yield total_tokens
 
+    async def async_chat(self, system, history, gen_conf={}, **kwargs):
+        """The non-blocking counterpart of `chat`, for many concurrent calls from one trio run."""
+        if not self._has_native_async("chat", "_chat"):
+            return await chat_in_thread(self, system, history, gen_conf, **kwargs)
+        if system and history and history[0].get("role") != "system":
+            history.insert(0, {"role": "system", "content": system})
+        gen_conf = self._clean_conf(gen_conf)
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self._async_chat(history, gen_conf, **kwargs)
+            except Exception as e:
+                e = await self._async_exceptions(e, attempt)
+                if e:
+                    return e, 0
+        assert False, "Shouldn't be here."
+
+    async def async_chat_streamly(self, system, history, gen_conf: dict = {}, **kwargs):
+        """The non-blocking counterpart of `chat_streamly`: yields the deltas, then the token count."""
+        if not self._has_native_async("chat_streamly", "_chat_streamly"):
+            async for item in stream_in_thread(self, self.chat_streamly(system, history, gen_conf, **kwargs)):
+                yield item
+            return
+        if system and history and history[0].get("role") != "system":
+            history.insert(0, {"role": "system", "content": system})
+        gen_conf = self._clean_conf(gen_conf)
+        ans = ""
+        total_tokens = 0
+        try:
+            async for delta_ans, tol in self._async_chat_streamly(history, gen_conf, **kwargs):
+                yield delta_ans
+                total_tokens += tol
+        except openai.APIError as e:
+            yield ans + "\n**ERROR**: " + str(e)
+
+        yield total_tokens
+
     def total_token_count(self, resp):
         try:
             return resp.usage.total_tokens
@@ -537,6 +695,10 @@ class AzureChat(Base):
         super().__init__(key, model_name, base_url, **kwargs)
         self.client = AzureOpenAI(api_key=api_key, azure_endpoint=base_url, api_version=api_version)
         self.model_name = model_name
+        self.azure_conf = {"api_key": api_key, "azure_endpoint": base_url, "api_version": api_version}
+
+    def _new_async_client(self):
+        return AsyncAzureOpenAI(**self.azure_conf)
 
 
 class BaiChuanChat(Base):
@@ -781,7 +943,7 @@ class MiniMaxChat(Base):
             "Content-Type": "application/json",
         }
         payload = json.dumps({"model": self.model_name, "messages": history, **gen_conf})
-        response = requests.request("POST", url=self.base_url, headers=headers, data=payload)
+        response = http_session.request("POST", url=self.base_url, headers=headers, data=payload)
         response = response.json()
         ans = response["choices"][0]["message"]["content"].strip()
         if response["choices"][0]["finish_reason"] == "length":
@@ -812,7 +974,7 @@ class MiniMaxChat(Base):
                     **gen_conf,
                 }
             )
-            response = requests.request(
+            response = http_session.request(
                 "POST",
                 url=self.base_url,
                 headers=headers,
@@ -1802,6 +1964,14 @@ class LiteLLMBase(ABC):
 
         yield total_tokens
 
+    async def async_chat(self, system, history, gen_conf={}, **kwargs):
+        # litellm's own async API is bound to asyncio, so the blocking call runs in a worker thread.
+        return await chat_in_thread(self, system, history, gen_conf, **kwargs)
+
+    async def async_chat_streamly(self, system, history, gen_conf: dict = {}, **kwargs):
+        async for item in stream_in_thread(self, self.chat_streamly(system, history, gen_conf, **kwargs)):
+            yield item
+
     def total_token_count(self, resp):
         try:
             return resp.usage.total_tokens
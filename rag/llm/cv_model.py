@@ -20,13 +20,13 @@ from abc import ABC
 from copy import deepcopy
 from io import BytesIO
 from urllib.parse import urljoin
-import requests
 from openai import OpenAI
 from openai.lib.azure import AzureOpenAI
 from zhipuai import ZhipuAI
 from rag.nlp import is_english
 from rag.prompts import vision_llm_describe_prompt
 from rag.utils import num_tokens_from_string
+from rag.utils import http_session
 
 
 class Base(ABC):
@@ -605,7 +605,7 @@ class NvidiaCV(Base):
 
     def describe(self, image):
         b64 = self.image2base64(image)
-        response = requests.post(
+        response = http_session.post(
             url=self.base_url,
             headers={
                 "accept": "application/json",
@@ -621,7 +621,7 @@ class NvidiaCV(Base):
         )
 
     def _request(self, msg, gen_conf={}):
-        response = requests.post(
+        response = http_session.post(
             url=self.base_url,
             headers={
                 "accept": "application/json",
@@ -17,14 +17,16 @@ import json
 import logging
 import os
 import re
+import queue
 import threading
+import time
 from abc import ABC
+from concurrent.futures import Future
 from urllib.parse import urljoin
 
 import dashscope
 import google.generativeai as genai
 import numpy as np
-import requests
 from huggingface_hub import snapshot_download
 from ollama import Client
 from openai import OpenAI
@@ -34,6 +36,7 @@ from api import settings
 from api.utils.file_utils import get_home_cache_dir
 from api.utils.log_utils import log_exception
 from rag.utils import num_tokens_from_string, truncate
+from rag.utils import http_session
 
 
 class Base(ABC):
@@ -63,11 +66,126 @@ class Base(ABC):
         return 0
 
 
+LOCAL_EMBEDDING_BATCH_WINDOW = float(os.environ.get("LOCAL_EMBEDDING_BATCH_WINDOW_MS", 5)) / 1000
+LOCAL_EMBEDDING_MAX_BATCH_SIZE = int(os.environ.get("LOCAL_EMBEDDING_MAX_BATCH_SIZE", 64))
+
+
+def encode_in_batches(fn, texts: list, batch_size=16) -> np.ndarray:
+    """Encode `texts` with one `fn` call per `batch_size` texts into one preallocated matrix."""
+    ress = None
+    for i in range(0, len(texts), batch_size):
+        vts = np.asarray(fn(texts[i : i + batch_size]))
+        if ress is None:
+            ress = np.empty((len(texts), vts.shape[1]), dtype=vts.dtype)
+        ress[i : i + len(vts)] = vts
+    return ress
+
+
+class MicroBatcher:
+    """
+    Gathers the texts submitted by many threads within `window` seconds, up to `max_batch_size`
+    texts, and encodes them with one `fn` call per `batch_size` texts from a single worker thread.
+    The vectors are written into one preallocated matrix and handed back to each caller as a slice.
+    """
+
+    def __init__(self, fn, batch_size=16, max_batch_size=LOCAL_EMBEDDING_MAX_BATCH_SIZE, window=LOCAL_EMBEDDING_BATCH_WINDOW):
+        self.fn = fn
+        self.batch_size = batch_size
+        self.max_batch_size = max(batch_size, max_batch_size)
+        self.window = window
+        self._queue = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name="embedding_micro_batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, texts: list) -> np.ndarray:
+        fut = Future()
+        with self._lock:
+            queued = not self._closed
+            if queued:
+                self._queue.put((texts, fut))
+        if not queued:
+            # Submitted after close: encode in the calling thread.
+            return encode_in_batches(self.fn, texts, self.batch_size)
+        return fut.result()
+
+    def close(self):
+        """Let the worker finish the submitted texts and exit, releasing `fn` and what it holds."""
+        with self._lock:
+            self._closed = True
+            self._queue.put(None)
+
+    def _run(self):
+        closed = False
+        while not closed:
+            req = self._queue.get()
+            if req is None:
+                return
+            reqs = [req]
+            n = len(req[0])
+            deadline = time.monotonic() + self.window
+            while n < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    req = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if req is None:
+                    closed = True
+                    break
+                reqs.append(req)
+                n += len(req[0])
+
+            try:
+                ress = encode_in_batches(self.fn, [t for txts, _ in reqs for t in txts], self.batch_size)
+            except Exception as e:
+                if len(reqs) == 1:
+                    reqs[0][1].set_exception(e)
+                    continue
+                # One bad input must not fail the other callers of the batch: retry each on its own.
+                for txts, fut in reqs:
+                    try:
+                        fut.set_result(encode_in_batches(self.fn, txts, self.batch_size))
+                    except Exception as e:
+                        fut.set_exception(e)
+                continue
+            pos = 0
+            for txts, fut in reqs:
+                fut.set_result(ress[pos : pos + len(txts)])
+                pos += len(txts)
+
+
 class DefaultEmbedding(Base):
     _FACTORY_NAME = "BAAI"
     _model = None
     _model_name = ""
     _model_lock = threading.Lock()
+    _batchers = {}
+
+    def _encode_batched(self, kind, fn, texts: list) -> np.ndarray:
+        """
+        Encode `texts` with `fn` through the micro-batcher of `kind` ("documents" or "queries") shared
+        by every user of the loaded model. Batchers are keyed by class and model name; when the model
+        is replaced, the batchers of the old one are retired so it can be freed.
+        """
+        with DefaultEmbedding._model_lock:
+            batcher = None
+            if self._model is DefaultEmbedding._model:
+                for k, (mdl, b) in list(DefaultEmbedding._batchers.items()):
+                    if mdl is not DefaultEmbedding._model:
+                        b.close()
+                        del DefaultEmbedding._batchers[k]
+                key = (type(self).__name__, self._model_name, kind)
+                if key not in DefaultEmbedding._batchers:
+                    DefaultEmbedding._batchers[key] = (self._model, MicroBatcher(fn))
+                batcher = DefaultEmbedding._batchers[key][1]
+        if batcher is None:
+            # This instance still holds a model that has been replaced since.
+            return encode_in_batches(fn, texts)
+        return batcher.submit(texts)
 
     def __init__(self, key, model_name, **kwargs):
         """
@@ -111,22 +229,21 @@ class DefaultEmbedding(Base):
         self._model_name = DefaultEmbedding._model_name
 
     def encode(self, texts: list):
-        batch_size = 16
         texts = [truncate(t, 2048) for t in texts]
         token_count = 0
         for t in texts:
             token_count += num_tokens_from_string(t)
-        ress = None
-        for i in range(0, len(texts), batch_size):
-            if ress is None:
-                ress = self._model.encode(texts[i : i + batch_size], convert_to_numpy=True)
-            else:
-                ress = np.concatenate((ress, self._model.encode(texts[i : i + batch_size], convert_to_numpy=True)), axis=0)
+        if not texts:
+            return None, token_count
+        model = self._model
+        ress = self._encode_batched("documents", lambda txts: model.encode(txts, convert_to_numpy=True), texts)
         return ress, token_count
 
     def encode_queries(self, text: str):
         token_count = num_tokens_from_string(text)
-        return self._model.encode_queries([text], convert_to_numpy=False)[0][0].cpu().numpy(), token_count
+        model = self._model
+        ress = self._encode_batched("queries", lambda txts: model.encode_queries(txts, convert_to_numpy=True), [text])
+        return ress[0], token_count
 
 
 class OpenAIEmbed(Base):
@@ -358,16 +475,20 @@ class FastEmbed(DefaultEmbedding):
         encodings = self._model.model.tokenizer.encode_batch(texts)
         total_tokens = sum(len(e) for e in encodings)
 
-        embeddings = [e.tolist() for e in self._model.embed(texts, batch_size=16)]
+        if not texts:
+            return np.array([]), total_tokens
+        model = self._model
+        embeddings = self._encode_batched("documents", lambda txts: np.array(list(model.embed(txts, batch_size=16))), texts)
 
-        return np.array(embeddings), total_tokens
+        return embeddings, total_tokens
 
     def encode_queries(self, text: str):
         # Using the internal tokenizer to encode the texts and get the total
         # number of tokens
         encoding = self._model.model.tokenizer.encode(text)
-        embedding = next(self._model.query_embed(text))
-        return np.array(embedding), len(encoding.ids)
+        model = self._model
+        embedding = self._encode_batched("queries", lambda txts: np.array(list(model.query_embed(txts))), [text])[0]
+        return embedding, len(encoding.ids)
 
 
 class XinferenceEmbed(Base):
@@ -446,7 +567,7 @@ class JinaEmbed(Base):
         token_count = 0
         for i in range(0, len(texts), batch_size):
             data = {"model": self.model_name, "input": texts[i : i + batch_size], "encoding_type": "float"}
-            response = requests.post(self.base_url, headers=self.headers, json=data)
+            response = http_session.post(self.base_url, headers=self.headers, json=data)
             try:
                 res = response.json()
                 ress.extend([d["embedding"] for d in res["data"]])
@@ -628,7 +749,7 @@ class NvidiaEmbed(Base):
                 "encoding_format": "float",
                 "truncate": "END",
             }
-            response = requests.post(self.base_url, headers=self.headers, json=payload)
+            response = http_session.post(self.base_url, headers=self.headers, json=payload)
             try:
                 res = response.json()
             except Exception as _e:
@@ -756,7 +877,7 @@ class SILICONFLOWEmbed(Base):
                 "input": texts_batch,
                 "encoding_format": "float",
             }
-            response = requests.post(self.base_url, json=payload, headers=self.headers)
+            response = http_session.post(self.base_url, json=payload, headers=self.headers)
             try:
                 res = response.json()
                 ress.extend([d["embedding"] for d in res["data"]])
@@ -772,7 +893,7 @@ class SILICONFLOWEmbed(Base):
             "input": text,
             "encoding_format": "float",
         }
-        response = requests.post(self.base_url, json=payload, headers=self.headers)
+        response = http_session.post(self.base_url, json=payload, headers=self.headers)
         try:
             res = response.json()
             return np.array(res["data"][0]["embedding"]), self.total_token_count(res)
@@ -879,7 +1000,7 @@ class HuggingFaceEmbed(Base):
     def encode(self, texts: list):
         embeddings = []
         for text in texts:
-            response = requests.post(f"{self.base_url}/embed", json={"inputs": text}, headers={"Content-Type": "application/json"})
+            response = http_session.post(f"{self.base_url}/embed", json={"inputs": text}, headers={"Content-Type": "application/json"})
             if response.status_code == 200:
                 embedding = response.json()
                 embeddings.append(embedding[0])
@@ -888,7 +1009,7 @@ class HuggingFaceEmbed(Base):
         return np.array(embeddings), sum([num_tokens_from_string(text) for text in texts])
 
     def encode_queries(self, text):
-        response = requests.post(f"{self.base_url}/embed", json={"inputs": text}, headers={"Content-Type": "application/json"})
+        response = http_session.post(f"{self.base_url}/embed", json={"inputs": text}, headers={"Content-Type": "application/json"})
         if response.status_code == 200:
             embedding = response.json()
             return np.array(embedding[0]), num_tokens_from_string(text)
@@ -32,11 +32,11 @@ from wsgiref.handlers import format_date_time
 
 import httpx
 import ormsgpack
-import requests
 import websocket
 from pydantic import BaseModel, conint
 
 from rag.utils import num_tokens_from_string
+from rag.utils import http_session
 
 
 class ServeReferenceAudio(BaseModel):
@@ -97,25 +97,25 @@ class FishAudioTTS(Base):
         text = self.normalize_text(text)
         request = ServeTTSRequest(text=text, reference_id=self.ref_id)
 
-        with httpx.Client() as client:
-            try:
-                with client.stream(
-                    method="POST",
-                    url=self.base_url,
-                    content=ormsgpack.packb(request, option=ormsgpack.OPT_SERIALIZE_PYDANTIC),
-                    headers=self.headers,
-                    timeout=None,
-                ) as response:
-                    if response.status_code == HTTPStatus.OK:
-                        for chunk in response.iter_bytes():
-                            yield chunk
-                    else:
-                        response.raise_for_status()
+        client = http_session.get_httpx_client(self.base_url)
+        try:
+            with client.stream(
+                method="POST",
+                url=self.base_url,
+                content=ormsgpack.packb(request, option=ormsgpack.OPT_SERIALIZE_PYDANTIC),
+                headers=self.headers,
+                timeout=None,
+            ) as response:
+                if response.status_code == HTTPStatus.OK:
+                    for chunk in response.iter_bytes():
+                        yield chunk
+                else:
+                    response.raise_for_status()
 
-                yield num_tokens_from_string(text)
+            yield num_tokens_from_string(text)
 
-            except httpx.HTTPStatusError as e:
-                raise RuntimeError(f"**ERROR**: {e}")
+        except httpx.HTTPStatusError as e:
+            raise RuntimeError(f"**ERROR**: {e}")
 
 
 class QwenTTS(Base):
@@ -191,7 +191,7 @@ class OpenAITTS(Base):
         text = self.normalize_text(text)
         payload = {"model": self.model_name, "voice": voice, "input": text}
 
-        response = requests.post(f"{self.base_url}/audio/speech", headers=self.headers, json=payload, stream=True)
+        response = http_session.post(f"{self.base_url}/audio/speech", headers=self.headers, json=payload, stream=True)
 
         if response.status_code != 200:
             raise Exception(f"**Error**: {response.status_code}, {response.text}")
@@ -300,7 +300,7 @@ class XinferenceTTS(Base):
     def tts(self, text, voice="中文女", stream=True):
         payload = {"model": self.model_name, "input": text, "voice": voice}
 
-        response = requests.post(f"{self.base_url}/v1/audio/speech", headers=self.headers, json=payload, stream=stream)
+        response = http_session.post(f"{self.base_url}/v1/audio/speech", headers=self.headers, json=payload, stream=stream)
 
         if response.status_code != 200:
             raise Exception(f"**Error**: {response.status_code}, {response.text}")
@@ -323,7 +323,7 @@ class OllamaTTS(Base):
     def tts(self, text, voice="standard-voice"):
         payload = {"model": self.model_name, "voice": voice, "input": text}
 
-        response = requests.post(f"{self.base_url}/audio/tts", headers=self.headers, json=payload, stream=True)
+        response = http_session.post(f"{self.base_url}/audio/tts", headers=self.headers, json=payload, stream=True)
 
         if response.status_code != 200:
             raise Exception(f"**Error**: {response.status_code}, {response.text}")
@@ -345,7 +345,7 @@ class GPUStackTTS(Base):
     def tts(self, text, voice="Chinese Female", stream=True):
         payload = {"model": self.model_name, "input": text, "voice": voice}
 
-        response = requests.post(f"{self.base_url}/v1/audio/speech", headers=self.headers, json=payload, stream=stream)
+        response = http_session.post(f"{self.base_url}/v1/audio/speech", headers=self.headers, json=payload, stream=stream)
 
         if response.status_code != 200:
             raise Exception(f"**Error**: {response.status_code}, {response.text}")
@@ -379,7 +379,7 @@ class SILICONFLOWTTS(Base):
             "gain": 0,
         }
 
-        response = requests.post(f"{self.base_url}/audio/speech", headers=self.headers, json=payload)
+        response = http_session.post(f"{self.base_url}/audio/speech", headers=self.headers, json=payload)
 
         if response.status_code != 200:
             raise Exception(f"**Error**: {response.status_code}, {response.text}")
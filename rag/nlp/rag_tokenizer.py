@@ -17,16 +17,78 @@
 import logging
 import copy
 import datrie
+import marisa_trie
 import math
 import os
 import re
 import string
+import struct
 import sys
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import cached_property, lru_cache
 from hanziconv import HanziConv
-from nltk import word_tokenize
-from nltk.stem import PorterStemmer, WordNetLemmatizer
 from api.utils.file_utils import get_project_base_directory
 
+HUQIE_MMAP = os.environ.get("HUQIE_MMAP", "true").lower() in ["true", "1", "yes"]
+TOKENIZER_CACHE_SIZE = int(os.environ.get("TOKENIZER_CACHE_SIZE", 16384))
+TOKENIZER_CACHE_MAX_LEN = int(os.environ.get("TOKENIZER_CACHE_MAX_LEN", 256))
+TOKENIZER_WORKERS = int(os.environ.get("TOKENIZER_WORKERS", min(4, os.cpu_count() or 1)))
+TOKENIZER_BATCH_MIN = int(os.environ.get("TOKENIZER_BATCH_MIN", 256))
+
+
+class MmapTrie:
+    """
+    Read-only dictionary compiled to a marisa-trie file and memory-mapped, so every process
+    on the host shares the same pages instead of loading its own copy of the datrie.
+    Values are packed as one signed frequency byte followed by the POS tag; the reversed
+    keys used by backward matching carry an empty value.
+    """
+
+    def __init__(self, trie):
+        self._trie = trie
+
+    @classmethod
+    def load(cls, fnm):
+        return cls(marisa_trie.BytesTrie().mmap(fnm))
+
+    @classmethod
+    def compile(cls, trie, fnm):
+        def pack(v):
+            if not isinstance(v, tuple):
+                return b""
+            return struct.pack("b", max(-128, min(127, v[0]))) + v[1].encode("utf-8")
+
+        tmp = f"{fnm}.{os.getpid()}.tmp"
+        marisa_trie.BytesTrie((k, pack(v)) for k, v in trie.items()).save(tmp)
+        os.replace(tmp, fnm)
+        return cls.load(fnm)
+
+    def __contains__(self, k):
+        return k in self._trie
+
+    def __getitem__(self, k):
+        v = self._trie[k][0]
+        if not v:
+            return 1
+        return struct.unpack("b", v[:1])[0], v[1:].decode("utf-8")
+
+    def has_keys_with_prefix(self, prefix):
+        for _ in self._trie.iterkeys(prefix):
+            return True
+        return False
+
+    def items(self):
+        return [(k, self[k]) for k in self._trie.keys()]
+
+    def to_datrie(self):
+        trie = datrie.Trie(string.printable)
+        for k, v in self.items():
+            trie[k] = v
+        return trie
+
 
 class RagTokenizer:
     def key_(self, line):
@@ -62,32 +124,67 @@ class RagTokenizer:
         self.DEBUG = debug
         self.DENOMINATOR = 1000000
         self.DIR_ = os.path.join(get_project_base_directory(), "rag/res", "huqie")
-
-        self.stemmer = PorterStemmer()
-        self.lemmatizer = WordNetLemmatizer()
+        # Titles, repeated table cells and query words get tokenized over and over;
+        # long texts are rarely seen twice and would only churn the cache.
+        self._tokenize_cache = lru_cache(maxsize=TOKENIZER_CACHE_SIZE)(self._tokenize)
+        self._fine_grained_cache = lru_cache(maxsize=TOKENIZER_CACHE_SIZE)(self._fine_grained_tokenize)
+        self._user_dict = False
 
         self.SPLIT_CHAR = r"([ ,\.<>/?;:'\[\]\\`!@#$%^&*\(\)\{\}\|_+=《》，。？、；‘’：“”【】~！￥%……（）——-]+|[a-zA-Z0-9,\.-]+)"
 
         trie_file_name = self.DIR_ + ".txt.trie"
+        mmap_file_name = self.DIR_ + ".txt.marisa"
+        use_mmap = HUQIE_MMAP
+        if use_mmap and os.path.exists(mmap_file_name) and \
+                (not os.path.exists(trie_file_name) or os.path.getmtime(mmap_file_name) >= os.path.getmtime(trie_file_name)):
+            try:
+                self.trie_ = MmapTrie.load(mmap_file_name)
+                return
+            except Exception:
+                logging.exception(f"[HUQIE]:Fail to map trie file {mmap_file_name}, rebuild it")
+
+        self.trie_ = None
         # check if trie file existence
         if os.path.exists(trie_file_name):
             try:
                 # load trie from file
                 self.trie_ = datrie.Trie.load(trie_file_name)
-                return
             except Exception:
                 # fail to load trie from file, build default trie
                 logging.exception(f"[HUQIE]:Fail to load trie file {trie_file_name}, build the default trie file")
-                self.trie_ = datrie.Trie(string.printable)
         else:
             # file not exist, build default trie
             logging.info(f"[HUQIE]:Trie file {trie_file_name} not found, build the default trie file")
+
+        if self.trie_ is None:
             self.trie_ = datrie.Trie(string.printable)
+            # load data from dict file and save to trie file
+            self.loadDict_(self.DIR_ + ".txt")
+
+        if use_mmap:
+            try:
+                logging.info(f"[HUQIE]:Compile trie to {mmap_file_name}")
+                self.trie_ = MmapTrie.compile(self.trie_, mmap_file_name)
+            except Exception:
+                logging.exception(f"[HUQIE]:Fail to compile trie file {mmap_file_name}, keep the in-memory trie")
+
+    @cached_property
+    def stemmer(self):
+        from nltk.stem import PorterStemmer
+        return PorterStemmer()
 
-        # load data from dict file and save to trie file
-        self.loadDict_(self.DIR_ + ".txt")
+    @cached_property
+    def lemmatizer(self):
+        from nltk.stem import WordNetLemmatizer
+        return WordNetLemmatizer()
+
+    def clear_cache(self):
+        self._tokenize_cache.cache_clear()
+        self._fine_grained_cache.cache_clear()
 
     def loadUserDict(self, fnm):
+        self.clear_cache()
+        self._user_dict = True
         try:
             self.trie_ = datrie.Trie.load(fnm + ".trie")
             return
@@ -96,9 +193,14 @@ class RagTokenizer:
         self.loadDict_(fnm)
 
     def addUserDict(self, fnm):
+        self.clear_cache()
+        self._user_dict = True
+        if isinstance(self.trie_, MmapTrie):
+            self.trie_ = self.trie_.to_datrie()
         self.loadDict_(fnm)
 
-    def _strQ2B(self, ustring):
+    @staticmethod
+    def _strQ2B(ustring):
         """Convert full-width characters to half-width characters"""
         rstring = ""
         for uchar in ustring:
@@ -113,7 +215,8 @@ class RagTokenizer:
                 rstring += chr(inside_code)
         return rstring
 
-    def _tradi2simp(self, line):
+    @staticmethod
+    def _tradi2simp(line):
         return HanziConv.toSimplified(line)
 
     def dfs_(self, chars, s, preTks, tkslist, _depth=0, _memo=None):
@@ -197,6 +300,88 @@ class RagTokenizer:
         _memo[state_key] = result
         return result
 
+    def bestPaths_(self, chars, topn=2):
+        """
+        Rank the segmentations `dfs_` enumerates the way `sortTks_` does, without enumerating them.
+
+        A path's score only depends on its token count, its count of multi-char tokens and its
+        frequency sum, while `dfs_` only branches on the position, the depth and whether the last
+        three tokens are single chars. Keeping the `topn` highest frequency sums per such state,
+        ties broken by the DFS enumeration order (shorter tokens first), is thus exact.
+        Return up to `topn` (tokens, score) pairs, best first.
+        """
+        MAX_DEPTH = 10
+        B = 30
+        # (token count, multi-char token count, trailing single-char tokens capped at 3)
+        #   -> [(frequency sum, token lengths, tokens)]
+        states = [{} for _ in range(len(chars) + 1)]
+        states[0][(0, 0, 0)] = [(0, (), ())]
+        finals = []
+
+        def rank(path):
+            return -path[0], path[1]
+
+        def freq_of(t):
+            k = self.key_(t)
+            return self.trie_[k][0] if k in self.trie_ else -12
+
+        def push(e, state, paths, t, f):
+            n, n_long, run = state
+            key = (n + 1, n_long + (len(t) > 1), min(run + 1, 3) if len(t) == 1 else 0)
+            bucket = states[e].setdefault(key, [])
+            bucket.extend((F + f, lens + (len(t),), tks + (t,)) for F, lens, tks in paths)
+            if len(bucket) > topn:
+                bucket.sort(key=rank)
+                del bucket[topn:]
+
+        def finish(state, paths, t=None):
+            n, n_long, _ = state
+            if t is not None:
+                n, n_long = n + 1, n_long + (len(t) > 1)
+                paths = [(F - 12, lens + (len(t),), tks + (t,)) for F, lens, tks in paths]
+            finals.extend((B / n + n_long / n + F, lens, tks) for F, lens, tks in paths)
+
+        for s in range(len(chars) + 1):
+            for state, paths in states[s].items():
+                if state[0] > MAX_DEPTH:
+                    if s < len(chars):
+                        finish(state, paths, chars[s:])
+                    continue
+                if s >= len(chars):
+                    finish(state, paths)
+                    continue
+
+                if s < len(chars) - 4 and chars[s + 1: s + 5] == chars[s] * 4:
+                    end = s
+                    while end < len(chars) and chars[end] == chars[s]:
+                        end += 1
+                    mid = s + min(10, end - s)
+                    push(mid, state, paths, chars[s:mid], freq_of(chars[s:mid]))
+                    continue
+
+                S = s + 1
+                if s + 2 <= len(chars):
+                    if self.trie_.has_keys_with_prefix(self.key_(chars[s])) and \
+                            not self.trie_.has_keys_with_prefix(self.key_(chars[s:s + 2])):
+                        S = s + 2
+                if state[2] >= 3 and self.trie_.has_keys_with_prefix(self.key_(chars[s - 1] + chars[s])):
+                    S = s + 2
+
+                branched = False
+                for e in range(S, len(chars) + 1):
+                    t = chars[s:e]
+                    k = self.key_(t)
+                    if e > s + 1 and not self.trie_.has_keys_with_prefix(k):
+                        break
+                    if k in self.trie_:
+                        push(e, state, paths, t, self.trie_[k][0])
+                        branched = True
+                if not branched:
+                    push(s + 1, state, paths, chars[s], freq_of(chars[s]))
+
+        finals.sort(key=lambda x: (-x[0], x[1]))
+        return [(list(tks), score) for score, _, tks in finals[:topn]]
+
     def freq(self, tk):
         k = self.key_(tk)
         if k not in self.trie_:
@@ -320,6 +505,11 @@ class RagTokenizer:
         return txt_lang_pairs
 
     def tokenize(self, line):
+        if len(line) > TOKENIZER_CACHE_MAX_LEN:
+            return self._tokenize(line)
+        return self._tokenize_cache(line)
+
+    def _tokenize(self, line):
         line = re.sub(r"\W+", " ", line)
         line = self._strQ2B(line).lower()
         line = self._tradi2simp(line)
@@ -328,6 +518,7 @@ class RagTokenizer:
         res = []
         for L,lang in arr:
             if not lang:
+                from nltk import word_tokenize
                 res.extend([self.stemmer.stem(self.lemmatizer.lemmatize(t)) for t in word_tokenize(L)])
                 continue
             if len(L) < 2 or re.match(
@@ -367,9 +558,7 @@ class RagTokenizer:
                     j += 1
                     continue
                 # backward tokens from_i to i are different from forward tokens from _j to j.
-                tkslist = []
-                self.dfs_("".join(tks[_j:j]), 0, [], tkslist)
-                res.append(" ".join(self.sortTks_(tkslist)[0][0]))
+                res.append(" ".join(self.bestPaths_("".join(tks[_j:j]), 1)[0][0]))
 
                 same = 1
                 while i + same < len(tks1) and j + same < len(tks) and tks1[i + same] == tks[j + same]:
@@ -383,15 +572,42 @@ class RagTokenizer:
             if _i < len(tks1):
                 assert _j < len(tks)
                 assert "".join(tks1[_i:]) == "".join(tks[_j:])
-                tkslist = []
-                self.dfs_("".join(tks[_j:]), 0, [], tkslist)
-                res.append(" ".join(self.sortTks_(tkslist)[0][0]))
+                res.append(" ".join(self.bestPaths_("".join(tks[_j:]), 1)[0][0]))
 
-        res = " ".join(res)
-        logging.debug("[TKS] {}".format(self.merge_(res)))
-        return self.merge_(res)
+        res = self.merge_(" ".join(res))
+        logging.debug("[TKS] {}".format(res))
+        return res
 
     def fine_grained_tokenize(self, tks):
+        if len(tks) > TOKENIZER_CACHE_MAX_LEN:
+            return self._fine_grained_tokenize(tks)
+        return self._fine_grained_cache(tks)
+
+    def tokenize_batch(self, texts, workers=None, fine_grained=False):
+        """
+        Tokenize `texts`, returning the results in order; with `fine_grained`, as
+        (tokens, fine-grained tokens) pairs. Batches of at least `TOKENIZER_BATCH_MIN` texts are
+        spread over a shared pool of `workers` processes, which only the default tokenizer
+        without user dictionaries may use since workers load the stock dictionary. The pool is
+        only used with the memory-mapped dictionary: a datrie copy per worker would multiply
+        the dictionary's memory.
+        """
+        workers = TOKENIZER_WORKERS if workers is None else workers
+        if workers <= 1 or len(texts) < TOKENIZER_BATCH_MIN or self is not _tokenizer or self._user_dict \
+                or not isinstance(self.trie_, MmapTrie):
+            return _tokenize_texts(texts, fine_grained, self)
+
+        size = math.ceil(len(texts) / (workers * 4))
+        parts = [texts[i: i + size] for i in range(0, len(texts), size)]
+        try:
+            pool = _get_pool(workers)
+            return [r for part in pool.map(_tokenize_texts, parts, [fine_grained] * len(parts)) for r in part]
+        except BrokenProcessPool:
+            logging.exception("[HUQIE]:Tokenizer process pool broke, tokenize in process")
+            _drop_pool(workers)
+            return _tokenize_texts(texts, fine_grained, self)
+
+    def _fine_grained_tokenize(self, tks):
         tks = tks.split()
         zh_num = len([1 for c in tks if c and is_chinese(c[0])])
         if zh_num < len(tks) * 0.2:
@@ -405,15 +621,11 @@ class RagTokenizer:
             if len(tk) < 3 or re.match(r"[0-9,\.-]+$", tk):
                 res.append(tk)
                 continue
-            tkslist = []
-            if len(tk) > 10:
-                tkslist.append(tk)
-            else:
-                self.dfs_(tk, 0, [], tkslist)
-            if len(tkslist) < 2:
+            paths = self.bestPaths_(tk) if len(tk) <= 10 else []
+            if len(paths) < 2:
                 res.append(tk)
                 continue
-            stk = self.sortTks_(tkslist)[1][0]
+            stk = paths[1][0]
             if len(stk) == len(tk):
                 stk = tk
             else:
@@ -464,17 +676,163 @@ def naiveQie(txt):
     return tks
 
 
-tokenizer = RagTokenizer()
-tokenize = tokenizer.tokenize
-fine_grained_tokenize = tokenizer.fine_grained_tokenize
-tag = tokenizer.tag
-freq = tokenizer.freq
-loadUserDict = tokenizer.loadUserDict
-addUserDict = tokenizer.addUserDict
-tradi2simp = tokenizer._tradi2simp
-strQ2B = tokenizer._strQ2B
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+
+def get_tokenizer() -> RagTokenizer:
+    """The dictionary is loaded on first use, so importing this module costs nothing."""
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                _tokenizer = RagTokenizer()
+    return _tokenizer
+
+
+def __getattr__(name):
+    if name == "tokenizer":
+        return get_tokenizer()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def tokenize(line):
+    return get_tokenizer().tokenize(line)
+
+
+def tokenize_batch(texts, workers=None, fine_grained=False):
+    return get_tokenizer().tokenize_batch(texts, workers, fine_grained)
+
+
+def _tokenize_texts(texts, fine_grained, tknzr=None):
+    tknzr = tknzr or get_tokenizer()
+    res = []
+    for t in texts:
+        tks = tknzr.tokenize(t)
+        res.append((tks, tknzr.fine_grained_tokenize(tks)) if fine_grained else tks)
+    return res
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _get_pool(workers) -> ProcessPoolExecutor:
+    """
+    Workers come from a forkserver, which is safe to fork from a threaded task executor,
+    and load the dictionary once when they start; the memory-mapped dictionary is shared.
+    """
+    with _pools_lock:
+        if workers not in _pools:
+            methods = multiprocessing.get_all_start_methods()
+            ctx = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            _pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=get_tokenizer)
+        return _pools[workers]
+
+
+def _drop_pool(workers):
+    with _pools_lock:
+        pool = _pools.pop(workers, None)
+    if pool:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def fine_grained_tokenize(tks):
+    return get_tokenizer().fine_grained_tokenize(tks)
+
+
+def tag(tk):
+    return get_tokenizer().tag(tk)
+
+
+def freq(tk):
+    return get_tokenizer().freq(tk)
+
+
+def loadUserDict(fnm):
+    return get_tokenizer().loadUserDict(fnm)
+
+
+def addUserDict(fnm):
+    return get_tokenizer().addUserDict(fnm)
+
+
+tradi2simp = RagTokenizer._tradi2simp
+strQ2B = RagTokenizer._strQ2B
+
+
+def benchmark_startup(rounds=3):
+    """Time module import, dictionary load and the first English tokenization (NLTK), each in a fresh interpreter."""
+    import subprocess
+    import time
+
+    code = (
+        "import time; st = time.perf_counter(); from rag.nlp import rag_tokenizer; t1 = time.perf_counter(); "
+        "rag_tokenizer.get_tokenizer(); t2 = time.perf_counter(); rag_tokenizer.tokenize('scripts are compiled and cached'); "
+        "t3 = time.perf_counter(); print(type(rag_tokenizer.get_tokenizer().trie_).__name__, t1 - st, t2 - t1, t3 - t2)"
+    )
+    for mmap in ["false", "true"]:
+        env = dict(os.environ, HUQIE_MMAP=mmap)
+        for _ in range(rounds):
+            st = time.perf_counter()
+            out = subprocess.run([sys.executable, "-c", code], env=env, cwd=get_project_base_directory(),
+                                 capture_output=True, text=True, check=True).stdout.split()
+            backend, imp, load, first = out[0], *map(float, out[1:])
+            print(f"HUQIE_MMAP={mmap} backend={backend} import={imp * 1000:.0f}ms load={load * 1000:.0f}ms "
+                  f"first_tokenize={first * 1000:.0f}ms total={(time.perf_counter() - st) * 1000:.0f}ms")
+
+
+def benchmark_throughput(zh_file=None, en_file=None, rounds=3):
+    """
+    Tokenization (tokenize + fine_grained_tokenize) throughput in MB/s on a Chinese and an English
+    corpus, one line per text, first bypassing then going through the LRU cache. Also checks that
+    `bestPaths_` ranks like the exhaustive `dfs_` + `sortTks_` on every corpus token.
+    """
+    import time
+
+    corpora = {
+        "zh": ["公开征求意见稿提出，境外投资者可使用自有人民币或外汇投资。使用外汇投资的，可通过债券持有人在香港人民币业务清算行办理外汇资金兑换。",
+               "多校划片就是一个小区对应多个小学初中，让买了学区房的家庭也不确定到底能上哪个学校。目的是通过这种方式为学区房降温，把就近入学落到实处。",
+               "涡轮增压发动机最大功率,不像别的共享买车锁电子化的手段,我们接过来是否有意义,不过，今天要讲到的这家农贸市场，说实话，还真蛮有特色的！"] * 200,
+        "en": ["Retrieval augmented generation combines a search engine with a large language model to answer questions.",
+               "Scripts are compiled and cached, so the second run of the same notebook starts noticeably faster.",
+               "The quarterly report lists revenue, operating costs and net income for each business segment."] * 200,
+    }
+    for lang, fnm in [("zh", zh_file), ("en", en_file)]:
+        if fnm:
+            with open(fnm, "r", encoding="utf-8") as f:
+                corpora[lang] = [line.strip() for line in f if line.strip()]
+
+    tknzr = get_tokenizer()
+    for lang, lines in corpora.items():
+        mb = sum(len(line.encode("utf-8")) for line in lines) / 1024 / 1024
+        for cached in [False, True]:
+            tknzr.clear_cache()
+            st = time.perf_counter()
+            for _ in range(rounds):
+                for line in lines:
+                    if cached:
+                        tknzr.fine_grained_tokenize(tknzr.tokenize(line))
+                    else:
+                        tknzr._fine_grained_tokenize(tknzr._tokenize(line))
+            elapsed = (time.perf_counter() - st) / rounds
+            print(f"{lang} lines={len(lines)} size={mb:.2f}MB cache={cached} {mb / max(elapsed, 1e-9):.2f}MB/s")
+
+        for tk in {tk for line in lines[:100] for tk in tknzr.tokenize(line).split() if 2 < len(tk) <= 10}:
+            tkslist = []
+            tknzr.dfs_(tk, 0, [], tkslist)
+            assert tknzr.sortTks_(tkslist)[:2] == tknzr.bestPaths_(tk), f"bestPaths_ diverges from dfs_ on {tk}"
+
 
 if __name__ == '__main__':
+    # Usage: python -m rag.nlp.rag_tokenizer --bench-startup
+    #        python -m rag.nlp.rag_tokenizer --bench-throughput [zh_corpus] [en_corpus]
+    if sys.argv[1:2] == ["--bench-startup"]:
+        benchmark_startup()
+        sys.exit()
+    if sys.argv[1:2] == ["--bench-throughput"]:
+        benchmark_throughput(*sys.argv[2:4])
+        sys.exit()
     tknzr = RagTokenizer(debug=True)
     # huqie.addUserDict("/tmp/tmp.new.tks.dict")
     tks = tknzr.tokenize(
@@ -16,14 +16,14 @@
 import logging
 import re
 import math
-from collections import OrderedDict
 from dataclasses import dataclass
 
 from rag.settings import TAG_FLD, PAGERANK_FLD
 from rag.utils import rmSpace, get_float
 from rag.nlp import rag_tokenizer, query
 import numpy as np
-from rag.utils.doc_store_conn import DocStoreConnection, MatchDenseExpr, FusionExpr, OrderByExpr
+from rag.utils.doc_store_conn import DocStoreConnection, MatchDenseExpr, FusionExpr, OrderByExpr, vectors_to_matrix
+from rag.utils.retrieval_cache import RETRIEVAL_CACHE
 
 
 def index_name(uid): return f"ragflow_{uid}"
@@ -44,6 +44,7 @@ class Dealer:
         aggregation: list | dict | None = None
         keywords: list[str] | None = None
         group_docs: list[list] | None = None
+        vectors: np.ndarray | None = None
 
     def get_vector(self, txt, emb_mdl, topk=10, similarity=0.1):
         qv, _ = emb_mdl.encode_queries(txt)
@@ -146,6 +147,7 @@ class Dealer:
         keywords = list(kwds)
         highlight = self.dataStore.getHighlight(res, keywords, "content_with_weight")
         aggs = self.dataStore.getAggregation(res, "docnm_kwd")
+        vectors = self.dataStore.getVectors(res, f"q_{len(q_vec)}_vec", len(q_vec)) if q_vec else None
         return self.SearchResult(
             total=total,
             ids=ids,
@@ -153,7 +155,8 @@ class Dealer:
             aggregation=aggs,
             highlight=highlight,
             field=self.dataStore.getFields(res, src),
-            keywords=keywords
+            keywords=keywords,
+            vectors=vectors
         )
 
     @staticmethod
@@ -281,29 +284,23 @@ class Dealer:
                rank_feature: dict | None = None
                ):
         _, keywords = self.qryr.question(query)
-        vector_size = len(sres.query_vector)
-        vector_column = f"q_{vector_size}_vec"
-        zero_vector = [0.0] * vector_size
-        ins_embd = []
-        for chunk_id in sres.ids:
-            vector = sres.field[chunk_id].get(vector_column, zero_vector)
-            if isinstance(vector, str):
-                vector = [get_float(v) for v in vector.split("\t")]
-            ins_embd.append(vector)
-        if not ins_embd:
+        if not sres.ids:
             return [], [], []
+        ins_embd = sres.vectors
+        if ins_embd is None:
+            vector_column = f"q_{len(sres.query_vector)}_vec"
+            ins_embd = vectors_to_matrix([sres.field[i].get(vector_column) for i in sres.ids], len(sres.query_vector))
 
         for i in sres.ids:
             if isinstance(sres.field[i].get("important_kwd", []), str):
                 sres.field[i]["important_kwd"] = [sres.field[i]["important_kwd"]]
+        # Term similarity only checks which query terms a chunk contains, so the
+        # title/important/question boosts need not be materialized here.
         ins_tw = []
         for i in sres.ids:
-            content_ltks = list(OrderedDict.fromkeys(sres.field[i][cfield].split()))
-            title_tks = [t for t in sres.field[i].get("title_tks", "").split() if t]
-            question_tks = [t for t in sres.field[i].get("question_tks", "").split() if t]
-            important_kwd = sres.field[i].get("important_kwd", [])
-            tks = content_ltks + title_tks * 2 + important_kwd * 5 + question_tks * 6
-            ins_tw.append(tks)
+            fld = sres.field[i]
+            ins_tw.append(fld[cfield].split() + fld.get("title_tks", "").split()
+                          + fld.get("important_kwd", []) + fld.get("question_tks", "").split())
 
         ## For rank feature(tag_fea) scores.
         rank_fea = self._rank_feature_scores(rank_feature, sres)
@@ -331,7 +328,7 @@ class Dealer:
             tks = content_ltks + title_tks + important_kwd
             ins_tw.append(tks)
 
-        tksim = self.qryr.token_similarity(keywords, ins_tw)
+        tksim = self.qryr.batch_token_similarity(keywords, ins_tw)
         vtsim, _ = rerank_mdl.similarity(query, [rmSpace(" ".join(tks)) for tks in ins_tw])
         ## For rank feature(tag_fea) scores.
         rank_fea = self._rank_feature_scores(rank_feature, sres)
@@ -352,6 +349,19 @@ class Dealer:
         if not question:
             return ranks
 
+        cache_key = None
+        if RETRIEVAL_CACHE is not None:
+            cache_key = RETRIEVAL_CACHE.make_key(question, kb_ids, tenant_ids=tenant_ids, doc_ids=sorted(doc_ids or []),
+                                                 page=page, page_size=page_size, similarity_threshold=similarity_threshold,
+                                                 vector_similarity_weight=vector_similarity_weight, top=top, aggs=aggs,
+                                                 highlight=highlight, rank_feature=rank_feature,
+                                                 embd_mdl=getattr(embd_mdl, "llm_name", None),
+                                                 rerank_mdl=getattr(rerank_mdl, "llm_name", None))
+            if cache_key:
+                cached = RETRIEVAL_CACHE.get(cache_key)
+                if cached is not None:
+                    return cached
+
         RERANK_LIMIT = 64
         RERANK_LIMIT = int(RERANK_LIMIT//page_size + ((RERANK_LIMIT%page_size)/(page_size*1.) + 0.5)) * page_size if page_size>1 else 1
         if RERANK_LIMIT < 1: ## when page_size is very large the RERANK_LIMIT will be 0.
@@ -415,7 +425,7 @@ class Dealer:
                 "similarity": sim[i],
                 "vector_similarity": vsim[i],
                 "term_similarity": tsim[i],
-                "vector": chunk.get(vector_column, zero_vector),
+                "vector": sres.vectors[i].tolist() if sres.vectors is not None else chunk.get(vector_column, zero_vector),
                 "positions": position_int,
                 "doc_type_kwd": chunk.get("doc_type_kwd", "")
             }
@@ -435,6 +445,8 @@ class Dealer:
                                                                    key=lambda x: x[1]["count"] * -1)]
         ranks["chunks"] = ranks["chunks"][:page_size]
 
+        if cache_key:
+            RETRIEVAL_CACHE.set(cache_key, ranks)
         return ranks
 
     def sql_retrieval(self, sql, fetch_size=128, format="json"):
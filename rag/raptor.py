@@ -13,10 +13,15 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 #
+import json
 import logging
+import os
 import re
 import umap
+import numba
 import numpy as np
+import xxhash
+from joblib import Parallel, delayed
 from sklearn.mixture import GaussianMixture
 import trio
 
@@ -29,6 +34,12 @@ from graphrag.utils import (
     chat_limiter,
 )
 from rag.utils import truncate
+from rag.utils.redis_conn import REDIS_CONN
+
+RAPTOR_CLUSTER_JOBS = int(os.environ.get("RAPTOR_CLUSTER_JOBS", min(4, os.cpu_count() or 1)))
+RAPTOR_TREE_TTL = int(os.environ.get("RAPTOR_TREE_TTL", 7 * 24 * 3600))
+# Share of a layer's chunks that must be known from the stored tree to keep its clustering.
+RAPTOR_REUSE_RATIO = float(os.environ.get("RAPTOR_REUSE_RATIO", 0.8))
 
 
 class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
@@ -50,9 +61,7 @@ class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
 
         if response:
             return response
-        response = await trio.to_thread.run_sync(
-            lambda: self._llm_model.chat(system, history, gen_conf)
-        )
+        response = await self._llm_model.async_chat(system, history, gen_conf)
         response = re.sub(r"^.*</think>", "", response, flags=re.DOTALL)
         if response.find("**ERROR**") >= 0:
             raise Exception(response)
@@ -75,23 +84,128 @@ class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
         await trio.to_thread.run_sync(lambda: set_embed_cache(self._embd_model.llm_name, txt, embds))
         return embds
 
+    @staticmethod
+    def _fit(embeddings: np.ndarray, n: int, random_state: int):
+        gm = GaussianMixture(n_components=n, random_state=random_state)
+        gm.fit(embeddings)
+        return gm.bic(embeddings), gm
+
     def _get_optimal_clusters(self, embeddings: np.ndarray, random_state: int):
+        """
+        Coarse-to-fine search for the cluster count with the lowest BIC. Counts on a geometric
+        grid are fitted first, stopping once BIC went up twice in a row past the minimum, then
+        every count between the best grid point's neighbours. Each round is fitted in parallel.
+        Return the count and its fitted mixture.
+        """
         max_clusters = min(self._max_cluster, len(embeddings))
-        n_clusters = np.arange(1, max_clusters)
-        bics = []
-        for n in n_clusters:
-            gm = GaussianMixture(n_components=n, random_state=random_state)
-            gm.fit(embeddings)
-            bics.append(gm.bic(embeddings))
-        optimal_clusters = n_clusters[np.argmin(bics)]
-        return optimal_clusters
-
-    async def __call__(self, chunks, random_state, callback=None):
+        grid = sorted({int(round(1.5 ** i)) for i in range(64) if round(1.5 ** i) < max_clusters})
+        fits = {}
+
+        def fit_all(ns):
+            ns = [n for n in ns if n not in fits]
+            if not ns:
+                return
+            res = Parallel(n_jobs=min(RAPTOR_CLUSTER_JOBS, len(ns)), prefer="threads")(
+                delayed(self._fit)(embeddings, n, random_state) for n in ns)
+            fits.update(zip(ns, res))
+
+        def best():
+            return min(fits, key=lambda n: (fits[n][0], n))
+
+        for i in range(0, len(grid), max(1, RAPTOR_CLUSTER_JOBS)):
+            fit_all(grid[i: i + max(1, RAPTOR_CLUSTER_JOBS)])
+            rising = [n for n in grid if n in fits and n > best()]
+            if len(rising) >= 2 and fits[rising[0]][0] < fits[rising[1]][0]:
+                break
+
+        n = best()
+        pos = grid.index(n)
+        lo = grid[pos - 1] if pos > 0 else 1
+        hi = grid[pos + 1] if pos + 1 < len(grid) else max_clusters
+        fit_all(range(lo + 1, hi))
+        n = best()
+        return n, fits[n][1]
+
+    def _cluster(self, embeddings: np.ndarray, random_state: int):
+        n_neighbors = int((len(embeddings) - 1) ** 0.8)
+        reduced_embeddings = umap.UMAP(
+            n_neighbors=max(2, n_neighbors),
+            n_components=min(12, len(embeddings) - 2),
+            metric="cosine",
+        ).fit_transform(embeddings)
+        n_clusters, gm = self._get_optimal_clusters(reduced_embeddings, random_state)
+        if n_clusters == 1:
+            return [0 for _ in range(len(reduced_embeddings))], 1
+        probs = gm.predict_proba(reduced_embeddings)
+        lbls = [np.where(prob > self._threshold)[0] for prob in probs]
+        lbls = [lbl[0] if isinstance(lbl, np.ndarray) else lbl for lbl in lbls]
+        return lbls, n_clusters
+
+    @staticmethod
+    def _reuse_clusters(layer: dict | None, hashes: list[str], embeddings: np.ndarray):
+        """
+        Keep the stored clustering of a layer when most of its chunks are already known:
+        known chunks keep their cluster, new ones join the cluster with the closest centroid.
+        Return None when the layer has to be clustered from scratch.
+        """
+        if not layer:
+            return None
+        lbls = [layer["members"].get(h) for h in hashes]
+        if sum(lbl is not None for lbl in lbls) < len(hashes) * RAPTOR_REUSE_RATIO:
+            return None
+        centroids = np.asarray(layer["centroids"], dtype=np.float32)
+        if centroids.ndim != 2 or centroids.shape[1] != embeddings.shape[1]:
+            return None
+        centroids /= np.linalg.norm(centroids, axis=1, keepdims=True) + 1e-12
+        for i, lbl in enumerate(lbls):
+            if lbl is None:
+                lbls[i] = int(np.argmax(centroids @ embeddings[i]))
+        used = {c: i for i, c in enumerate(sorted(set(lbls)))}
+        return [used[lbl] for lbl in lbls], len(used)
+
+    def _tree_key(self, tree_id, random_state):
+        # Any change of the models or the RAPTOR config leads to a different tree, so it is keyed by them too.
+        conf = [
+            getattr(self._llm_model, "llm_name", ""),
+            getattr(self._embd_model, "llm_name", ""),
+            self._prompt,
+            self._max_token,
+            self._threshold,
+            self._max_cluster,
+            random_state,
+        ]
+        return f"raptor_tree:{tree_id}:{xxhash.xxh64(json.dumps(conf, ensure_ascii=False)).hexdigest()}"
+
+    def _load_tree(self, tree_id, random_state):
+        if not tree_id:
+            return []
+        try:
+            bin = REDIS_CONN.get(self._tree_key(tree_id, random_state))
+            return json.loads(bin) if bin else []
+        except Exception:
+            logging.exception(f"RAPTOR can't load the stored tree of {tree_id}")
+            return []
+
+    def _save_tree(self, tree_id, random_state, tree):
+        if tree_id:
+            REDIS_CONN.set(self._tree_key(tree_id, random_state), json.dumps(tree), RAPTOR_TREE_TTL)
+
+    async def __call__(self, chunks, random_state, callback=None, tree_id=None):
+        """
+        Build the summary tree over `chunks` and return them followed by every summary.
+
+        With `tree_id`, the clustering and summaries of each layer are stored, and the next run
+        for the same id, models and config keeps the clustering of layers whose chunks are mostly
+        unchanged and reuses the summary of every cluster whose members are unchanged. Only the
+        branches touched by new or changed chunks are summarized again.
+        """
         if len(chunks) <= 1:
             return []
         chunks = [(s, a) for s, a in chunks if s and len(a) > 0]
         layers = [(0, len(chunks))]
         start, end = 0, len(chunks)
+        old_tree, tree = self._load_tree(tree_id, random_state), []
+        reused = 0
 
         @timeout(60*20)
         async def summarize(ck_idx: list[int]):
@@ -123,13 +237,38 @@ class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
                 )
                 logging.debug(f"SUM: {cnt}")
                 embds = await self._embedding_encode(cnt)
-                chunks.append((cnt, embds))
+                return cnt, embds
+
+        async def summarize_clusters(clusters: list[list[int]], hashes: list[str], layer: dict):
+            nonlocal reused
+            old_summaries = old_tree[len(tree)]["summaries"] if len(tree) < len(old_tree) else {}
+            results = [None] * len(clusters)
+
+            async def run(c, ck_idx):
+                digest = xxhash.xxh64("".join(sorted(hashes[i - start] for i in ck_idx))).hexdigest()
+                if digest in old_summaries:
+                    cnt, embds = old_summaries[digest]
+                    results[c] = (cnt, np.array(embds))
+                else:
+                    results[c] = await summarize(ck_idx)
+                layer["summaries"][digest] = [results[c][0], np.asarray(results[c][1]).tolist()]
+
+            async with trio.open_nursery() as nursery:
+                for c, ck_idx in enumerate(clusters):
+                    assert len(ck_idx) > 0
+                    nursery.start_soon(run, c, ck_idx)
+            reused += sum(1 for r in layer["summaries"] if r in old_summaries)
+            # Append in cluster order so the next layer, and its prompts, do not depend on timing.
+            chunks.extend(results)
 
         labels = []
         while end - start > 1:
-            embeddings = [embd for _, embd in chunks[start:end]]
+            embeddings = np.array([embd for _, embd in chunks[start:end]], dtype=np.float32)
+            hashes = [xxhash.xxh64(t.encode("utf-8")).hexdigest() for t, _ in chunks[start:end]]
+            layer = {"members": {}, "centroids": [], "summaries": {}}
             if len(embeddings) == 2:
-                await summarize([start, start + 1])
+                await summarize_clusters([[start, start + 1]], hashes, layer)
+                tree.append(layer)
                 if callback:
                     callback(
                         msg="Cluster one layer: {} -> {}".format(
@@ -142,27 +281,21 @@ class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
                 end = len(chunks)
                 continue
 
-            n_neighbors = int((len(embeddings) - 1) ** 0.8)
-            reduced_embeddings = umap.UMAP(
-                n_neighbors=max(2, n_neighbors),
-                n_components=min(12, len(embeddings) - 2),
-                metric="cosine",
-            ).fit_transform(embeddings)
-            n_clusters = self._get_optimal_clusters(reduced_embeddings, random_state)
-            if n_clusters == 1:
-                lbls = [0 for _ in range(len(reduced_embeddings))]
+            normed = embeddings / (np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-12)
+            kept = self._reuse_clusters(old_tree[len(tree)] if len(tree) < len(old_tree) else None, hashes, normed)
+            if kept:
+                lbls, n_clusters = kept
             else:
-                gm = GaussianMixture(n_components=n_clusters, random_state=random_state)
-                gm.fit(reduced_embeddings)
-                probs = gm.predict_proba(reduced_embeddings)
-                lbls = [np.where(prob > self._threshold)[0] for prob in probs]
-                lbls = [lbl[0] if isinstance(lbl, np.ndarray) else lbl for lbl in lbls]
+                # Start numba's thread pool, which UMAP runs on, from the main thread: started from
+                # a worker thread it keeps the process from exiting.
+                numba.get_num_threads()
+                lbls, n_clusters = await trio.to_thread.run_sync(lambda: self._cluster(embeddings, random_state))
 
-            async with trio.open_nursery() as nursery:
-                for c in range(n_clusters):
-                    ck_idx = [i + start for i in range(len(lbls)) if lbls[i] == c]
-                    assert len(ck_idx) > 0
-                    nursery.start_soon(summarize, ck_idx)
+            clusters = [[i + start for i in range(len(lbls)) if lbls[i] == c] for c in range(n_clusters)]
+            layer["members"] = {h: int(lbl) for h, lbl in zip(hashes, lbls)}
+            layer["centroids"] = [embeddings[[i - start for i in ck_idx]].mean(axis=0).tolist() for ck_idx in clusters]
+            await summarize_clusters(clusters, hashes, layer)
+            tree.append(layer)
 
             assert len(chunks) - end == n_clusters, "{} vs. {}".format(
                 len(chunks) - end, n_clusters
@@ -171,11 +304,14 @@ class RecursiveAbstractiveProcessing4TreeOrganizedRetrieval:
             layers.append((end, len(chunks)))
             if callback:
                 callback(
-                    msg="Cluster one layer: {} -> {}".format(
-                        end - start, len(chunks) - end
+                    msg="Cluster one layer: {} -> {}{}".format(
+                        end - start, len(chunks) - end, " (clustering reused)" if kept else ""
                     )
                 )
             start = end
             end = len(chunks)
 
+        if callback and reused:
+            callback(msg=f"Reused {reused} summaries from the previous tree.")
+        await trio.to_thread.run_sync(lambda: self._save_tree(tree_id, random_state, tree))
         return chunks
@@ -58,6 +58,14 @@ except Exception:
 DOC_MAXIMUM_SIZE = int(os.environ.get("MAX_CONTENT_LENGTH", 128 * 1024 * 1024))
 DOC_BULK_SIZE = int(os.environ.get("DOC_BULK_SIZE", 4))
 EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", 16))
+# Caching chunk vectors costs Redis memory for every indexed chunk, so it is opt-in and short lived.
+EMBEDDING_CACHE_ENABLED = os.environ.get("EMBEDDING_CACHE_ENABLED", "false").lower() in ["true", "1", "yes"]
+EMBEDDING_CACHE_TTL = min(int(os.environ.get("EMBEDDING_CACHE_TTL", 3600)), 24 * 3600)
+RETRIEVAL_CACHE_ENABLED = os.environ.get("RETRIEVAL_CACHE_ENABLED", "false").lower() in ["true", "1", "yes"]
+RETRIEVAL_CACHE_SIZE = int(os.environ.get("RETRIEVAL_CACHE_SIZE", 1024))
+RETRIEVAL_CACHE_TTL = int(os.environ.get("RETRIEVAL_CACHE_TTL", 600))
+# Longer than the doc store refresh interval (conf/mapping.json), so the delayed bump happens after new chunks are searchable.
+RETRIEVAL_CACHE_REFRESH_DELAY = float(os.environ.get("RETRIEVAL_CACHE_REFRESH_DELAY", 2))
 SVR_QUEUE_NAME = "rag_flow_svr_queue"
 SVR_CONSUMER_GROUP_NAME = "rag_flow_svr_task_broker"
 PAGERANK_FLD = "pagerank_fea"
@@ -61,9 +61,11 @@ from rag.app import laws, paper, presentation, manual, qa, table, book, resume,
     email, tag
 from rag.nlp import search, rag_tokenizer
 from rag.raptor import RecursiveAbstractiveProcessing4TreeOrganizedRetrieval as Raptor
-from rag.settings import DOC_MAXIMUM_SIZE, DOC_BULK_SIZE, EMBEDDING_BATCH_SIZE, SVR_CONSUMER_GROUP_NAME, get_svr_queue_name, get_svr_queue_names, print_rag_settings, TAG_FLD, PAGERANK_FLD
-from rag.utils import num_tokens_from_string, truncate
+from rag.settings import DOC_MAXIMUM_SIZE, DOC_BULK_SIZE, SVR_CONSUMER_GROUP_NAME, get_svr_queue_name, get_svr_queue_names, print_rag_settings, TAG_FLD, PAGERANK_FLD
+from rag.utils import num_tokens_from_string
 from rag.utils.redis_conn import REDIS_CONN, RedisDistributedLock
+from rag.utils.retrieval_cache import bump_kb_generation
+from rag.utils.embedding_scheduler import get_embedding_scheduler
 from rag.utils.storage_factory import STORAGE_IMPL
 from graphrag.utils import chat_limiter
 
@@ -103,9 +105,9 @@ CURRENT_TASKS = {}
 MAX_CONCURRENT_TASKS = int(os.environ.get('MAX_CONCURRENT_TASKS', "5"))
 MAX_CONCURRENT_CHUNK_BUILDERS = int(os.environ.get('MAX_CONCURRENT_CHUNK_BUILDERS', "1"))
 MAX_CONCURRENT_MINIO = int(os.environ.get('MAX_CONCURRENT_MINIO', '10'))
+MAX_PENDING_EMBEDDING_BATCHES = int(os.environ.get('MAX_PENDING_EMBEDDING_BATCHES', '4'))
 task_limiter = trio.Semaphore(MAX_CONCURRENT_TASKS)
 chunk_limiter = trio.CapacityLimiter(MAX_CONCURRENT_CHUNK_BUILDERS)
-embed_limiter = trio.CapacityLimiter(MAX_CONCURRENT_CHUNK_BUILDERS)
 minio_limiter = trio.CapacityLimiter(MAX_CONCURRENT_MINIO)
 kg_limiter = trio.CapacityLimiter(2)
 WORKER_HEARTBEAT_TIMEOUT = int(os.environ.get('WORKER_HEARTBEAT_TIMEOUT', '120'))
@@ -430,12 +432,16 @@ def init_kb(row, vector_size: int):
     return settings.docStoreConn.createIdx(idxnm, row.get("kb_id", ""), vector_size)
 
 
-async def embedding(docs, mdl, parser_config=None, callback=None):
+async def embedding(docs, mdl, parser_config=None, callback=None, send_channel=None):
+    """
+    Embed `docs` batch by batch, writing each vector into its chunk.
+    When `send_channel` is given, every embedded batch is handed on to it as soon as it is ready
+    and progress is left to the consumer, which can only lag behind the embedding.
+    """
     if parser_config is None:
         parser_config = {}
-    tts, cnts = [], []
+    cnts = []
     for d in docs:
-        tts.append(d.get("docnm_kwd", "Title"))
         c = "\n".join(d.get("question_kwd", []))
         if not c:
             c = d["content_with_weight"]
@@ -443,45 +449,117 @@ async def embedding(docs, mdl, parser_config=None, callback=None):
         if not c:
             c = "None"
         cnts.append(c)
+    if not docs:
+        return 0, 0
 
     tk_count = 0
-    if len(tts) == len(cnts):
-        vts, c = await trio.to_thread.run_sync(lambda: mdl.encode(tts[0: 1]))
-        tts = np.concatenate([vts for _ in range(len(tts))], axis=0)
-        tk_count += c
+    vts, c = await trio.to_thread.run_sync(lambda: mdl.encode([docs[0].get("docnm_kwd", "Title")]))
+    title_vec = vts[0]
+    tk_count += c
 
-    @timeout(60)
-    def batch_encode(txts):
-        nonlocal mdl
-        return mdl.encode([truncate(c, mdl.max_length-10) for c in txts])
-
-    cnts_ = np.array([])
-    for i in range(0, len(cnts), EMBEDDING_BATCH_SIZE):
-        async with embed_limiter:
-            vts, c = await trio.to_thread.run_sync(lambda: batch_encode(cnts[i: i + EMBEDDING_BATCH_SIZE]))
-        if len(cnts_) == 0:
-            cnts_ = vts
-        else:
-            cnts_ = np.concatenate((cnts_, vts), axis=0)
-        tk_count += c
-        callback(prog=0.7 + 0.2 * (i + 1) / len(cnts), msg="")
-    cnts = cnts_
     filename_embd_weight = parser_config.get("filename_embd_weight", 0.1) # due to the db support none value
     if not filename_embd_weight:
         filename_embd_weight = 0.1
     title_w = float(filename_embd_weight)
-    vects = (title_w * tts + (1 - title_w) *
-             cnts) if len(tts) == len(cnts) else cnts
 
-    assert len(vects) == len(docs)
     vector_size = 0
-    for i, d in enumerate(docs):
-        v = vects[i].tolist()
-        vector_size = len(v)
-        d["q_%d_vec" % len(v)] = v
+
+    async def on_batch(start, vts):
+        nonlocal vector_size
+        batch = docs[start: start + len(vts)]
+        vects = title_w * title_vec + (1 - title_w) * vts
+        for d, v in zip(batch, vects):
+            v = v.tolist()
+            vector_size = len(v)
+            d["q_%d_vec" % len(v)] = v
+        if send_channel is not None:
+            await send_channel.send(batch)
+        elif callback:
+            callback(prog=0.7 + 0.2 * (start + len(vts)) / len(cnts), msg="")
+
+    _, c = await get_embedding_scheduler(mdl).encode(mdl, cnts, on_batch)
+    tk_count += c
     return tk_count, vector_size
 
 
+async def insert_chunks(task, receive_channel, vector_size, progress_callback, total):
+    """
+    Index chunk batches into the doc store as they arrive on `receive_channel`.
+    Vectors are dropped from chunks once indexed, so only in-flight batches hold them.
+    Return False if the task got canceled or removed meanwhile. In that case, and when inserting
+    or the embedding feeding `receive_channel` fails, the chunks already indexed are removed
+    again so that a failed document leaves nothing searchable behind.
+    """
+    task_id = task["id"]
+    task_tenant_id = task["tenant_id"]
+    task_dataset_id = task["kb_id"]
+    vctr_nm = "q_%d_vec" % vector_size
+    chunk_ids = []
+
+    async def delete_image(kb_id, chunk_id):
+        try:
+            async with minio_limiter:
+                STORAGE_IMPL.delete(kb_id, chunk_id)
+        except Exception:
+            logging.exception(
+                "Deleting image of chunk {}/{}/{} got exception".format(task["location"], task["name"], chunk_id))
+            raise
+
+    async def remove_inserted():
+        if not chunk_ids:
+            return
+        await trio.to_thread.run_sync(lambda: settings.docStoreConn.delete({"id": chunk_ids}, search.index_name(task_tenant_id), task_dataset_id))
+        bump_kb_generation(task_dataset_id)
+        async with trio.open_nursery() as nursery:
+            for chunk_id in chunk_ids:
+                nursery.start_soon(delete_image, task_dataset_id, chunk_id)
+
+    async def insert_bulk(bulk):
+        b = len(chunk_ids)
+        doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert(bulk, search.index_name(task_tenant_id), task_dataset_id))
+        chunk_ids.extend([chunk["id"] for chunk in bulk])
+        task_canceled = has_canceled(task_id)
+        if task_canceled:
+            progress_callback(-1, msg="Task has been canceled.")
+            return False
+        if b % 128 == 0:
+            progress_callback(prog=0.7 + 0.2 * (b + 1) / total, msg="")
+        if doc_store_result:
+            error_message = f"Insert chunk error: {doc_store_result}, please check log file and Elasticsearch/Infinity status!"
+            progress_callback(-1, msg=error_message)
+            raise Exception(error_message)
+        for d in bulk:
+            d.pop(vctr_nm, None)
+        chunk_ids_str = " ".join(chunk_ids)
+        try:
+            TaskService.update_chunk_ids(task_id, chunk_ids_str)
+        except DoesNotExist:
+            logging.warning(f"do_handle_task update_chunk_ids failed since task {task_id} is unknown.")
+            progress_callback(-1, msg=f"Chunk updates failed since task {task_id} is unknown.")
+            return False
+        return True
+
+    async def insert_all():
+        pending = []
+        async for batch in receive_channel:
+            pending.extend(batch)
+            while len(pending) >= DOC_BULK_SIZE:
+                bulk, pending = pending[:DOC_BULK_SIZE], pending[DOC_BULK_SIZE:]
+                if not await insert_bulk(bulk):
+                    return False
+        return not pending or await insert_bulk(pending)
+
+    try:
+        completed = await insert_all()
+    except BaseException:
+        with trio.CancelScope(shield=True):
+            await remove_inserted()
+        raise
+    if not completed:
+        await remove_inserted()
+    return completed
+
+
 async def run_dataflow(dsl:str, tenant_id:str, doc_id:str, task_id:str, flow_id:str, callback=None):
     _ = callback
 
@@ -508,7 +586,8 @@ async def run_raptor(row, chat_mdl, embd_mdl, vector_size, callback=None):
         row["parser_config"]["raptor"]["threshold"]
     )
     original_length = len(chunks)
-    chunks = await raptor(chunks, row["parser_config"]["raptor"]["random_seed"], callback)
+    chunks = await raptor(chunks, row["parser_config"]["raptor"]["random_seed"], callback,
+                          tree_id=f"{row['kb_id']}:{row['doc_id']}")
     doc = {
         "doc_id": row["doc_id"],
         "kb_id": [str(row["kb_id"])],
@@ -600,6 +679,7 @@ async def do_handle_task(task):
         with_community = graphrag_conf.get("community", False)
         async with kg_limiter:
             await run_graphrag(task, task_language, with_resolution, with_community, chat_model, embedding_model, progress_callback)
+        bump_kb_generation(task_dataset_id)
         progress_callback(prog=1.0, msg="Knowledge Graph done ({:.2f}s)".format(timer() - start_ts))
         return
     else:
@@ -613,57 +693,43 @@ async def do_handle_task(task):
         # TODO: exception handler
         ## set_progress(task["did"], -1, "ERROR: ")
         progress_callback(msg="Generate {} chunks".format(len(chunks)))
-        start_ts = timer()
-        try:
-            token_count, vector_size = await embedding(chunks, embedding_model, task_parser_config, progress_callback)
-        except Exception as e:
-            error_message = "Generate embedding error:{}".format(str(e))
-            progress_callback(-1, error_message)
-            logging.exception(error_message)
-            token_count = 0
-            raise
-        progress_message = "Embedding chunks ({:.2f}s)".format(timer() - start_ts)
-        logging.info(progress_message)
-        progress_callback(msg=progress_message)
+        token_count = 0
 
+    # Chunks flow through embedding and into the doc store batch by batch, so the embedding
+    # model and the doc store are busy at the same time.
     chunk_count = len(set([chunk["id"] for chunk in chunks]))
     start_ts = timer()
-    doc_store_result = ""
-
-    async def delete_image(kb_id, chunk_id):
-        try:
-            async with minio_limiter:
-                STORAGE_IMPL.delete(kb_id, chunk_id)
-        except Exception:
-            logging.exception(
-                "Deleting image of chunk {}/{}/{} got exception".format(task["location"], task["name"], chunk_id))
-            raise
+    send_channel, receive_channel = trio.open_memory_channel(MAX_PENDING_EMBEDDING_BATCHES)
+
+    async def produce_chunks():
+        # The channel is closed only once every batch got sent. On failure insert_chunks is canceled
+        # by the nursery instead of seeing a regular end of input, and removes what it indexed so far.
+        nonlocal token_count
+        if task_type == "raptor":
+            await send_channel.send(chunks)
+        else:
+            embedding_start_ts = timer()
+            try:
+                token_count, _ = await embedding(chunks, embedding_model, task_parser_config, progress_callback, send_channel)
+            except Exception as e:
+                error_message = "Generate embedding error:{}".format(str(e))
+                progress_callback(-1, error_message)
+                logging.exception(error_message)
+                raise
+            progress_message = "Embedding chunks ({:.2f}s)".format(timer() - embedding_start_ts)
+            logging.info(progress_message)
+            progress_callback(msg=progress_message)
+        await send_channel.aclose()
 
-    for b in range(0, len(chunks), DOC_BULK_SIZE):
-        doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.insert(chunks[b:b + DOC_BULK_SIZE], search.index_name(task_tenant_id), task_dataset_id))
-        task_canceled = has_canceled(task_id)
-        if task_canceled:
-            progress_callback(-1, msg="Task has been canceled.")
-            return
-        if b % 128 == 0:
-            progress_callback(prog=0.8 + 0.1 * (b + 1) / len(chunks), msg="")
-        if doc_store_result:
-            error_message = f"Insert chunk error: {doc_store_result}, please check log file and Elasticsearch/Infinity status!"
-            progress_callback(-1, msg=error_message)
-            raise Exception(error_message)
-        chunk_ids = [chunk["id"] for chunk in chunks[:b + DOC_BULK_SIZE]]
-        chunk_ids_str = " ".join(chunk_ids)
-        try:
-            TaskService.update_chunk_ids(task["id"], chunk_ids_str)
-        except DoesNotExist:
-            logging.warning(f"do_handle_task update_chunk_ids failed since task {task['id']} is unknown.")
-            doc_store_result = await trio.to_thread.run_sync(lambda: settings.docStoreConn.delete({"id": chunk_ids}, search.index_name(task_tenant_id), task_dataset_id))
-            async with trio.open_nursery() as nursery:
-                for chunk_id in chunk_ids:
-                    nursery.start_soon(delete_image, task_dataset_id, chunk_id)
-            progress_callback(-1, msg=f"Chunk updates failed since task {task['id']} is unknown.")
-            return
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(produce_chunks)
+        completed = await insert_chunks(task, receive_channel, vector_size, progress_callback, len(chunks))
+        if not completed:
+            nursery.cancel_scope.cancel()
+    if not completed:
+        return
 
+    bump_kb_generation(task_dataset_id)
     logging.info("Indexing doc({}), page({}-{}), chunks({}), elapsed: {:.2f}".format(task_document_name, task_from_page,
                                                                                      task_to_page, len(chunks),
                                                                                      timer() - start_ts))
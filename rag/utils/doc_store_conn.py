@@ -56,6 +56,31 @@ class SparseVector:
         return str(self)
 
 
+def vectors_to_matrix(vectors: list, dim: int) -> np.ndarray:
+    """
+    Pack the stored dense vectors of a batch of hits into one contiguous (n, dim) float32 matrix.
+    A vector may be a list, an ndarray, a float32 buffer or a tab-separated string;
+    missing or mis-sized vectors become zero rows.
+    """
+    try:
+        mat = np.asarray(vectors, dtype=np.float32)
+        if mat.shape == (len(vectors), dim):
+            return mat
+    except (TypeError, ValueError):
+        pass
+    mat = np.zeros((len(vectors), dim), dtype=np.float32)
+    for i, v in enumerate(vectors):
+        if v is None:
+            continue
+        if isinstance(v, (bytes, bytearray, memoryview)):
+            v = np.frombuffer(v, dtype=np.float32)
+        elif isinstance(v, str):
+            v = np.array(v.split("\t"), dtype=np.float32) if v else []
+        if len(v) == dim:
+            mat[i] = v
+    return mat
+
+
 class MatchTextExpr(ABC):
     def __init__(
         self,
@@ -252,6 +277,13 @@ class DocStoreConnection(ABC):
     def getFields(self, res, fields: list[str]) -> dict[str, dict]:
         raise NotImplementedError("Not implemented")
 
+    def getVectors(self, res, fieldnm: str, dim: int) -> np.ndarray:
+        """
+        Return the dense vectors of the hits as a (n, dim) float32 matrix, rows ordered as getChunkIds(res)
+        """
+        fields = self.getFields(res, [fieldnm])
+        return vectors_to_matrix([fields.get(i, {}).get(fieldnm) for i in self.getChunkIds(res)], dim)
+
     @abstractmethod
     def getHighlight(self, res, keywords: list[str], fieldnm: str):
         raise NotImplementedError("Not implemented")
@@ -0,0 +1,214 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import logging
+import os
+import random
+import re
+from timeit import default_timer as timer
+
+import numpy as np
+import trio
+
+from api.utils.api_utils import timeout
+from graphrag.utils import get_embed_cache_batch, set_embed_cache_batch
+from rag.settings import EMBEDDING_BATCH_SIZE, EMBEDDING_CACHE_ENABLED, EMBEDDING_CACHE_TTL
+from rag.utils import num_tokens_from_string, truncate
+
+EMBEDDING_CONCURRENCY = int(os.environ.get("EMBEDDING_CONCURRENCY", 4))
+EMBEDDING_MAX_BATCH_SIZE = int(os.environ.get("EMBEDDING_MAX_BATCH_SIZE", EMBEDDING_BATCH_SIZE * 8))
+EMBEDDING_TARGET_LATENCY = float(os.environ.get("EMBEDDING_TARGET_LATENCY", 5.0))
+EMBEDDING_MAX_RETRIES = int(os.environ.get("EMBEDDING_MAX_RETRIES", 5))
+
+RATE_LIMIT_PATTERN = re.compile(r"rate limit|429|tpm limit|too many requests|requests per minute", flags=re.IGNORECASE)
+
+
+def is_rate_limited(e: Exception) -> bool:
+    return bool(RATE_LIMIT_PATTERN.search(str(e)))
+
+
+class EmbeddingScheduler:
+    """
+    Keeps several `encode` batches of one embedding model in flight.
+
+    The batch size grows additively while batches finish within the target latency without
+    hurting throughput, and halves when they get slow. A batch never holds more tokens than
+    `EMBEDDING_BATCH_SIZE` texts of the model's `max_length` would, so short chunks make large
+    batches and long chunks small ones. Rate limit errors halve both the batch size and the
+    number of batches in flight, then the batch is retried after an exponential backoff;
+    concurrency is restored gradually after consecutive successes.
+    """
+
+    def __init__(self, batch_size=EMBEDDING_BATCH_SIZE, max_batch_size=EMBEDDING_MAX_BATCH_SIZE,
+                 concurrency=EMBEDDING_CONCURRENCY, target_latency=EMBEDDING_TARGET_LATENCY,
+                 max_retries=EMBEDDING_MAX_RETRIES, base_delay=1.0):
+        self.base_batch_size = max(1, batch_size)
+        self.batch_size = self.base_batch_size
+        self.max_batch_size = max(self.base_batch_size, max_batch_size)
+        self.concurrency = max(1, concurrency)
+        self.target_latency = target_latency
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.limiter = trio.CapacityLimiter(self.concurrency)
+        self.throughput = 0.0
+        self._successes = 0
+
+    def _next_batch_end(self, lengths, start, max_batch_tokens):
+        end, tokens = start, 0
+        while end < len(lengths) and end - start < self.batch_size:
+            if end > start and tokens + lengths[end] > max_batch_tokens:
+                break
+            tokens += lengths[end]
+            end += 1
+        return end
+
+    def _adapt(self, n, latency):
+        tput = n / max(latency, 1e-6)
+        if latency > self.target_latency * 1.5:
+            self.batch_size = max(1, self.batch_size // 2)
+        elif self.throughput and tput < self.throughput * 0.8:
+            self.batch_size = max(1, self.batch_size - max(1, self.base_batch_size // 2))
+        elif latency < self.target_latency and n >= self.batch_size:
+            self.batch_size = min(self.max_batch_size, self.batch_size + max(1, self.base_batch_size // 2))
+        self.throughput = tput if not self.throughput else 0.8 * self.throughput + 0.2 * tput
+
+        self._successes += 1
+        if self.limiter.total_tokens < self.concurrency and self._successes >= 8:
+            self.limiter.total_tokens += 1
+            self._successes = 0
+
+    async def _encode_batch(self, mdl, texts):
+        @timeout(60)
+        def batch_encode(txts):
+            return mdl.encode(txts)
+
+        for attempt in range(self.max_retries + 1):
+            st = timer()
+            try:
+                vts, c = await trio.to_thread.run_sync(lambda: batch_encode(texts))
+            except Exception as e:
+                if not is_rate_limited(e) or attempt >= self.max_retries:
+                    raise
+                self.batch_size = max(1, self.batch_size // 2)
+                self.limiter.total_tokens = max(1, self.limiter.total_tokens // 2)
+                self._successes = 0
+                delay = self.base_delay * (2 ** attempt) * random.uniform(0.5, 1.5)
+                logging.warning(f"EmbeddingScheduler rate limited, retry in {delay:.2f}s with {self.limiter.total_tokens} batches in flight: {e}")
+                await trio.sleep(delay)
+                continue
+            self._adapt(len(texts), timer() - st)
+            return vts, c
+
+    async def encode(self, mdl, texts: list[str], on_batch=None, use_cache=EMBEDDING_CACHE_ENABLED):
+        """
+        Encode `texts` with `mdl`, keeping several batches in flight.
+
+        Identical texts are sent to the model once. With `use_cache`, vectors are also looked up
+        in and stored to the embedding cache, keyed by model name and truncated text, so only
+        texts never seen before reach the model.
+        `on_batch(start, vectors)` is awaited for consecutive runs of texts in input order. Without
+        it the vectors are gathered into one preallocated (len(texts), dim) matrix.
+        Return the matrix (None when `on_batch` is given) and the token count.
+        """
+        max_length = getattr(mdl, "max_length", 8192) - 10
+        texts = [truncate(t, max_length) for t in texts]
+        uniq = {}
+        slots = [uniq.setdefault(t, len(uniq)) for t in texts]
+        utexts = list(uniq)
+        first_pos = {}
+        for pos, slot in enumerate(slots):
+            first_pos.setdefault(slot, pos)
+
+        llm_name = getattr(mdl, "llm_name", None)
+        use_cache = use_cache and bool(llm_name)
+        uvecs = [None] * len(utexts)
+        if use_cache and utexts:
+            uvecs = await trio.to_thread.run_sync(lambda: get_embed_cache_batch(llm_name, utexts))
+        misses = [i for i, v in enumerate(uvecs) if v is None]
+        if len(texts) > len(misses):
+            logging.debug(f"EmbeddingScheduler: {len(texts) - len(misses)}/{len(texts)} texts served by dedup or cache")
+
+        lengths = [num_tokens_from_string(utexts[i]) for i in misses]
+        max_batch_tokens = max_length * self.base_batch_size
+
+        mat = None
+        tk_count = 0
+        waiters = []
+        next_emit = 0
+        emit_lock = trio.Lock()
+
+        async def emit():
+            nonlocal next_emit, mat
+            async with emit_lock:
+                while next_emit < len(texts) and uvecs[slots[next_emit]] is not None:
+                    end = next_emit
+                    while end < len(texts) and end - next_emit < self.max_batch_size and uvecs[slots[end]] is not None:
+                        end += 1
+                    vts = np.stack([uvecs[slots[pos]] for pos in range(next_emit, end)])
+                    if on_batch is not None:
+                        await on_batch(next_emit, vts)
+                    else:
+                        if mat is None:
+                            mat = np.empty((len(texts), vts.shape[1]), dtype=vts.dtype)
+                        mat[next_emit: end] = vts
+                    next_emit = end
+                for threshold, ev in list(waiters):
+                    if threshold <= next_emit:
+                        waiters.remove((threshold, ev))
+                        ev.set()
+
+        async def run_batch(start, end, borrower):
+            nonlocal tk_count
+            try:
+                batch = misses[start: end]
+                btexts = [utexts[i] for i in batch]
+                vts, c = await self._encode_batch(mdl, btexts)
+                assert len(vts) == end - start
+                tk_count += c
+                # Hold the slot until this batch is handed on, so finished batches waiting
+                # behind a slow one can not pile up beyond the concurrency limit.
+                ev = trio.Event()
+                waiters.append((first_pos[batch[-1]] + 1, ev))
+                for i, v in zip(batch, vts):
+                    uvecs[i] = v
+                await emit()
+                if use_cache:
+                    await trio.to_thread.run_sync(lambda: set_embed_cache_batch(llm_name, btexts, vts, EMBEDDING_CACHE_TTL))
+                await ev.wait()
+            finally:
+                self.limiter.release_on_behalf_of(borrower)
+
+        await emit()
+        async with trio.open_nursery() as nursery:
+            start = 0
+            while start < len(misses):
+                end = self._next_batch_end(lengths, start, max_batch_tokens)
+                borrower = object()
+                await self.limiter.acquire_on_behalf_of(borrower)
+                nursery.start_soon(run_batch, start, end, borrower)
+                start = end
+
+        return mat, tk_count
+
+
+_SCHEDULERS = {}
+
+
+def get_embedding_scheduler(mdl) -> EmbeddingScheduler:
+    """Return the scheduler shared by every caller of the same tenant's embedding model."""
+    key = (getattr(mdl, "tenant_id", None), getattr(mdl, "llm_name", None) or id(mdl))
+    if key not in _SCHEDULERS:
+        _SCHEDULERS[key] = EmbeddingScheduler()
+    return _SCHEDULERS[key]
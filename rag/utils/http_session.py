@@ -0,0 +1,152 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Pooled, keep-alive HTTP sessions shared by the `requests`-based model providers.
+
+One session is kept per origin (scheme, host and port), so every model served by the same
+endpoint reuses its TCP/TLS connections. Sessions are shared across tenants, so they never keep
+cookies. At most `HTTP_MAX_SESSIONS` origins are kept; the least recently used one is dropped
+beyond that, and its connections are released once no caller holds it any more.
+`get_httpx_client` does the same for `httpx` callers and speaks HTTP/2 when the `h2` package is
+installed.
+"""
+import os
+import threading
+from collections import OrderedDict
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+HTTP_POOL_CONNECTIONS = int(os.environ.get("HTTP_POOL_CONNECTIONS", 10))
+HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", 32))
+HTTP_MAX_SESSIONS = int(os.environ.get("HTTP_MAX_SESSIONS", 64))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get("HTTP_CONNECT_TIMEOUT", 10))
+HTTP_READ_TIMEOUT = float(os.environ.get("HTTP_READ_TIMEOUT", os.environ.get("LM_TIMEOUT_SECONDS", 600)))
+HTTP2_ENABLED = os.environ.get("HTTP2_ENABLED", "true").lower() in ["true", "1", "yes"]
+
+try:
+    import h2  # noqa: F401
+
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class PooledSession(requests.Session):
+    """A cookie-less `requests.Session` with a bounded connection pool, a default timeout and usage counters."""
+
+    def __init__(self, pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE):
+        super().__init__()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+        # Shared by every tenant calling the origin, so no cookie may be carried from one call to another.
+        self.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        self.pool_maxsize = pool_maxsize
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._lock = threading.Lock()
+
+    def request(self, method, url, *args, **kwargs):
+        kwargs.setdefault("timeout", (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            return super().request(method, url, *args, **kwargs)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "pool_maxsize": self.pool_maxsize,
+            "utilization": self.peak_in_flight / self.pool_maxsize if self.pool_maxsize else 0.0,
+        }
+
+
+_SESSIONS = OrderedDict()
+_HTTPX_CLIENTS = OrderedDict()
+_LOCK = threading.Lock()
+
+
+def _origin(url: str) -> str:
+    parts = urlsplit(url if "://" in url else "http://" + url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _get_or_create(cache: OrderedDict, key: str, create):
+    with _LOCK:
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
+        cache[key] = obj = create()
+        # Evicted sessions may still be in use by other threads, mid-request or mid-stream,
+        # so they are only dropped from the cache and their sockets go with the last reference.
+        while len(cache) > HTTP_MAX_SESSIONS:
+            cache.popitem(last=False)
+        return obj
+
+
+def get_session(url: str) -> PooledSession:
+    """Return the pooled session shared by every request to the origin of `url`."""
+    return _get_or_create(_SESSIONS, _origin(url), PooledSession)
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    return get_session(url).request(method, url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return get_session(url).post(url, **kwargs)
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return get_session(url).get(url, **kwargs)
+
+
+def get_httpx_client(url: str) -> httpx.Client:
+    """Return the pooled `httpx` client for the origin of `url`, using HTTP/2 where available."""
+
+    def create():
+        return httpx.Client(
+            http2=HTTP2_ENABLED and HTTP2_AVAILABLE,
+            limits=httpx.Limits(max_connections=HTTP_POOL_MAXSIZE, max_keepalive_connections=HTTP_POOL_CONNECTIONS),
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        )
+
+    return _get_or_create(_HTTPX_CLIENTS, _origin(url), create)
+
+
+def pool_stats() -> dict:
+    """Return the usage counters of every pooled session, keyed by origin."""
+    with _LOCK:
+        sessions = list(_SESSIONS.items())
+    return {origin: session.stats() for origin, session in sessions}
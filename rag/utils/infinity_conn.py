@@ -38,6 +38,7 @@ from rag.utils.doc_store_conn import (
     MatchDenseExpr,
     FusionExpr,
     OrderByExpr,
+    vectors_to_matrix,
 )
 
 logger = logging.getLogger('ragflow.infinity_conn')
@@ -708,6 +709,14 @@ class InfinityConnection(DocStoreConnection):
         
         return res2.set_index("id").to_dict(orient="index")
 
+    def getVectors(self, res: tuple[pd.DataFrame, int] | pd.DataFrame, fieldnm: str, dim: int):
+        if isinstance(res, tuple):
+            res = res[0]
+        column_map = {col.lower(): col for col in res.columns}
+        if fieldnm.lower() not in column_map:
+            return vectors_to_matrix([None] * len(res), dim)
+        return vectors_to_matrix(res[column_map[fieldnm.lower()]].tolist(), dim)
+
     def getHighlight(self, res: tuple[pd.DataFrame, int] | pd.DataFrame, keywords: list[str], fieldnm: str):
         if isinstance(res, tuple):
             res = res[0]
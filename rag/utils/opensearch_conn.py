@@ -29,7 +29,7 @@ from rag.settings import TAG_FLD, PAGERANK_FLD
 from rag.utils import singleton
 from api.utils.file_utils import get_project_base_directory
 from rag.utils.doc_store_conn import DocStoreConnection, MatchExpr, OrderByExpr, MatchTextExpr, MatchDenseExpr, \
-    FusionExpr
+    FusionExpr, vectors_to_matrix
 from rag.nlp import is_english, rag_tokenizer
 
 ATTEMPT_TIME = 2
@@ -490,6 +490,9 @@ class OSConnection(DocStoreConnection):
                 res_fields[d["id"]] = m
         return res_fields
 
+    def getVectors(self, res, fieldnm: str, dim: int):
+        return vectors_to_matrix([d["_source"].get(fieldnm) for d in res["hits"]["hits"]], dim)
+
     def getHighlight(self, res, keywords: list[str], fieldnm: str):
         ans = {}
         for d in res["hits"]["hits"]:
@@ -130,6 +130,77 @@ class RedisDB:
             self.__open__()
         return False
 
+    def mget(self, keys: list[str]):
+        if not self.REDIS:
+            return
+        try:
+            return self.REDIS.mget(keys)
+        except Exception as e:
+            logging.warning("RedisDB.mget " + str(keys) + " got exception: " + str(e))
+            self.__open__()
+
+    def set_many(self, mapping: dict, exp=3600):
+        try:
+            pipeline = self.REDIS.pipeline(transaction=False)
+            for k, v in mapping.items():
+                pipeline.set(k, v, exp)
+            pipeline.execute()
+            return True
+        except Exception as e:
+            logging.warning("RedisDB.set_many " + str(len(mapping)) + " keys got exception: " + str(e))
+            self.__open__()
+        return False
+
+    def incr(self, key: str, amount: int = 1):
+        try:
+            return self.REDIS.incrby(key, amount)
+        except Exception as e:
+            logging.warning("RedisDB.incr " + str(key) + " got exception: " + str(e))
+            self.__open__()
+        return None
+
+    def hincrby(self, key: str, field: str, amount: int = 1):
+        try:
+            return self.REDIS.hincrby(key, field, amount)
+        except Exception as e:
+            logging.warning("RedisDB.hincrby " + str(key) + " got exception: " + str(e))
+            self.__open__()
+        return None
+
+    def hgetall(self, key: str):
+        try:
+            return self.REDIS.hgetall(key)
+        except Exception as e:
+            logging.warning("RedisDB.hgetall " + str(key) + " got exception: " + str(e))
+            self.__open__()
+        return None
+
+    def hdel(self, key: str, field: str):
+        try:
+            self.REDIS.hdel(key, field)
+            return True
+        except Exception as e:
+            logging.warning("RedisDB.hdel " + str(key) + " got exception: " + str(e))
+            self.__open__()
+        return False
+
+    def hget(self, key: str, field: str):
+        try:
+            return self.REDIS.hget(key, field)
+        except Exception as e:
+            logging.warning("RedisDB.hget " + str(key) + " got exception: " + str(e))
+            self.__open__()
+        return None
+
+    def rename(self, key: str, new_key: str):
+        try:
+            self.REDIS.rename(key, new_key)
+            return True
+        except Exception as e:
+            logging.warning("RedisDB.rename " + str(key) + " got exception: " + str(e))
+            self.__open__()
+        return False
+
     def sadd(self, key: str, member: str):
         try:
             self.REDIS.sadd(key, member)
@@ -375,5 +446,12 @@ class RedisDistributedLock:
                 break
             await trio.sleep(10)
 
+    def extend(self):
+        """Reset the lock's timeout; return False if the lock is no longer held."""
+        try:
+            return self.lock.reacquire()
+        except Exception:
+            return False
+
     def release(self):
         REDIS_CONN.delete_if_equal(self.lock_key, self.lock_value)
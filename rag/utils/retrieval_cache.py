@@ -0,0 +1,128 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+Two-tier (in-process LRU + Redis) cache of `Dealer.retrieval` results.
+
+Every cache key embeds the current generation of each knowledge base involved.
+Every path that writes chunks (indexing, chunk edits, switches and deletes, pagerank and
+tag updates) calls `bump_kb_generation` afterwards, which makes all cached results of that
+knowledge base unreachable without scanning Redis. Inserts and single chunk updates only become
+searchable at the next index refresh, so the generation is bumped again once
+`RETRIEVAL_CACHE_REFRESH_DELAY` has passed: results cached in between may predate the write.
+"""
+import json
+import logging
+import re
+import threading
+
+import xxhash
+from cachetools import TTLCache
+
+from rag.settings import RETRIEVAL_CACHE_ENABLED, RETRIEVAL_CACHE_REFRESH_DELAY, RETRIEVAL_CACHE_SIZE, RETRIEVAL_CACHE_TTL
+from rag.utils.redis_conn import REDIS_CONN
+
+
+def kb_generation_key(kb_id: str) -> str:
+    return f"kb_generation:{kb_id}"
+
+
+def _incr_kb_generations(kb_ids: list[str]):
+    for kb_id in kb_ids:
+        REDIS_CONN.incr(kb_generation_key(kb_id))
+
+
+def bump_kb_generation(kb_ids: str | list[str]):
+    if isinstance(kb_ids, str):
+        kb_ids = [kb_ids]
+    _incr_kb_generations(kb_ids)
+    if RETRIEVAL_CACHE_REFRESH_DELAY > 0:
+        threading.Timer(RETRIEVAL_CACHE_REFRESH_DELAY, _incr_kb_generations, args=(kb_ids,)).start()
+
+
+def get_kb_generations(kb_ids: list[str]) -> list[int] | None:
+    """
+    Return the generation of each knowledge base, or None when Redis is unavailable,
+    in which case nothing may be cached since invalidation can not be observed.
+    """
+    gens = REDIS_CONN.mget([kb_generation_key(kb_id) for kb_id in kb_ids])
+    if gens is None:
+        return None
+    return [int(g) if g else 0 for g in gens]
+
+
+class RetrievalCache:
+    def __init__(self, maxsize: int = RETRIEVAL_CACHE_SIZE, ttl: int = RETRIEVAL_CACHE_TTL):
+        self.ttl = ttl
+        self._local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize_question(question: str) -> str:
+        return re.sub(r"\s+", " ", question).strip().lower()
+
+    def make_key(self, question: str, kb_ids: list[str], **params) -> str | None:
+        kb_ids = sorted(set(kb_ids or []))
+        gens = get_kb_generations(kb_ids) if kb_ids else []
+        if gens is None:
+            return None
+        hasher = xxhash.xxh64()
+        hasher.update(self.normalize_question(question).encode("utf-8"))
+        hasher.update(json.dumps(list(zip(kb_ids, gens))).encode("utf-8"))
+        hasher.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+        return "retrieval:" + hasher.hexdigest()
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            bin = self._local.get(key)
+            if bin is not None:
+                self.local_hits += 1
+        if bin is not None:
+            return json.loads(bin)
+        bin = REDIS_CONN.get(key)
+        with self._lock:
+            if bin:
+                self.redis_hits += 1
+                self._local[key] = bin
+            else:
+                self.misses += 1
+        return json.loads(bin) if bin else None
+
+    def set(self, key: str, ranks: dict):
+        try:
+            bin = json.dumps(ranks, ensure_ascii=False, default=lambda o: o.item() if hasattr(o, "item") else str(o))
+        except Exception:
+            logging.exception("RetrievalCache.set can't serialize the retrieval result")
+            return
+        with self._lock:
+            self._local[key] = bin
+        REDIS_CONN.set(key, bin, self.ttl)
+
+    def stats(self) -> dict:
+        with self._lock:
+            local_hits, redis_hits, misses = self.local_hits, self.redis_hits, self.misses
+        total = local_hits + redis_hits + misses
+        return {
+            "local_hits": local_hits,
+            "redis_hits": redis_hits,
+            "misses": misses,
+            "hit_ratio": (local_hits + redis_hits) / total if total else 0.0,
+        }
+
+
+RETRIEVAL_CACHE = RetrievalCache() if RETRIEVAL_CACHE_ENABLED else None
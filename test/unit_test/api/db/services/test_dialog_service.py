@@ -0,0 +1,92 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import threading
+import time
+
+import pytest
+
+from api.db.services.dialog_service import run_stages
+
+
+def stage(value, delay=0.0):
+    def func(res):
+        time.sleep(delay)
+        return value(res) if callable(value) else value
+
+    return func
+
+
+class TestRunStages:
+    @pytest.mark.p1
+    def test_dependencies_and_concurrency(self):
+        # The two independent stages wait for each other, so they must overlap.
+        barrier = threading.Barrier(2, timeout=10)
+
+        def independent(value):
+            def func(res):
+                barrier.wait()
+                return value
+
+            return func
+
+        results, timings = run_stages(
+            {
+                "a": ([], independent(1), None),
+                "b": ([], independent(2), None),
+                "sum": (["a", "b"], stage(lambda res: res["a"] + res["b"]), None),
+                "double": (["sum"], stage(lambda res: res["sum"] * 2), None),
+            },
+            timeout=10,
+        )
+        assert results == {"a": 1, "b": 2, "sum": 3, "double": 6}
+        assert timings["sum"][0] >= max(timings["a"][1], timings["b"][1])
+        assert timings["double"][0] >= timings["sum"][1]
+
+    @pytest.mark.p1
+    def test_timeout_uses_fallback(self):
+        results, timings = run_stages(
+            {
+                "slow": ([], stage("late", delay=2), lambda res: "fallback"),
+                "next": (["slow"], stage(lambda res: res["slow"] + "!"), None),
+            },
+            timeout=0.2,
+        )
+        assert results == {"slow": "fallback", "next": "fallback!"}
+        assert timings["slow"][1] - timings["slow"][0] < 1
+
+    @pytest.mark.p1
+    def test_timeout_without_fallback_fails(self):
+        with pytest.raises(TimeoutError, match="Retrieval timed out"):
+            run_stages({"retrieval": ([], stage("late", delay=2), None)}, timeout=0.2)
+
+    @pytest.mark.p2
+    def test_error_cancels_other_stages(self):
+        def fail(res):
+            raise ValueError("stage failed")
+
+        ran = []
+        start = time.time()
+        with pytest.raises(ValueError, match="stage failed"):
+            run_stages(
+                {
+                    "fail": ([], fail, None),
+                    "slow": ([], stage("late", delay=2), None),
+                    "after": (["slow"], stage(lambda res: ran.append(1)), None),
+                },
+                timeout=10,
+            )
+        assert time.time() - start < 1
+        assert ran == []
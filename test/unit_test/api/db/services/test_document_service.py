@@ -0,0 +1,135 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+from datetime import datetime
+
+import pytest
+from peewee import SqliteDatabase
+
+from api.db import TaskStatus
+from api.db.db_models import DB, Document, Task
+from api.db.services import document_service
+from api.db.services.document_service import DocumentService
+
+
+class LockingSqliteDatabase(SqliteDatabase):
+    """SQLite serializes writers anyway, so SELECT ... FOR UPDATE runs as a plain SELECT."""
+
+    for_update = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements = []
+
+    def execute_sql(self, sql, params=None, *args, **kwargs):
+        self.statements.append(sql)
+        return super().execute_sql(sql.replace(" FOR UPDATE", ""), params, *args, **kwargs)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = LockingSqliteDatabase(":memory:")
+    with db.bind_ctx([Document, Task]):
+        db.create_tables([Document, Task])
+        # The service methods open connections on the shared MySQL database object.
+        monkeypatch.setattr(DB, "is_closed", lambda: False)
+        monkeypatch.setattr(DB, "close", lambda: None)
+        monkeypatch.setattr(document_service, "DB", db)
+        monkeypatch.setattr(document_service, "PROGRESS_BATCH_SIZE", 2)
+        yield db
+
+
+@pytest.fixture
+def queue_lengths(monkeypatch):
+    calls = []
+
+    def get_queue_length(priority):
+        calls.append(priority)
+        return 10 + priority
+
+    monkeypatch.setattr(document_service, "get_queue_length", get_queue_length)
+    return calls
+
+
+def add_doc(doc_id, tasks, run=TaskStatus.RUNNING.value):
+    Document.create(id=doc_id, kb_id="kb", parser_id="naive", type="pdf", created_by="user", suffix="pdf", progress=0.1, run=run,
+                    process_begin_at=datetime.now())
+    for i, (progress, msg, priority) in enumerate(tasks):
+        Task.create(id=f"{doc_id}-{i}", doc_id=doc_id, progress=progress, progress_msg=msg, priority=priority)
+
+
+def doc(doc_id):
+    return Document.get_by_id(doc_id)
+
+
+class TestUpdateProgress:
+    @pytest.mark.p1
+    def test_aggregates_tasks_in_batches(self, db, queue_lengths):
+        add_doc("running", [(1, "b done", 0), (0.5, "a half", 0)])
+        add_doc("done", [(1, "x", 0), (1, "y", 0)])
+        add_doc("failed", [(1, "ok", 0), (-1, "error", 0)])
+        add_doc("queued", [(0, "", 1), (0, " ", 1)])
+        add_doc("queued2", [(0, "", 1)])
+        db.statements.clear()
+        DocumentService.update_progress()
+
+        assert (doc("running").progress, doc("running").progress_msg, doc("running").run) == (0.75, "a half\nb done", TaskStatus.RUNNING.value)
+        assert (doc("done").progress, doc("done").run) == (1, TaskStatus.DONE.value)
+        assert (doc("failed").progress, doc("failed").run) == (-1, TaskStatus.FAIL.value)
+        assert doc("queued").progress_msg == "11 tasks are ahead in the queue..."
+        assert doc("queued2").progress_msg == "11 tasks are ahead in the queue..."
+        # One queue read per priority and one task read per batch of documents.
+        assert queue_lengths == [1]
+        assert len([s for s in db.statements if s.startswith("SELECT") and 'FROM "task"' in s]) == 3
+
+    @pytest.mark.p1
+    def test_skips_documents_stopped_meanwhile(self, db, queue_lengths, monkeypatch):
+        add_doc("canceled", [(0.5, "half", 0)])
+        add_doc("running", [(0.5, "half", 0)])
+        get_unfinished_docs = DocumentService.get_unfinished_docs
+
+        def cancel_after_read():
+            docs = get_unfinished_docs()
+            Document.update(run=TaskStatus.CANCEL.value).where(Document.id == "canceled").execute()
+            return docs
+
+        monkeypatch.setattr(DocumentService, "get_unfinished_docs", cancel_after_read)
+        DocumentService.update_progress()
+        assert (doc("canceled").run, doc("canceled").progress) == (TaskStatus.CANCEL.value, 0.1)
+        assert (doc("running").run, doc("running").progress) == (TaskStatus.RUNNING.value, 0.5)
+
+    @pytest.mark.p2
+    def test_failed_bulk_update_falls_back_per_document(self, db, queue_lengths, monkeypatch):
+        for i in range(5):
+            add_doc(f"doc{i}", [(0.5, f"doc{i} half", 0)])
+        Document.update(run=TaskStatus.CANCEL.value).where(Document.id == "doc3").execute()
+        get_unfinished_docs = DocumentService.get_unfinished_docs
+
+        def read_as_running():
+            docs = get_unfinished_docs()
+            for d in docs:
+                d["run"] = TaskStatus.RUNNING.value
+            return docs
+
+        def fail(*args, **kwargs):
+            raise RuntimeError("bulk update failed")
+
+        monkeypatch.setattr(DocumentService, "get_unfinished_docs", read_as_running)
+        monkeypatch.setattr(Document, "bulk_update", fail)
+        DocumentService.update_progress()
+        for i in (0, 1, 2, 4):
+            assert (doc(f"doc{i}").progress, doc(f"doc{i}").progress_msg) == (0.5, f"doc{i} half")
+        # The per-document updates keep the run guard.
+        assert (doc("doc3").run, doc("doc3").progress) == (TaskStatus.CANCEL.value, 0.1)
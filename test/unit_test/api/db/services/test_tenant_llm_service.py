@@ -0,0 +1,206 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from api.db.services import tenant_llm_service
+from api.db.services.tenant_llm_service import (
+    LLM_USAGE_FLUSHING_KEY,
+    LLM_USAGE_KEY,
+    TenantLLMService,
+    bump_tenant_llm_generation,
+    cached_tenant_llm_lookup,
+    get_langfuse_tracer,
+)
+
+
+class FakeLangfuse:
+    instances = []
+
+    def __init__(self, public_key, secret_key, host):
+        self.public_key = public_key
+        self.auth_checks = 0
+        FakeLangfuse.instances.append(self)
+
+    def auth_check(self):
+        self.auth_checks += 1
+        return self.public_key != "bad"
+
+
+class FakeLock:
+    timeout = 60
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def acquire(self):
+        return True
+
+    def extend(self):
+        return True
+
+    def release(self):
+        pass
+
+
+class FakeModel:
+    def __init__(self, name):
+        self.name = name
+        self.client = object()
+        self.tools = None
+
+
+@pytest.fixture(autouse=True)
+def llm_cache(monkeypatch, redis):
+    monkeypatch.setattr(tenant_llm_service, "REDIS_CONN", redis)
+    tenant_llm_service._LLM_CACHE.clear()
+    tenant_llm_service._LANGFUSE_CLIENTS.clear()
+    FakeLangfuse.instances.clear()
+
+
+@pytest.fixture
+def resolver(monkeypatch):
+    calls = []
+
+    def get_model_config(tenant_id, llm_type, llm_name=None):
+        calls.append(("config", tenant_id, llm_type, llm_name))
+        return {"llm_name": llm_name or "default", "llm_factory": "Fake", "api_key": f"key-{len(calls)}"}
+
+    def model_instance(tenant_id, llm_type, llm_name=None, lang="Chinese", **kwargs):
+        calls.append(("instance", tenant_id, llm_type, llm_name))
+        return FakeModel(llm_name)
+
+    monkeypatch.setattr(TenantLLMService, "_get_model_config", get_model_config)
+    monkeypatch.setattr(TenantLLMService, "_model_instance", model_instance)
+    return calls
+
+
+class TestTenantLLMCache:
+    @pytest.mark.p1
+    def test_config_cached_until_settings_change(self, resolver):
+        config = TenantLLMService.get_model_config("tenant", "chat", "gpt")
+        config["api_key"] = "changed by caller"
+        assert TenantLLMService.get_model_config("tenant", "chat", "gpt")["api_key"] == "key-1"
+        TenantLLMService.get_model_config("other", "chat", "gpt")
+        assert len(resolver) == 2
+
+        bump_tenant_llm_generation("tenant")
+        assert TenantLLMService.get_model_config("tenant", "chat", "gpt")["api_key"] == "key-3"
+
+    @pytest.mark.p1
+    def test_instances_share_the_client(self, resolver):
+        m1 = TenantLLMService.model_instance("tenant", "chat", "gpt")
+        m2 = TenantLLMService.model_instance("tenant", "chat", "gpt")
+        assert len(resolver) == 1
+        assert m1 is not m2 and m1.client is m2.client
+        m1.tools = ["search"]
+        assert m2.tools is None
+        TenantLLMService.model_instance("tenant", "chat", "gpt", lang="English")
+        assert len(resolver) == 2
+
+    @pytest.mark.p2
+    def test_not_cached_without_redis_or_result(self, monkeypatch):
+        calls = []
+        for _ in range(2):
+            cached_tenant_llm_lookup(("missing",), "tenant", lambda: calls.append(1))
+        monkeypatch.setattr(tenant_llm_service.REDIS_CONN, "mget", lambda keys: None)
+        for _ in range(2):
+            cached_tenant_llm_lookup(("value",), "tenant", lambda: calls.append(1) or 1)
+        assert len(calls) == 4
+
+    @pytest.mark.p1
+    def test_langfuse_auth_checked_once_per_keys(self, monkeypatch):
+        keys = {"tenant": SimpleNamespace(public_key="pk", secret_key="sk", host="h"), "bad": SimpleNamespace(public_key="bad", secret_key="sk", host="h")}
+        monkeypatch.setattr(tenant_llm_service, "Langfuse", FakeLangfuse)
+        monkeypatch.setattr(tenant_llm_service.TenantLangfuseService, "filter_by_tenant", lambda tenant_id: keys.get(tenant_id))
+
+        tracer = get_langfuse_tracer("tenant")
+        assert get_langfuse_tracer("tenant") is tracer
+        assert get_langfuse_tracer("bad") is None
+        assert get_langfuse_tracer("bad") is None
+        assert get_langfuse_tracer("none") is None
+        assert [lf.auth_checks for lf in FakeLangfuse.instances] == [1, 1]
+
+
+@pytest.fixture
+def usage(monkeypatch, redis):
+    """Token usage added to tenant_llm, by model; `fail` lists the models whose update raises."""
+    applied = {}
+    fail = set()
+
+    def get_tenant(tenant_id):
+        return True, SimpleNamespace(llm_id="chat-model", embd_id="embedding-model", asr_id=None, img2txt_id=None, rerank_id=None, tts_id=None)
+
+    def add_used_tokens(tenant_id, llm_name, llm_factory, used_tokens, raise_error=False):
+        # The field is still staged while tenant_llm is updated.
+        assert int(redis.hget(LLM_USAGE_FLUSHING_KEY, json.dumps([tenant_id, llm_name, llm_factory]))) == used_tokens
+        if llm_name in fail:
+            raise RuntimeError("update failed")
+        applied[llm_name] = applied.get(llm_name, 0) + used_tokens
+        return 1
+
+    monkeypatch.setattr(tenant_llm_service, "RedisDistributedLock", FakeLock)
+    monkeypatch.setattr(tenant_llm_service, "start_usage_flusher", lambda: None)
+    monkeypatch.setattr(tenant_llm_service.TenantService, "get_by_id", get_tenant)
+    monkeypatch.setattr(TenantLLMService, "has_model", lambda tenant_id, llm_name, llm_factory: True)
+    monkeypatch.setattr(TenantLLMService, "add_used_tokens", add_used_tokens)
+    return SimpleNamespace(applied=applied, fail=fail)
+
+
+class TestUsageFlush:
+    @pytest.mark.p1
+    def test_staged_usage_is_flushed(self, usage, redis):
+        for tokens in (10, 20, 30):
+            assert TenantLLMService.increase_usage("tenant", "chat", tokens)
+        assert TenantLLMService.increase_usage("tenant", "embedding", 5)
+        assert TenantLLMService.increase_usage("tenant", "chat", 0)
+        assert usage.applied == {}
+
+        assert TenantLLMService.flush_usage() == 2
+        assert usage.applied == {"chat-model": 60, "embedding-model": 5}
+        assert not redis.exist(LLM_USAGE_KEY) and not redis.exist(LLM_USAGE_FLUSHING_KEY)
+        assert TenantLLMService.flush_usage() == 0
+
+    @pytest.mark.p1
+    def test_failed_update_stays_staged(self, usage, redis):
+        TenantLLMService.increase_usage("tenant", "chat", 10)
+        TenantLLMService.increase_usage("tenant", "embedding", 5)
+        usage.fail.add("chat-model")
+        TenantLLMService.flush_usage()
+        assert usage.applied == {"embedding-model": 5}
+
+        # Usage staged meanwhile waits until the failed field is applied.
+        TenantLLMService.increase_usage("tenant", "chat", 7)
+        usage.fail.clear()
+        TenantLLMService.flush_usage()
+        assert usage.applied == {"chat-model": 10, "embedding-model": 5}
+        TenantLLMService.flush_usage()
+        assert usage.applied == {"chat-model": 17, "embedding-model": 5}
+        assert not redis.exist(LLM_USAGE_KEY) and not redis.exist(LLM_USAGE_FLUSHING_KEY)
+
+    @pytest.mark.p2
+    def test_usage_is_not_lost_when_unstaging_fails(self, usage, redis, monkeypatch):
+        TenantLLMService.increase_usage("tenant", "chat", 10)
+        hincrby = redis.hincrby
+        monkeypatch.setattr(redis, "hincrby", lambda key, field, amount=1: None if key == LLM_USAGE_FLUSHING_KEY else hincrby(key, field, amount))
+        TenantLLMService.flush_usage()
+        monkeypatch.setattr(redis, "hincrby", hincrby)
+        # The field is applied again rather than dropped.
+        TenantLLMService.flush_usage()
+        assert usage.applied == {"chat-model": 20}
+        assert not redis.exist(LLM_USAGE_FLUSHING_KEY)
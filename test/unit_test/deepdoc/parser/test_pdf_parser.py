@@ -0,0 +1,132 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import pickle
+
+import numpy as np
+import pdfplumber
+import pytest
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from deepdoc.parser import pdf_parser
+
+PAGES = 7
+
+
+def write_pdf(path, pages=PAGES, figure_pages=()):
+    c = canvas.Canvas(str(path), pagesize=A4)
+    for p in range(pages):
+        c.setFont("Helvetica", 11)
+        for line in range(30):
+            c.drawString(60, 780 - line * 22, f"Page {p + 1} line {line + 1}: the quick brown fox jumps over the lazy dog.")
+        if p in figure_pages:
+            c.rect(60, 100, 400, 300, fill=1)
+        c.showPage()
+    c.save()
+    return str(path)
+
+
+@pytest.fixture(scope="module")
+def pdf_path(tmp_path_factory):
+    return write_pdf(tmp_path_factory.mktemp("pdf") / "doc.pdf")
+
+
+class TestPdfRendering:
+    @pytest.mark.p1
+    def test_rendered_pages_match_in_process_rendering(self, pdf_path):
+        with pdfplumber.open(pdf_path) as pdf:
+            expected = [p.to_image(resolution=72 * 3, antialias=True).annotated for p in pdf.pages[2:5]]
+        rendered = pdf_parser._render_pages(pdf_path, 2, 5, 3)
+        assert len(rendered) == 3
+        for img, exp in zip(rendered, expected):
+            assert np.array_equal(np.asarray(img), np.asarray(exp))
+
+    @pytest.mark.p1
+    def test_extracted_chars_cross_processes(self, pdf_path):
+        chars = pdf_parser._extract_page_chars(pdf_path, 0, PAGES)
+        assert len(chars) == PAGES
+        assert pickle.loads(pickle.dumps(chars)) == chars
+        with pdfplumber.open(pdf_path) as pdf:
+            for page, page_chars in zip(pdf.pages, chars):
+                assert "".join(c["text"] for c in page_chars) == "".join(c["text"] for c in page.dedupe_chars().chars)
+
+    @pytest.mark.p1
+    def test_render_pool_keeps_page_order(self, pdf_path):
+        pool = pdf_parser._get_render_pool()
+        assert pool is pdf_parser._get_render_pool()
+        groups = [(s, min(s + 2, PAGES)) for s in range(0, PAGES, 2)]
+        futs = [pool.submit(pdf_parser._render_pages, pdf_path, s, e, 1) for s, e in groups]
+        images = [img for fut in futs for img in fut.result()]
+        assert len(images) == PAGES
+        for img, exp in zip(images, pdf_parser._render_pages(pdf_path, 0, PAGES, 1)):
+            assert np.array_equal(np.asarray(img), np.asarray(exp))
+
+    @pytest.mark.p2
+    def test_images_streamed_from_workers_match_in_process(self, pdf_path, monkeypatch):
+        parser = pdf_parser.RAGFlowPdfParser()
+        parser.__images__(pdf_path, 1, 0, PAGES)
+        streamed = ([np.asarray(img) for img in parser.page_images], parser.page_chars, parser.boxes)
+
+        monkeypatch.setattr(pdf_parser, "PDF_RENDER_WORKERS", 0)
+        parser.__images__(pdf_path, 1, 0, PAGES)
+        assert len(streamed[0]) == len(parser.page_images) == PAGES
+        for img, exp in zip(streamed[0], parser.page_images):
+            assert np.array_equal(img, np.asarray(exp))
+        assert [[c["text"] for c in chars] for chars in streamed[1]] == [[c["text"] for c in chars] for chars in parser.page_chars]
+        assert [[b["text"] for b in bxs] for bxs in streamed[2]] == [[b["text"] for b in bxs] for bxs in parser.boxes]
+
+
+def page_image_and_chars(path, page, zoomin=3):
+    img = pdf_parser._render_pages(path, page, page + 1, zoomin)[0]
+    return img, pdf_parser._extract_page_chars(path, page, page + 1)[0]
+
+
+class TestTextLayer:
+    @pytest.mark.p1
+    def test_clean_page_is_covered_by_its_chars(self, pdf_path):
+        img, chars = page_image_and_chars(pdf_path, 0)
+        garbled, coverage = pdf_parser.RAGFlowPdfParser._text_layer_quality(img, chars, 3)
+        assert garbled == 0
+        assert coverage >= pdf_parser.PDF_TEXT_LAYER_MIN_COVERAGE
+
+    @pytest.mark.p1
+    def test_figure_lowers_coverage(self, tmp_path):
+        path = write_pdf(tmp_path / "figure.pdf", pages=1, figure_pages=(0,))
+        img, chars = page_image_and_chars(path, 0)
+        _, coverage = pdf_parser.RAGFlowPdfParser._text_layer_quality(img, chars, 3)
+        assert coverage < pdf_parser.PDF_TEXT_LAYER_MIN_COVERAGE
+
+    @pytest.mark.p2
+    def test_garbled_chars_are_counted(self, pdf_path):
+        img, chars = page_image_and_chars(pdf_path, 0)
+        for c in chars[::10]:
+            c["text"] = "(cid:12)"
+        garbled, _ = pdf_parser.RAGFlowPdfParser._text_layer_quality(img, chars, 3)
+        assert garbled == pytest.approx(len(chars[::10]) / len(chars))
+        assert pdf_parser.RAGFlowPdfParser._text_layer_quality(img, [], 3) == (1., 0.)
+
+    @pytest.mark.p2
+    def test_born_digital_pages_skip_ocr(self, tmp_path, monkeypatch):
+        path = write_pdf(tmp_path / "mixed.pdf", pages=3, figure_pages=(1,))
+        parser = pdf_parser.RAGFlowPdfParser()
+        parser.__images__(path, 3, 0, 3)
+        assert parser.page_paths == {"text_layer": 2, "ocr": 1}
+        texts = " ".join(b["text"] for b in parser.boxes[0])
+        assert "Page 1 line 1" in texts
+
+        monkeypatch.setattr(pdf_parser, "PDF_TEXT_LAYER_FAST_PATH", False)
+        parser.__images__(path, 3, 0, 3)
+        assert parser.page_paths == {"text_layer": 0, "ocr": 3}
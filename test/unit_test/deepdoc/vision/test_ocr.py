@@ -0,0 +1,161 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import onnxruntime as ort
+import pytest
+
+from deepdoc.vision import ocr
+
+
+class FakeDetSession:
+    """Marks dark pixels of the normalized input as text, like a detection model would."""
+
+    def __init__(self, batch_dim="N"):
+        self.inputs = [SimpleNamespace(name="x", shape=[batch_dim, 3, "H", "W"])]
+        self.runs = []
+
+    def get_inputs(self):
+        return self.inputs
+
+    def run(self, output_names, feed, run_options=None):
+        x = feed["x"]
+        self.runs.append(x.shape)
+        return [(x.mean(axis=1, keepdims=True) < 0).astype(np.float32)]
+
+
+def make_page(rng, h, w):
+    img = np.full((h, w, 3), 255, dtype=np.uint8)
+    for _ in range(rng.integers(3, 12)):
+        top, left = rng.integers(0, h - 30), rng.integers(0, w - 120)
+        img[top: top + rng.integers(8, 25), left: left + rng.integers(30, 110)] = 0
+    return img
+
+
+@pytest.fixture
+def detector(monkeypatch):
+    def make(batch_dim="N"):
+        sess = FakeDetSession(batch_dim)
+        monkeypatch.setattr(ocr, "load_model", lambda model_dir, nm, device_id=None: (sess, None))
+        return ocr.TextDetector("unused"), sess
+    return make
+
+
+class TestTextDetectorBatch:
+    @pytest.mark.p1
+    def test_batch_matches_per_image_detection(self, detector):
+        det, sess = detector()
+        rng = np.random.default_rng(0)
+        pages = [make_page(rng, 600, 400) for _ in range(5)] + [make_page(rng, 320, 500)] + [make_page(rng, 600, 400)]
+        expected = [det(page)[0] for page in pages]
+        sess.runs.clear()
+
+        got = det.batch(pages)
+        assert len(got) == len(pages)
+        for (boxes, _), exp in zip(got, expected):
+            assert len(exp) > 0
+            np.testing.assert_array_equal(boxes, exp)
+        assert len(sess.runs) == 2
+        assert sorted(shape[0] for shape in sess.runs) == [1, 6]
+
+    @pytest.mark.p2
+    def test_fixed_batch_dimension_runs_per_image(self, detector):
+        det, sess = detector(batch_dim=1)
+        rng = np.random.default_rng(1)
+        pages = [make_page(rng, 600, 400) for _ in range(3)]
+        got = det.batch(pages)
+        assert len(sess.runs) == 3
+        for (boxes, _), page in zip(got, pages):
+            np.testing.assert_array_equal(boxes, det(page)[0])
+
+    @pytest.mark.p2
+    def test_detect_batch_sorts_boxes_like_detect(self, detector):
+        det, _ = detector()
+        engine = ocr.OCR.__new__(ocr.OCR)
+        engine.text_detector = [det]
+        rng = np.random.default_rng(2)
+        pages = [make_page(rng, 600, 400) for _ in range(3)]
+        for got, page in zip(engine.detect_batch(pages), pages):
+            assert [box.tolist() for box, _ in got] == [box.tolist() for box, _ in engine.detect(page)]
+
+
+class FakeInferenceSession:
+    created = []
+
+    def __init__(self, path, options=None, providers=None, provider_options=None):
+        time.sleep(0.05)
+        self.path = path
+        self.options = options
+        FakeInferenceSession.created.append(self)
+
+
+@pytest.fixture
+def model_dir(tmp_path, monkeypatch):
+    for nm in ("det", "rec"):
+        (tmp_path / f"{nm}.onnx").write_bytes(b"fp32")
+    (tmp_path / "det.int8.onnx").write_bytes(b"int8")
+    FakeInferenceSession.created = []
+    monkeypatch.setattr(ocr.ort, "InferenceSession", FakeInferenceSession)
+    monkeypatch.setattr(ocr, "loaded_models", {})
+    return str(tmp_path)
+
+
+class TestModelPool:
+    @pytest.mark.p1
+    def test_model_file_falls_back_to_fp32(self, model_dir):
+        assert ocr.model_file(model_dir, "det", "int8") == os.path.join(model_dir, "det.int8.onnx")
+        assert ocr.model_file(model_dir, "rec", "int8") == os.path.join(model_dir, "rec.onnx")
+        assert ocr.model_file(model_dir, "det", "fp32") == os.path.join(model_dir, "det.onnx")
+
+    @pytest.mark.p1
+    def test_sessions_are_shared_per_model_and_device(self, model_dir):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(ocr.load_model(model_dir, "det"))) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert len(FakeInferenceSession.created) == 1
+        assert all(sess is results[0][0] for sess, _ in results)
+
+        assert ocr.load_model(model_dir, "rec")[0] is not results[0][0]
+        assert ocr.load_model(model_dir, "det", device_id=1)[0] is not results[0][0]
+        assert ocr.load_model(model_dir, "det", precision="int8")[0].path.endswith("det.int8.onnx")
+        assert len(FakeInferenceSession.created) == 4
+
+    @pytest.mark.p1
+    def test_session_threads_come_from_the_budget(self, model_dir):
+        sess, _ = ocr.load_model(model_dir, "det")
+        assert sess.options.intra_op_num_threads == ocr.ONNX_INTRA_OP_THREADS
+        assert sess.options.inter_op_num_threads == ocr.ONNX_INTER_OP_THREADS
+
+    @pytest.mark.p2
+    def test_optimized_model_is_serialized_then_reused(self, model_dir, tmp_path, monkeypatch):
+        opt_dir = tmp_path / "optimized"
+        monkeypatch.setattr(ocr, "ONNX_OPTIMIZED_MODEL_DIR", str(opt_dir))
+        sess, _ = ocr._load_model(os.path.join(model_dir, "det.onnx"))
+        opt_path = str(opt_dir / "det.cpu.opt.onnx")
+        assert sess.options.optimized_model_filepath == opt_path
+        assert sess.options.graph_optimization_level == ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        (opt_dir / "det.cpu.opt.onnx").write_bytes(b"optimized")
+        sess, _ = ocr._load_model(os.path.join(model_dir, "det.onnx"))
+        assert sess.path == opt_path
+        assert sess.options.graph_optimization_level == ort.GraphOptimizationLevel.ORT_DISABLE_ALL
@@ -0,0 +1,182 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+"""
+In-memory stand-ins for the doc store and Redis, covering the calls the services under test make.
+"""
+import copy
+import threading
+
+from rag.utils.doc_store_conn import DocStoreConnection
+
+
+class FakeDocStore(DocStoreConnection):
+    def __init__(self):
+        self.rows = {}
+        self.searches = []
+
+    def dbType(self) -> str:
+        return "fake"
+
+    def health(self) -> dict:
+        return {"type": "fake", "status": "green"}
+
+    def createIdx(self, indexName: str, knowledgebaseId: str, vectorSize: int):
+        return True
+
+    def deleteIdx(self, indexName: str, knowledgebaseId: str):
+        self.rows = {k: d for k, d in self.rows.items() if d.get("kb_id") != knowledgebaseId}
+
+    def indexExist(self, indexName: str, knowledgebaseId: str) -> bool:
+        return True
+
+    @staticmethod
+    def _match(d, condition):
+        for k, v in condition.items():
+            if k == "must_not":
+                if "exists" in v and d.get(v["exists"]) not in (None, "", []):
+                    return False
+                continue
+            if k == "exists":
+                if d.get(v) in (None, "", []):
+                    return False
+                continue
+            vs = v if isinstance(v, list) else [v]
+            dv = d.get(k)
+            dvs = dv if isinstance(dv, list) else [dv]
+            if not set(map(str, vs)) & set(map(str, dvs)):
+                return False
+        return True
+
+    def search(self, selectFields, highlightFields, condition, matchExprs, orderBy, offset, limit, indexNames,
+               knowledgebaseIds, aggFields=[], rank_feature=None):
+        self.searches.append({"condition": copy.deepcopy(condition), "offset": offset, "limit": limit})
+        rows = [d for d in self.rows.values() if d.get("kb_id") in knowledgebaseIds and self._match(d, condition)]
+        for fld, desc in reversed(orderBy.fields if orderBy else []):
+            rows.sort(key=lambda d: (d.get(fld) is None, d.get(fld)), reverse=bool(desc))
+        return [copy.deepcopy(d) for d in rows[offset: offset + limit]]
+
+    def get(self, chunkId: str, indexName: str, knowledgebaseIds: list[str]) -> dict | None:
+        d = self.rows.get(chunkId)
+        return copy.deepcopy(d) if d and d.get("kb_id") in knowledgebaseIds else None
+
+    def insert(self, rows: list[dict], indexName: str, knowledgebaseId: str = None) -> list[str]:
+        for d in rows:
+            d = copy.deepcopy(d)
+            d["kb_id"] = knowledgebaseId
+            self.rows[d["id"]] = d
+        return []
+
+    def update(self, condition: dict, newValue: dict, indexName: str, knowledgebaseId: str) -> bool:
+        for d in self.rows.values():
+            if d.get("kb_id") == knowledgebaseId and self._match(d, condition):
+                d.update(copy.deepcopy(newValue))
+        return True
+
+    def delete(self, condition: dict, indexName: str, knowledgebaseId: str) -> int:
+        ids = [k for k, d in self.rows.items() if d.get("kb_id") == knowledgebaseId and self._match(d, condition)]
+        for k in ids:
+            del self.rows[k]
+        return len(ids)
+
+    def getTotal(self, res):
+        return len(res)
+
+    def getChunkIds(self, res):
+        return [d["id"] for d in res]
+
+    def getFields(self, res, fields: list[str]) -> dict[str, dict]:
+        return {d["id"]: {f: d[f] for f in fields if f in d} for d in res}
+
+    def getHighlight(self, res, keywords: list[str], fieldnm: str):
+        return {}
+
+    def getAggregation(self, res, fieldnm: str):
+        return []
+
+    def sql(sql: str, fetch_size: int, format: str):
+        raise NotImplementedError
+
+
+class FakeRedis:
+    """Same interface as `rag.utils.redis_conn.RedisDB` for the strings, counters and hashes used here."""
+
+    def __init__(self):
+        self.data = {}
+        self.ttls = {}
+        self._lock = threading.Lock()
+
+    def is_alive(self):
+        return True
+
+    def exist(self, k):
+        return k in self.data
+
+    def get(self, k):
+        return self.data.get(k)
+
+    def set(self, k, v, exp=3600):
+        self.data[k] = v
+        self.ttls[k] = exp
+        return True
+
+    def set_obj(self, k, obj, exp=3600):
+        import json
+        return self.set(k, json.dumps(obj, ensure_ascii=False), exp)
+
+    def mget(self, keys):
+        return [self.data.get(k) for k in keys]
+
+    def set_many(self, mapping, exp=3600):
+        self.data.update(mapping)
+        self.ttls.update(dict.fromkeys(mapping, exp))
+        return True
+
+    def delete(self, key):
+        return self.data.pop(key, None) is not None
+
+    def incr(self, key, amount=1):
+        with self._lock:
+            self.data[key] = int(self.data.get(key) or 0) + amount
+            return self.data[key]
+
+    def hincrby(self, key, field, amount=1):
+        with self._lock:
+            h = self.data.setdefault(key, {})
+            h[field] = int(h.get(field) or 0) + amount
+            return h[field]
+
+    def hget(self, key, field):
+        v = self.data.get(key, {}).get(field)
+        return None if v is None else str(v)
+
+    def hgetall(self, key):
+        return {k: str(v) for k, v in self.data.get(key, {}).items()}
+
+    def hdel(self, key, field):
+        with self._lock:
+            h = self.data.get(key, {})
+            h.pop(field, None)
+            if not h:
+                # Redis drops a hash with its last field.
+                self.data.pop(key, None)
+        return True
+
+    def rename(self, key, new_key):
+        with self._lock:
+            if key not in self.data:
+                return False
+            self.data[new_key] = self.data.pop(key)
+        return True
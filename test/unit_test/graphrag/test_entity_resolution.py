@@ -0,0 +1,94 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import itertools
+import random
+import string
+
+import pytest
+
+from graphrag.entity_resolution import EntityResolution, _similar_pairs, block_pairs
+
+CJK = "中国人民银行北京大学上海交通华为技术有限公司阿里巴巴集团腾讯控股研究院深圳市政府数据科学"
+
+
+def mutate(rng, name, alphabet):
+    chars = list(name)
+    for _ in range(rng.randint(0, 3)):
+        op = rng.random()
+        pos = rng.randrange(len(chars) + 1)
+        if op < 0.4:
+            chars.insert(pos, rng.choice(alphabet))
+        elif op < 0.7 and len(chars) > 1:
+            chars.pop(min(pos, len(chars) - 1))
+        elif chars:
+            chars[min(pos, len(chars) - 1)] = rng.choice(alphabet)
+    return "".join(chars)
+
+
+def random_names(rng, n):
+    names = set()
+    while len(names) < n:
+        kind = rng.random()
+        if kind < 0.4:
+            base = "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 12)))
+            if rng.random() < 0.3:
+                base += " " + "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 8)))
+            alphabet = string.ascii_lowercase
+        elif kind < 0.9:
+            base = "".join(rng.choice(CJK) for _ in range(rng.randint(1, 8)))
+            alphabet = CJK
+        else:
+            base = rng.choice(["v", "型号", "gpt-", "第"]) + str(rng.randint(0, 30))
+            alphabet = string.digits
+        names.add(base)
+        for _ in range(rng.randint(0, 3)):
+            variant = mutate(rng, base, alphabet)
+            if variant:
+                names.add(variant)
+    return list(names)[:n]
+
+
+def scan_pairs(names, subgraph_nodes):
+    return [(a, b) for a, b in itertools.combinations(names, 2)
+            if (a in subgraph_nodes or b in subgraph_nodes) and EntityResolution.is_similarity(a, b)]
+
+
+class TestBlockPairs:
+    @pytest.mark.p1
+    @pytest.mark.parametrize("seed", range(20))
+    def test_matches_full_scan(self, seed):
+        rng = random.Random(seed)
+        names = random_names(rng, rng.randint(20, 300))
+        subgraph_nodes = set(rng.sample(names, rng.randint(1, len(names))))
+        candidates = block_pairs(names, subgraph_nodes)
+        assert len(candidates) == len(set(candidates))
+        assert _similar_pairs(candidates) == scan_pairs(names, subgraph_nodes)
+
+    @pytest.mark.p2
+    def test_only_pairs_touching_the_subgraph(self):
+        rng = random.Random(99)
+        names = random_names(rng, 200)
+        subgraph_nodes = set(names[:5])
+        for a, b in block_pairs(names, subgraph_nodes):
+            assert a in subgraph_nodes or b in subgraph_nodes
+            assert names.index(a) < names.index(b)
+
+    @pytest.mark.p2
+    def test_edge_cases(self):
+        assert block_pairs([], set()) == []
+        assert block_pairs(["a", "b"], {"a"}) == scan_pairs(["a", "b"], {"a"})
+        names = ["abc", "abd", "中国", "中国人", "国中", "x1", "x2"]
+        assert _similar_pairs(block_pairs(names, set(names))) == scan_pairs(names, set(names))
@@ -0,0 +1,95 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import threading
+
+import numpy as np
+import pytest
+import trio
+
+from graphrag import utils
+from graphrag.utils import embed_graph_chunks, set_embed_cache_batch
+from rag.utils.embedding_scheduler import EMBEDDING_MAX_BATCH_SIZE
+
+DIM = 8
+
+
+def text_vector(text):
+    rng = np.random.default_rng(abs(hash(text)) % (2 ** 32))
+    return rng.random(DIM).astype(np.float32)
+
+
+class RecordingEmbedding:
+    max_length = 512
+
+    def __init__(self, llm_name):
+        self.llm_name = llm_name
+        self.batches = []
+        self._lock = threading.Lock()
+
+    def encode(self, texts):
+        with self._lock:
+            self.batches.append(list(texts))
+        return np.stack([text_vector(t) for t in texts]), sum(len(t) for t in texts)
+
+
+def graph_chunks(n):
+    keys = [f"entity {i}" for i in range(n)]
+    texts = [f"entity {i}: description {i}" for i in range(n)]
+    return [{"id": k} for k in keys], keys, texts
+
+
+@pytest.fixture(autouse=True)
+def embed_cache(monkeypatch, redis):
+    monkeypatch.setattr(utils, "REDIS_CONN", redis)
+    return redis
+
+
+class TestEmbedGraphChunks:
+    @pytest.mark.p1
+    def test_batched_vectors_follow_chunks(self):
+        mdl = RecordingEmbedding("graph-embedding-batches")
+        chunks, keys, texts = graph_chunks(500)
+        trio.run(embed_graph_chunks, mdl, chunks, keys, texts)
+
+        for chunk, text in zip(chunks, texts):
+            assert np.allclose(chunk[f"q_{DIM}_vec"], text_vector(text))
+        assert sorted(t for b in mdl.batches for t in b) == sorted(texts)
+        assert max(len(b) for b in mdl.batches) <= EMBEDDING_MAX_BATCH_SIZE
+        # One request per batch, not one per entity.
+        assert len(mdl.batches) * 4 <= len(texts)
+
+    @pytest.mark.p1
+    def test_only_cache_misses_are_encoded(self):
+        mdl = RecordingEmbedding("graph-embedding-cache")
+        chunks, keys, texts = graph_chunks(100)
+        set_embed_cache_batch(mdl.llm_name, keys[:60], [text_vector(t) for t in texts[:60]])
+        trio.run(embed_graph_chunks, mdl, chunks, keys, texts)
+        assert sorted(t for b in mdl.batches for t in b) == sorted(texts[60:])
+        for chunk, text in zip(chunks, texts):
+            assert np.allclose(chunk[f"q_{DIM}_vec"], text_vector(text))
+
+        # The misses were cached under their keys, so a second pass encodes nothing.
+        mdl.batches.clear()
+        chunks, keys, texts = graph_chunks(100)
+        trio.run(embed_graph_chunks, mdl, chunks, keys, texts)
+        assert mdl.batches == []
+        assert all(np.allclose(chunk[f"q_{DIM}_vec"], text_vector(text)) for chunk, text in zip(chunks, texts))
+
+    @pytest.mark.p2
+    def test_no_chunks(self):
+        mdl = RecordingEmbedding("graph-embedding-empty")
+        trio.run(embed_graph_chunks, mdl, [], [], [])
+        assert mdl.batches == []
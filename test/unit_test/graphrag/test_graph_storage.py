@@ -0,0 +1,146 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import json
+import random
+
+import networkx as nx
+import numpy as np
+import pytest
+import trio
+
+from api import settings
+from fakes import FakeDocStore
+from graphrag import utils
+from graphrag.general.index import merge_subgraph
+from graphrag.utils import GraphChange, get_graph, rebuild_graph, set_graph
+from rag.nlp.search import Dealer
+
+PARTITIONS = 8
+NAMES = [f"entity {i}" for i in range(60)]
+
+
+class FakeEmbedding:
+    llm_name = "fake-graph-embedding"
+    max_length = 512
+
+    def encode(self, texts):
+        return np.ones((len(texts), 4), dtype=np.float32), len(texts)
+
+
+def callback(*args, **kwargs):
+    pass
+
+
+def make_subgraph(seed, doc_id, n_nodes=20, n_edges=30):
+    rng = random.Random(seed)
+    names = rng.sample(NAMES, n_nodes)
+    g = nx.Graph()
+    for n in names:
+        g.add_node(n, entity_name=n, entity_type="thing", description=f"{n} in {doc_id}", source_id=[doc_id])
+    for _ in range(n_edges):
+        f, t = rng.sample(names, 2)
+        g.add_edge(f, t, src_id=f, tgt_id=t, description=f"{f} and {t} in {doc_id}", keywords=[doc_id], weight=rng.randint(1, 5), source_id=[doc_id])
+    g.graph["source_id"] = [doc_id]
+    return g
+
+
+def use_store(monkeypatch, store):
+    monkeypatch.setattr(settings, "docStoreConn", store)
+    monkeypatch.setattr(settings, "retrievaler", Dealer(store))
+
+
+def without_pagerank(attrs):
+    return {k: v for k, v in attrs.items() if k != "pagerank"}
+
+
+def assert_same_graph(g1, g2):
+    assert {n: without_pagerank(a) for n, a in g1.nodes(data=True)} == {n: without_pagerank(a) for n, a in g2.nodes(data=True)}
+    assert {frozenset((f, t)): a for f, t, a in g1.edges(data=True)} == {frozenset((f, t)): a for f, t, a in g2.edges(data=True)}
+    assert sorted(g1.graph["source_id"]) == sorted(g2.graph["source_id"])
+
+
+@pytest.fixture(autouse=True)
+def graph_env(monkeypatch, redis):
+    monkeypatch.setattr(utils, "GRAPH_PARTITIONS", PARTITIONS)
+    monkeypatch.setattr(utils, "REDIS_CONN", redis)
+
+
+class TestGraphStorage:
+    @pytest.mark.p1
+    def test_round_trip(self, monkeypatch, doc_store):
+        use_store(monkeypatch, doc_store)
+        graph = make_subgraph(0, "doc1")
+        change = GraphChange(added_updated_nodes=set(graph.nodes), added_updated_edges=set(graph.edges))
+        trio.run(set_graph, "tenant", "kb", FakeEmbedding(), graph, change, callback)
+
+        parts = [d for d in doc_store.rows.values() if d["knowledge_graph_kwd"] == "graph_part"]
+        assert 1 < len(parts) <= PARTITIONS
+        doc_store.searches.clear()
+        loaded = trio.run(get_graph, "tenant", "kb")
+        assert_same_graph(loaded, graph)
+        # All partition rows come back in one request sized to the partition count.
+        part_searches = [s for s in doc_store.searches if s["condition"].get("knowledge_graph_kwd") == ["graph_part"]]
+        assert [(s["offset"], s["limit"]) for s in part_searches] == [(0, PARTITIONS)]
+
+    @pytest.mark.p1
+    def test_partial_load(self, monkeypatch, doc_store):
+        use_store(monkeypatch, doc_store)
+        graph = make_subgraph(1, "doc1")
+        change = GraphChange(added_updated_nodes=set(graph.nodes), added_updated_edges=set(graph.edges))
+        trio.run(set_graph, "tenant", "kb", FakeEmbedding(), graph, change, callback)
+
+        nodes = sorted(graph.nodes)[:5]
+        doc_store.searches.clear()
+        loaded = trio.run(get_graph, "tenant", "kb", None, nodes)
+        assert_same_graph(loaded, graph.subgraph(nodes))
+        assert not [s for s in doc_store.searches if s["condition"].get("knowledge_graph_kwd") == ["graph_part"]]
+        assert loaded.graph["partial"]["nodes"] == graph.number_of_nodes()
+
+    @pytest.mark.p1
+    def test_partial_merge_matches_full_merge(self, monkeypatch):
+        full_store, partial_store = FakeDocStore(), FakeDocStore()
+        docs = [make_subgraph(seed, f"doc{seed}") for seed in range(2, 6)]
+        for store, full_graph in ((full_store, True), (partial_store, False)):
+            use_store(monkeypatch, store)
+            for doc in docs:
+                trio.run(merge_subgraph, "tenant", "kb", doc.graph["source_id"][0], doc.copy(), FakeEmbedding(), callback, full_graph)
+
+        use_store(monkeypatch, full_store)
+        expected = trio.run(get_graph, "tenant", "kb")
+        use_store(monkeypatch, partial_store)
+        merged = trio.run(get_graph, "tenant", "kb")
+        assert_same_graph(merged, expected)
+        assert sorted(d["id"] for d in partial_store.rows.values() if d["knowledge_graph_kwd"] in ("entity", "relation")) == sorted(
+            d["id"] for d in full_store.rows.values() if d["knowledge_graph_kwd"] in ("entity", "relation")
+        )
+        manifest = [d for d in partial_store.rows.values() if d["knowledge_graph_kwd"] == "graph"]
+        assert len(manifest) == 1
+        assert json.loads(manifest[0]["content_with_weight"])["graph"]["nodes"] == expected.number_of_nodes()
+        # Each document's subgraph is still stored, so removing one can rebuild the rest.
+        assert set(trio.run(rebuild_graph, "tenant", "kb").nodes) == set(expected.nodes)
+
+    @pytest.mark.p2
+    def test_partial_graph_refuses_removals(self, monkeypatch, doc_store):
+        use_store(monkeypatch, doc_store)
+        graph = make_subgraph(6, "doc1")
+        change = GraphChange(added_updated_nodes=set(graph.nodes), added_updated_edges=set(graph.edges))
+        trio.run(set_graph, "tenant", "kb", FakeEmbedding(), graph, change, callback)
+
+        node = sorted(graph.nodes)[0]
+        loaded = trio.run(get_graph, "tenant", "kb", None, [node])
+        loaded.remove_node(node)
+        with pytest.raises(ValueError):
+            trio.run(set_graph, "tenant", "kb", FakeEmbedding(), loaded, GraphChange(removed_nodes={node}), callback)
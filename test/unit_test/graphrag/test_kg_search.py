@@ -0,0 +1,110 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import json
+import threading
+
+import pytest
+
+from api import settings
+from graphrag import search as kg_search
+from graphrag.search import KGSearch, cached_kb_lookup, run_concurrently
+from graphrag.utils import get_relations
+from rag.nlp.search import Dealer
+from rag.utils import retrieval_cache
+from rag.utils.retrieval_cache import bump_kb_generation
+
+
+def entity(name, entity_type, rank):
+    return {"id": f"ent-{name}", "kb_id": "kb", "knowledge_graph_kwd": "entity", "entity_kwd": name, "entity_type_kwd": entity_type,
+            "rank_flt": rank, "content_with_weight": json.dumps({"description": name})}
+
+
+def relation(f, t):
+    return {"id": f"rel-{f}-{t}", "kb_id": "kb", "knowledge_graph_kwd": "relation", "from_entity_kwd": f, "to_entity_kwd": t,
+            "content_with_weight": json.dumps({"description": f"{f} -> {t}"})}
+
+
+@pytest.fixture(autouse=True)
+def generations(monkeypatch, redis):
+    monkeypatch.setattr(retrieval_cache, "REDIS_CONN", redis)
+    monkeypatch.setattr(retrieval_cache, "RETRIEVAL_CACHE_REFRESH_DELAY", 0)
+    kg_search._KB_LOOKUP_CACHE.clear()
+
+
+class TestKbLookupCache:
+    @pytest.mark.p1
+    def test_cached_until_generation_bump(self):
+        calls = []
+
+        def lookup(x):
+            calls.append(x)
+            return {"x": x, "n": len(calls)}
+
+        assert cached_kb_lookup("lookup", ["kb2", "kb1"], lookup, 1) == {"x": 1, "n": 1}
+        assert cached_kb_lookup("lookup", ["kb1", "kb2"], lookup, 1) == {"x": 1, "n": 1}
+        assert cached_kb_lookup("lookup", ["kb1", "kb2"], lookup, 2) == {"x": 2, "n": 2}
+        bump_kb_generation("kb1")
+        assert cached_kb_lookup("lookup", ["kb1", "kb2"], lookup, 1) == {"x": 1, "n": 3}
+
+    @pytest.mark.p2
+    def test_not_cached_without_generations(self, monkeypatch):
+        monkeypatch.setattr(retrieval_cache.REDIS_CONN, "mget", lambda keys: None)
+        calls = []
+        for _ in range(2):
+            cached_kb_lookup("lookup", ["kb"], lambda: calls.append(1))
+        assert len(calls) == 2
+
+    @pytest.mark.p1
+    def test_entities_by_type_are_cached(self, doc_store):
+        for i, ty in enumerate(["person", "person", "place", "person"]):
+            doc_store.insert([entity(f"e{i}", ty, i)], "idx", "kb")
+        kg = KGSearch(doc_store)
+        filters = kg.get_filters({"kb_ids": ["kb"]})
+
+        ents = kg.get_relevant_ents_by_types(["person"], filters, ["idx"], ["kb"], 10000)
+        assert list(ents) == ["e3", "e1", "e0"]
+        n_searches = len(doc_store.searches)
+        assert kg.get_relevant_ents_by_types(["person"], filters, ["idx"], ["kb"], 10000) == ents
+        assert len(doc_store.searches) == n_searches
+
+        # Rebuilding the graph bumps the generation, so new entities show up.
+        doc_store.insert([entity("e4", "person", 9)], "idx", "kb")
+        bump_kb_generation("kb")
+        assert list(kg.get_relevant_ents_by_types(["person"], filters, ["idx"], ["kb"], 10000)) == ["e4", "e3", "e1", "e0"]
+
+
+class TestConcurrentLookups:
+    @pytest.mark.p1
+    def test_run_concurrently(self):
+        # Each function waits for the others, so this only finishes if they run at the same time.
+        barrier = threading.Barrier(3, timeout=10)
+
+        def wait(i):
+            barrier.wait()
+            return i
+
+        assert run_concurrently(lambda: wait(0), lambda: wait(1), lambda: wait(2)) == [0, 1, 2]
+
+    @pytest.mark.p1
+    def test_get_relations(self, monkeypatch, doc_store):
+        doc_store.insert([relation("a", "b"), relation("c", "b"), relation("a", "d")], "idx", "kb")
+        monkeypatch.setattr(settings, "retrievaler", Dealer(doc_store))
+        pairs = [("a", "b"), ("b", "c"), ("a", "c"), ("d", "a")]
+        res = get_relations(["tenant"], ["kb"], pairs)
+        assert {pair: rel["description"] for pair, rel in res.items()} == {("a", "b"): "a -> b", ("b", "c"): "c -> b", ("d", "a"): "a -> d"}
+        # One search for all the pairs.
+        assert len(doc_store.searches) == 1
+        assert get_relations(["tenant"], ["kb"], []) == {}
@@ -0,0 +1,175 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import pytest
+import trio
+
+from rag.llm import chat_model
+from rag.llm.chat_model import GptTurbo
+
+
+def completion(content, total_tokens=7):
+    message = SimpleNamespace(content=content)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason="stop")], usage=SimpleNamespace(total_tokens=total_tokens))
+
+
+def chunk(content, total_tokens=None):
+    delta = SimpleNamespace(content=content)
+    usage = SimpleNamespace(total_tokens=total_tokens) if total_tokens else None
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta, finish_reason=None)], usage=usage)
+
+
+async def stream_of(chunks):
+    for c in chunks:
+        await trio.lowlevel.checkpoint()
+        yield c
+
+
+class FakeAsyncClient:
+    """Stands in for AsyncOpenAI: records the requests, how many overlap, and whether it was closed."""
+
+    def __init__(self, failures=()):
+        self.requests = []
+        self.failures = list(failures)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.closed = False
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    async def create(self, model, messages, stream=False, **kwargs):
+        self.requests.append(messages)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await trio.sleep(0.01)
+            if self.failures:
+                raise self.failures.pop(0)
+        finally:
+            self.in_flight -= 1
+        if stream:
+            return stream_of([chunk("Hel"), chunk("lo", total_tokens=5)])
+        return completion("hello")
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def model(monkeypatch):
+    monkeypatch.setattr(chat_model, "_ASYNC_CLIENTS", OrderedDict())
+    monkeypatch.setattr(chat_model, "_ASYNC_LIMITERS", OrderedDict())
+    mdl = GptTurbo("sk-test", "gpt-test", "http://127.0.0.1:1/v1", retry_interval=0)
+    mdl.created = []
+
+    def new_async_client():
+        client = FakeAsyncClient()
+        mdl.created.append(client)
+        return client
+
+    mdl._new_async_client = new_async_client
+    return mdl
+
+
+class TestAsyncChat:
+    @pytest.mark.p1
+    def test_async_chat(self, model):
+        history = [{"role": "user", "content": "hi"}]
+        ans = trio.run(model.async_chat, "be brief", history, {"temperature": 0.1})
+        assert ans == ("hello", 7)
+        (client,) = model.created
+        assert client.requests == [[{"role": "system", "content": "be brief"}, {"role": "user", "content": "hi"}]]
+
+    @pytest.mark.p1
+    def test_async_chat_streamly(self, model):
+        async def collect():
+            return [item async for item in model.async_chat_streamly("", [{"role": "user", "content": "hi"}], {})]
+
+        assert trio.run(collect) == ["Hel", "lo", 5 + chat_model.num_tokens_from_string("Hel")]
+
+    @pytest.mark.p1
+    def test_client_reused_within_run_and_closed_at_end(self, model):
+        async def chat_concurrently(n):
+            async with trio.open_nursery() as nursery:
+                for _ in range(n):
+                    nursery.start_soon(model.async_chat, "", [{"role": "user", "content": "hi"}], {})
+            # Still open while the run is going.
+            assert not model.created[-1].closed
+
+        trio.run(chat_concurrently, 4)
+        (client,) = model.created
+        assert len(client.requests) == 4
+        assert client.closed
+
+        # The next run gets its own client.
+        trio.run(chat_concurrently, 1)
+        assert len(model.created) == 2
+        assert model.created[1].closed
+
+    @pytest.mark.p2
+    def test_concurrency_capped_per_endpoint(self, model, monkeypatch):
+        monkeypatch.setattr(chat_model, "LLM_ASYNC_CONCURRENCY", 2)
+
+        async def chat_concurrently():
+            async with trio.open_nursery() as nursery:
+                for _ in range(6):
+                    nursery.start_soon(model.async_chat, "", [{"role": "user", "content": "hi"}], {})
+
+        trio.run(chat_concurrently)
+        (client,) = model.created
+        assert len(client.requests) == 6
+        assert client.max_in_flight == 2
+
+    @pytest.mark.p2
+    def test_retries_server_errors(self, model, monkeypatch):
+        client = FakeAsyncClient(failures=[RuntimeError("503 server unavailable")])
+        model._new_async_client = lambda: client
+        monkeypatch.setattr(model, "_get_delay", lambda: 0)
+
+        assert trio.run(model.async_chat, "", [{"role": "user", "content": "hi"}], {}) == ("hello", 7)
+        assert len(client.requests) == 2
+
+    @pytest.mark.p2
+    def test_gives_up_on_other_errors(self, model):
+        client = FakeAsyncClient(failures=[RuntimeError("401 invalid api key")])
+        model._new_async_client = lambda: client
+
+        ans, tokens = trio.run(model.async_chat, "", [{"role": "user", "content": "hi"}], {})
+        assert ans.startswith(chat_model.ERROR_PREFIX)
+        assert tokens == 0
+        assert len(client.requests) == 1
+
+    @pytest.mark.p2
+    def test_overridden_chat_runs_in_thread(self, model):
+        class CustomChat(GptTurbo):
+            def chat(self, system, history, gen_conf={}, **kwargs):
+                return "from thread", 3
+
+            def chat_streamly(self, system, history, gen_conf={}, **kwargs):
+                yield "from "
+                yield "thread"
+                yield 3
+
+        model.__class__ = CustomChat
+
+        async def run():
+            ans = await model.async_chat("", [{"role": "user", "content": "hi"}], {})
+            items = [item async for item in model.async_chat_streamly("", [{"role": "user", "content": "hi"}], {})]
+            return ans, items
+
+        assert trio.run(run) == (("from thread", 3), ["from ", "thread", 3])
+        assert model.created == []
@@ -0,0 +1,140 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import threading
+
+import numpy as np
+import pytest
+
+from rag.llm.embedding_model import DefaultEmbedding, MicroBatcher, encode_in_batches
+
+DIM = 4
+
+
+def text_vector(text):
+    rng = np.random.default_rng(abs(hash(text)) % (2 ** 32))
+    return rng.random(DIM).astype(np.float32)
+
+
+class RecordingEncoder:
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, texts):
+        with self._lock:
+            self.calls.append(list(texts))
+        if any(t.startswith("bad") for t in texts):
+            raise ValueError("bad input")
+        return np.stack([text_vector(t) for t in texts])
+
+
+def submit_concurrently(batcher, requests):
+    """Submit each list of `requests` from its own thread, all at once; return results or exceptions."""
+    barrier = threading.Barrier(len(requests), timeout=10)
+    results = [None] * len(requests)
+
+    def run(i):
+        barrier.wait()
+        try:
+            results[i] = batcher.submit(requests[i])
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(requests))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+class TestMicroBatcher:
+    @pytest.mark.p1
+    def test_encode_in_batches(self):
+        fn = RecordingEncoder()
+        texts = [f"text {i}" for i in range(37)]
+        res = encode_in_batches(fn, texts, batch_size=16)
+        assert [len(c) for c in fn.calls] == [16, 16, 5]
+        assert res.dtype == np.float32
+        assert np.array_equal(res, np.stack([text_vector(t) for t in texts]))
+
+    @pytest.mark.p1
+    def test_concurrent_calls_share_model_calls(self):
+        fn = RecordingEncoder()
+        batcher = MicroBatcher(fn, batch_size=16, max_batch_size=64, window=0.2)
+        requests = [[f"caller {i} text {j}" for j in range(i % 3 + 1)] for i in range(20)]
+        results = submit_concurrently(batcher, requests)
+        batcher.close()
+
+        for texts, res in zip(requests, results):
+            assert np.array_equal(res, np.stack([text_vector(t) for t in texts]))
+        # 40 texts from 20 callers, fanned out of a few full model calls.
+        assert sorted(t for c in fn.calls for t in c) == sorted(t for texts in requests for t in texts)
+        assert len(fn.calls) < len(requests)
+        assert max(len(c) for c in fn.calls) <= 16
+
+    @pytest.mark.p1
+    def test_bad_input_only_fails_its_caller(self):
+        fn = RecordingEncoder()
+        batcher = MicroBatcher(fn, batch_size=16, max_batch_size=64, window=0.2)
+        requests = [[f"good {i}"] for i in range(5)] + [["bad one"]]
+        results = submit_concurrently(batcher, requests)
+        batcher.close()
+
+        assert isinstance(results[-1], ValueError)
+        for texts, res in zip(requests[:-1], results[:-1]):
+            assert np.array_equal(res, np.stack([text_vector(t) for t in texts]))
+
+    @pytest.mark.p2
+    def test_submit_after_close(self):
+        fn = RecordingEncoder()
+        batcher = MicroBatcher(fn, window=0.01)
+        batcher.close()
+        batcher._worker.join(timeout=5)
+        assert not batcher._worker.is_alive()
+        assert np.array_equal(batcher.submit(["late"]), text_vector("late")[None, :])
+
+
+class TestDefaultEmbeddingBatchers:
+    @pytest.mark.p2
+    def test_batchers_follow_the_loaded_model(self, monkeypatch):
+        monkeypatch.setattr(DefaultEmbedding, "_batchers", {})
+        fn = RecordingEncoder()
+
+        def embedding(model):
+            mdl = DefaultEmbedding.__new__(DefaultEmbedding)
+            mdl._model = model
+            mdl._model_name = "bge"
+            return mdl
+
+        old_model, new_model = object(), object()
+        monkeypatch.setattr(DefaultEmbedding, "_model", old_model)
+        old = embedding(old_model)
+        assert np.array_equal(old._encode_batched("queries", fn, ["q"]), text_vector("q")[None, :])
+        ((_, batcher),) = DefaultEmbedding._batchers.values()
+        assert embedding(old_model)._encode_batched("queries", fn, ["q"]) is not None
+        assert list(DefaultEmbedding._batchers.values())[0][1] is batcher
+
+        # Loading another model retires the batchers holding the old one.
+        monkeypatch.setattr(DefaultEmbedding, "_model", new_model)
+        embedding(new_model)._encode_batched("queries", fn, ["q"])
+        assert [mdl for mdl, _ in DefaultEmbedding._batchers.values()] == [new_model]
+        batcher._worker.join(timeout=5)
+        assert not batcher._worker.is_alive()
+        # An instance still holding the old model encodes on its own.
+        assert np.array_equal(old._encode_batched("queries", fn, ["old"]), text_vector("old")[None, :])
+        for _, b in DefaultEmbedding._batchers.values():
+            b.close()
@@ -0,0 +1,67 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import random
+import string
+
+import datrie
+import pytest
+
+from rag.nlp.rag_tokenizer import MmapTrie, RagTokenizer
+
+WORDS = ["中国", "中国人", "人民", "银行", "中国人民银行", "北京", "北京大学", "大学生", "machine", "learning", "学习"]
+
+
+@pytest.fixture
+def tries(tmp_path):
+    tknzr = RagTokenizer.__new__(RagTokenizer)
+    trie = datrie.Trie(string.printable)
+    for w in WORDS:
+        trie[tknzr.key_(w)] = (random.randint(-20, 20), random.choice(["n", "v", "ns", "nt", ""]))
+        trie[tknzr.rkey_(w)] = 1
+    return tknzr, trie, MmapTrie.compile(trie, str(tmp_path / "huqie.txt.marisa"))
+
+
+class TestMmapTrie:
+    @pytest.mark.p1
+    def test_lookups_match_datrie(self, tries):
+        tknzr, trie, mmap_trie = tries
+        for w in WORDS + ["中", "银", "大学", "machines", "学"]:
+            for k in (tknzr.key_(w), tknzr.rkey_(w)):
+                assert (k in mmap_trie) == (k in trie)
+                if k in trie:
+                    assert mmap_trie[k] == trie[k]
+                assert mmap_trie.has_keys_with_prefix(k) == trie.has_keys_with_prefix(k)
+
+    @pytest.mark.p1
+    def test_reload_and_convert_back(self, tries, tmp_path):
+        _, trie, _ = tries
+        loaded = MmapTrie.load(str(tmp_path / "huqie.txt.marisa"))
+        assert sorted(loaded.items()) == sorted(trie.items())
+        assert sorted(loaded.to_datrie().items()) == sorted(trie.items())
+
+    @pytest.mark.p2
+    def test_frequencies_are_clamped_to_a_byte(self, tmp_path):
+        trie = datrie.Trie(string.printable)
+        trie["big"] = (500, "n")
+        trie["small"] = (-500, "v")
+        mmap_trie = MmapTrie.compile(trie, str(tmp_path / "clamp.marisa"))
+        assert mmap_trie["big"] == (127, "n")
+        assert mmap_trie["small"] == (-128, "v")
+
+    @pytest.mark.p1
+    def test_tokenizer_loads_the_mmap_dictionary(self):
+        from rag.nlp import rag_tokenizer
+        assert isinstance(rag_tokenizer.tokenizer.trie_, MmapTrie)
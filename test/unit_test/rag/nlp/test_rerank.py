@@ -0,0 +1,85 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import random
+
+import numpy as np
+import pytest
+
+from fakes import FakeDocStore
+
+from rag.nlp import rag_tokenizer
+from rag.nlp.search import Dealer
+
+CORPUS = rag_tokenizer.tokenize(
+    "多校划片就是一个小区对应多个小学初中，让买了学区房的家庭也不确定到底能上哪个学校。目的是通过这种方式为学区房降温，把就近入学落到实处。"
+    "公开征求意见稿提出，境外投资者可使用自有人民币或外汇投资。Retrieval augmented generation combines a search engine with a language model."
+).split()
+QUESTION = "学区房如何降温 retrieval augmented generation"
+
+
+@pytest.fixture(scope="module")
+def dealer():
+    return Dealer(FakeDocStore())
+
+
+def boosted_tokens(fld):
+    # Token list the per-chunk term weighting used to be computed on.
+    content_ltks = list(dict.fromkeys(fld["content_ltks"].split()))
+    title_tks = [t for t in fld.get("title_tks", "").split() if t]
+    question_tks = [t for t in fld.get("question_tks", "").split() if t]
+    return content_ltks + title_tks * 2 + fld.get("important_kwd", []) * 5 + question_tks * 6
+
+
+class TestTokenSimilarity:
+    @pytest.mark.p1
+    def test_batch_matches_token_similarity(self, dealer):
+        rnd = random.Random(0)
+        _, keywords = dealer.qryr.question(QUESTION)
+        cands = [rnd.choices(CORPUS, k=rnd.randint(0, 200)) for _ in range(200)]
+        expected = dealer.qryr.token_similarity(keywords, cands)
+        assert np.allclose(dealer.qryr.batch_token_similarity(keywords, cands), expected)
+
+    @pytest.mark.p2
+    def test_batch_without_candidates(self, dealer):
+        _, keywords = dealer.qryr.question(QUESTION)
+        assert dealer.qryr.batch_token_similarity(keywords, []) == []
+
+
+class TestRerank:
+    @pytest.mark.p1
+    def test_rerank_matches_boosted_token_lists(self, dealer):
+        rnd = random.Random(1)
+        ids, field = [], {}
+        for i in range(50):
+            ids.append(str(i))
+            field[str(i)] = {
+                "content_ltks": " ".join(rnd.choices(CORPUS, k=rnd.randint(1, 100))),
+                "title_tks": " ".join(rnd.choices(CORPUS, k=3)),
+                "important_kwd": rnd.choices(CORPUS, k=2),
+                "question_tks": " ".join(rnd.choices(CORPUS, k=4)),
+            }
+        query_vector = [rnd.random() for _ in range(8)]
+        vectors = np.array([[rnd.random() for _ in range(8)] for _ in ids], dtype=np.float32)
+        sres = Dealer.SearchResult(total=len(ids), ids=ids, query_vector=query_vector, field=field, vectors=vectors)
+
+        sim, tksim, vtsim = dealer.rerank(sres, QUESTION)
+
+        _, keywords = dealer.qryr.question(QUESTION)
+        expected_tksim = dealer.qryr.token_similarity(keywords, [boosted_tokens(field[i]) for i in ids])
+        expected_vtsim = vectors @ np.array(query_vector) / np.linalg.norm(vectors, axis=1) / np.linalg.norm(query_vector)
+        assert np.allclose(tksim, expected_tksim)
+        assert np.allclose(vtsim, expected_vtsim, atol=1e-6)
+        assert np.allclose(sim, 0.7 * expected_vtsim + 0.3 * np.array(expected_tksim), atol=1e-6)
@@ -0,0 +1,103 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import time
+
+import numpy as np
+import pytest
+
+from rag.nlp import search
+from rag.nlp.search import Dealer
+from rag.utils import retrieval_cache
+from rag.utils.retrieval_cache import RetrievalCache, bump_kb_generation
+
+REFRESH_DELAY = 0.2
+
+
+class FakeEmbedding:
+    llm_name = "fake-embedding"
+
+    def encode_queries(self, txt):
+        return np.array([1.0, 0.0]), 1
+
+
+def chunk(chunk_id, text):
+    return {"id": chunk_id, "doc_id": "doc", "docnm_kwd": "doc", "content_ltks": text, "content_with_weight": text,
+            "available_int": 1, "q_2_vec": [1.0, 0.0]}
+
+
+@pytest.fixture
+def cache(monkeypatch, redis):
+    monkeypatch.setattr(retrieval_cache, "REDIS_CONN", redis)
+    monkeypatch.setattr(retrieval_cache, "RETRIEVAL_CACHE_REFRESH_DELAY", REFRESH_DELAY)
+    cache = RetrievalCache(maxsize=16, ttl=60)
+    monkeypatch.setattr(search, "RETRIEVAL_CACHE", cache)
+    return cache
+
+
+def retrieve(dealer):
+    res = dealer.retrieval("retrieval cache", FakeEmbedding(), "tenant", ["kb"], 1, 10, similarity_threshold=0)
+    return sorted(c["chunk_id"] for c in res["chunks"])
+
+
+class TestRetrievalCacheKey:
+    @pytest.mark.p1
+    def test_key_follows_kb_generation(self, cache):
+        key = cache.make_key("What  is RAG?", ["kb2", "kb1"], top=8)
+        assert key == cache.make_key("what is rag?", ["kb1", "kb2"], top=8)
+        assert key != cache.make_key("what is rag?", ["kb1", "kb2"], top=9)
+        bump_kb_generation("kb1")
+        assert key != cache.make_key("what is rag?", ["kb1", "kb2"], top=8)
+
+    @pytest.mark.p2
+    def test_no_key_without_redis(self, cache, monkeypatch):
+        monkeypatch.setattr(retrieval_cache.REDIS_CONN, "mget", lambda keys: None)
+        assert cache.make_key("q", ["kb"]) is None
+
+    @pytest.mark.p2
+    def test_local_and_redis_tiers(self, cache, redis):
+        cache.set("k", {"total": 1})
+        assert cache.get("k") == {"total": 1}
+        other = RetrievalCache(maxsize=16, ttl=60)
+        assert other.get("k") == {"total": 1}
+        assert other.get("missing") is None
+        assert cache.stats()["local_hits"] == 1
+        assert other.stats() == {"local_hits": 0, "redis_hits": 1, "misses": 1, "hit_ratio": 0.5}
+
+
+class TestRetrievalInvalidation:
+    @pytest.mark.p1
+    def test_write_invalidates_cached_results(self, cache, doc_store):
+        dealer = Dealer(doc_store)
+        doc_store.insert([chunk("a", "retrieval cache")], "ragflow_tenant", "kb")
+        assert retrieve(dealer) == ["a"]
+
+        doc_store.insert([chunk("b", "retrieval cache")], "ragflow_tenant", "kb")
+        assert retrieve(dealer) == ["a"], "served from the cache until the generation changes"
+        bump_kb_generation("kb")
+        assert retrieve(dealer) == ["a", "b"]
+
+    @pytest.mark.p1
+    def test_results_cached_before_refresh_expire(self, cache, doc_store):
+        dealer = Dealer(doc_store)
+        # A chunk was written but the index has not refreshed yet: it is not searchable and the
+        # stale result gets cached under the new generation.
+        bump_kb_generation("kb")
+        assert retrieve(dealer) == []
+        # Index refresh.
+        doc_store.insert([chunk("a", "retrieval cache")], "ragflow_tenant", "kb")
+        assert retrieve(dealer) == []
+        time.sleep(REFRESH_DELAY * 3)
+        assert retrieve(dealer) == ["a"]
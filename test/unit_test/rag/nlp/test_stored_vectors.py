@@ -0,0 +1,75 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import numpy as np
+import pytest
+
+from fakes import FakeDocStore
+
+from rag.nlp.search import Dealer
+from rag.utils.doc_store_conn import vectors_to_matrix
+
+
+class FakeEmbedding:
+    def encode_queries(self, txt):
+        return np.array([1.0, 0.0, 0.0]), 1
+
+
+class TestVectorsToMatrix:
+    @pytest.mark.p1
+    def test_mixed_formats(self):
+        vectors = [
+            [1.0, 2.0, 3.0],
+            np.array([4.0, 5.0, 6.0]),
+            np.array([7.0, 8.0, 9.0], dtype=np.float32).tobytes(),
+            "1.5\t2.5\t3.5",
+            None,
+            [1.0, 2.0],
+            "",
+        ]
+        mat = vectors_to_matrix(vectors, 3)
+        assert mat.dtype == np.float32
+        assert mat.shape == (7, 3)
+        assert mat.flags["C_CONTIGUOUS"]
+        assert np.array_equal(mat[:4], [[1, 2, 3], [4, 5, 6], [7, 8, 9], [1.5, 2.5, 3.5]])
+        assert not mat[4:].any(), "missing, mis-sized and empty vectors must become zero rows"
+
+    @pytest.mark.p2
+    def test_uniform_lists(self):
+        mat = vectors_to_matrix([[0.1, 0.2], [0.3, 0.4]], 2)
+        assert np.allclose(mat, [[0.1, 0.2], [0.3, 0.4]])
+
+    @pytest.mark.p2
+    def test_empty(self):
+        assert vectors_to_matrix([], 4).shape == (0, 4)
+
+
+class TestSearchVectors:
+    @pytest.mark.p1
+    def test_search_attaches_vector_matrix(self):
+        store = FakeDocStore()
+        store.insert([
+            {"id": "a", "content_ltks": "a", "content_with_weight": "a", "q_3_vec": [1.0, 0.0, 0.0]},
+            {"id": "b", "content_ltks": "b", "content_with_weight": "b", "q_3_vec": "0\t1\t0"},
+            {"id": "c", "content_ltks": "c", "content_with_weight": "c"},
+        ], "idx", "kb")
+        dealer = Dealer(store)
+
+        sres = dealer.search({"question": "a", "kb_ids": ["kb"]}, "idx", ["kb"], FakeEmbedding())
+
+        assert sres.ids == ["a", "b", "c"]
+        assert np.array_equal(sres.vectors, [[1, 0, 0], [0, 1, 0], [0, 0, 0]])
+        _, _, vtsim = dealer.rerank(sres, "a")
+        assert np.allclose(vtsim, [1, 0, 0])
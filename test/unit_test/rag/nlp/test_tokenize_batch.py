@@ -0,0 +1,59 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import random
+
+import pytest
+
+from rag.nlp import rag_tokenizer
+from test_tokenizer import random_line
+
+
+@pytest.fixture(scope="module")
+def texts():
+    rng = random.Random(5)
+    n = max(rag_tokenizer.TOKENIZER_BATCH_MIN, 64) * 2
+    return [random_line(rng, rng.randint(1, 20)) + rng.choice(["", " Running tests", " 2024-01-01 v1.2"]) for _ in range(n)]
+
+
+@pytest.fixture(scope="module")
+def tknzr():
+    tknzr = rag_tokenizer.get_tokenizer()
+    yield tknzr
+    rag_tokenizer._drop_pool(2)
+
+
+class TestTokenizeBatch:
+    @pytest.mark.p1
+    def test_pool_matches_tokenize(self, tknzr, texts):
+        assert isinstance(tknzr.trie_, rag_tokenizer.MmapTrie)
+        expected = [tknzr.tokenize(t) for t in texts]
+        assert rag_tokenizer.tokenize_batch(texts, workers=2) == expected
+        assert 2 in rag_tokenizer._pools
+
+    @pytest.mark.p1
+    def test_pool_matches_fine_grained_tokenize(self, tknzr, texts):
+        expected = []
+        for t in texts:
+            tks = tknzr.tokenize(t)
+            expected.append((tks, tknzr.fine_grained_tokenize(tks)))
+        assert rag_tokenizer.tokenize_batch(texts, workers=2, fine_grained=True) == expected
+
+    @pytest.mark.p2
+    def test_small_batches_stay_in_process(self, tknzr, texts):
+        rag_tokenizer._drop_pool(3)
+        small = texts[: rag_tokenizer.TOKENIZER_BATCH_MIN - 1]
+        assert rag_tokenizer.tokenize_batch(small, workers=3) == [tknzr.tokenize(t) for t in small]
+        assert 3 not in rag_tokenizer._pools
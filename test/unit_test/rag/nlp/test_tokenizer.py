@@ -0,0 +1,95 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import random
+
+import pytest
+
+from rag.nlp import rag_tokenizer
+
+WORDS = ["中国", "人民", "银行", "北京", "大学", "学生", "研究", "生命", "起源", "科学", "技术", "发展",
+         "经济", "市场", "公司", "管理", "信息", "系统", "数据", "分析", "的", "了", "和", "是", "在"]
+CHARS = "的一是不了人我在有他这中大来上国个到说们为子和你地出道也时年得就那要下以生会自着去之过家学对可里后小心多天而能好都然没日于起还发成事只作当想看开手用主行方又如前所本见经头面公同"
+
+
+@pytest.fixture(scope="module")
+def tknzr():
+    return rag_tokenizer.get_tokenizer()
+
+
+def random_line(rng, n_words):
+    parts = []
+    for _ in range(n_words):
+        parts.append(rng.choice(WORDS) if rng.random() < 0.6 else "".join(rng.choice(CHARS) for _ in range(rng.randint(1, 3))))
+    return "".join(parts)
+
+
+def dfs_best(tknzr, chars, topn):
+    tkslist = []
+    tknzr.dfs_(chars, 0, [], tkslist)
+    return tknzr.sortTks_(tkslist)[:topn]
+
+
+class TestBestPaths:
+    @pytest.mark.p1
+    def test_matches_dfs_ranking(self, tknzr):
+        rng = random.Random(7)
+        for _ in range(300):
+            chars = random_line(rng, rng.randint(1, 5))
+            expected = dfs_best(tknzr, chars, 2)
+            got = tknzr.bestPaths_(chars, 2)
+            assert [tks for tks, _ in got] == [tks for tks, _ in expected], chars
+            assert [score for _, score in got] == pytest.approx([score for _, score in expected]), chars
+
+    @pytest.mark.p2
+    def test_repetitive_and_long_inputs(self, tknzr):
+        for chars in ["哈哈哈哈哈哈哈哈哈哈哈哈", "啊啊啊啊啊中国人民", "一二三四五六七八九十一二三四五六"]:
+            assert tknzr.bestPaths_(chars, 1)[0][0] == dfs_best(tknzr, chars, 1)[0][0]
+
+    @pytest.mark.p2
+    def test_paths_cover_input(self, tknzr):
+        rng = random.Random(11)
+        for _ in range(100):
+            chars = random_line(rng, rng.randint(1, 8))
+            for tks, _ in tknzr.bestPaths_(chars, 2):
+                assert "".join(tks) == chars
+
+
+class TestTokenizeCache:
+    @pytest.mark.p1
+    def test_cached_results_match_uncached(self, tknzr):
+        tknzr.clear_cache()
+        rng = random.Random(3)
+        lines = [random_line(rng, rng.randint(1, 10)) + " hello worlds" for _ in range(50)]
+        expected = [tknzr._tokenize(line) for line in lines]
+        assert [tknzr.tokenize(line) for line in lines] == expected
+        assert [tknzr.tokenize(line) for line in lines] == expected
+        info = tknzr._tokenize_cache.cache_info()
+        assert info.hits >= len(set(lines))
+
+    @pytest.mark.p2
+    def test_long_lines_bypass_the_cache(self, tknzr):
+        tknzr.clear_cache()
+        line = "中国人民银行" * (rag_tokenizer.TOKENIZER_CACHE_MAX_LEN // 6 + 1)
+        assert tknzr.tokenize(line) == tknzr._tokenize(line)
+        assert tknzr._tokenize_cache.cache_info().currsize == 0
+
+    @pytest.mark.p2
+    def test_fine_grained_cache(self, tknzr):
+        tknzr.clear_cache()
+        tks = tknzr.tokenize("中华人民共和国国务院新闻办公室")
+        assert tknzr.fine_grained_tokenize(tks) == tknzr._fine_grained_tokenize(tks)
+        assert tknzr.fine_grained_tokenize(tks) == tknzr._fine_grained_tokenize(tks)
+        assert tknzr._fine_grained_cache.cache_info().hits == 1
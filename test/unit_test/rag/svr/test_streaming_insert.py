@@ -0,0 +1,144 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import pytest
+import trio
+from peewee import DoesNotExist
+
+from rag.svr import task_executor
+
+VECTOR_SIZE = 4
+TASK = {"id": "task", "tenant_id": "tenant", "kb_id": "kb", "location": "doc.pdf", "name": "doc.pdf"}
+
+
+class FakeStorage:
+    def __init__(self):
+        self.deleted = []
+
+    def delete(self, bucket, name):
+        self.deleted.append((bucket, name))
+
+
+class FakeTaskService:
+    unknown = False
+    chunk_ids = ""
+
+    @classmethod
+    def update_chunk_ids(cls, task_id, chunk_ids):
+        if cls.unknown:
+            raise DoesNotExist()
+        cls.chunk_ids = chunk_ids
+
+
+def make_batches(n_batches, batch_size):
+    return [[{"id": f"c{b}_{i}", "content_with_weight": f"chunk {b} {i}", f"q_{VECTOR_SIZE}_vec": [0.0] * VECTOR_SIZE}
+             for i in range(batch_size)] for b in range(n_batches)]
+
+
+@pytest.fixture
+def executor(monkeypatch, doc_store):
+    storage = FakeStorage()
+    bumps = []
+    canceled = {"value": False}
+    FakeTaskService.unknown = False
+    FakeTaskService.chunk_ids = ""
+    monkeypatch.setattr(task_executor.settings, "docStoreConn", doc_store)
+    monkeypatch.setattr(task_executor, "STORAGE_IMPL", storage)
+    monkeypatch.setattr(task_executor, "TaskService", FakeTaskService)
+    monkeypatch.setattr(task_executor, "has_canceled", lambda task_id: canceled["value"])
+    monkeypatch.setattr(task_executor, "bump_kb_generation", lambda kb_id: bumps.append(kb_id))
+    monkeypatch.setattr(task_executor, "DOC_BULK_SIZE", 3)
+    return doc_store, storage, bumps, canceled
+
+
+def run_insert(batches, fail_after=None):
+    """Feed `batches` through a channel the way do_handle_task's producer does, optionally failing midway."""
+    progress = []
+
+    def progress_callback(prog=None, msg=""):
+        progress.append((prog, msg))
+
+    async def produce(send_channel):
+        for i, batch in enumerate(batches):
+            if fail_after is not None and i == fail_after:
+                await trio.sleep(0.05)
+                raise RuntimeError("embedding failed")
+            await send_channel.send(batch)
+        await send_channel.aclose()
+
+    async def main():
+        send_channel, receive_channel = trio.open_memory_channel(1)
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(produce, send_channel)
+            completed = await task_executor.insert_chunks(TASK, receive_channel, VECTOR_SIZE, progress_callback, sum(len(b) for b in batches))
+            if not completed:
+                nursery.cancel_scope.cancel()
+        return completed
+
+    return trio.run(main), progress
+
+
+class TestStreamingInsert:
+    @pytest.mark.p1
+    def test_all_batches_are_indexed(self, executor):
+        doc_store, storage, bumps, _ = executor
+        batches = make_batches(4, 2)
+        completed, progress = run_insert(batches)
+        assert completed
+        ids = [chunk["id"] for batch in batches for chunk in batch]
+        assert sorted(doc_store.rows) == sorted(ids)
+        assert sorted(FakeTaskService.chunk_ids.split()) == sorted(ids)
+        assert all(f"q_{VECTOR_SIZE}_vec" not in chunk for batch in batches for chunk in batch)
+        assert not storage.deleted
+        assert not bumps
+        assert all(prog is None or prog >= 0 for prog, _ in progress)
+
+    @pytest.mark.p1
+    def test_embedding_failure_removes_indexed_chunks(self, executor):
+        doc_store, storage, bumps, _ = executor
+        with pytest.raises(BaseException) as exc_info:
+            run_insert(make_batches(4, 2), fail_after=3)
+        assert "embedding failed" in repr(exc_info.value)
+        assert not doc_store.rows
+        assert storage.deleted
+        assert bumps == ["kb"]
+
+    @pytest.mark.p1
+    def test_cancel_removes_indexed_chunks(self, executor):
+        doc_store, storage, bumps, canceled = executor
+        canceled["value"] = True
+        completed, progress = run_insert(make_batches(4, 2))
+        assert not completed
+        assert not doc_store.rows
+        assert sorted(name for _, name in storage.deleted) == ["c0_0", "c0_1", "c1_0"]
+        assert bumps == ["kb"]
+        assert progress[-1][0] == -1
+
+    @pytest.mark.p2
+    def test_unknown_task_removes_indexed_chunks(self, executor):
+        doc_store, _, bumps, _ = executor
+        FakeTaskService.unknown = True
+        completed, _ = run_insert(make_batches(4, 2))
+        assert not completed
+        assert not doc_store.rows
+        assert bumps == ["kb"]
+
+    @pytest.mark.p2
+    def test_progress_is_monotonic(self, executor):
+        completed, progress = run_insert(make_batches(40, 10))
+        assert completed
+        reported = [prog for prog, _ in progress if prog is not None]
+        assert reported == sorted(reported)
+        assert all(0.7 <= prog <= 0.9 for prog in reported)
@@ -0,0 +1,119 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import numpy as np
+import pytest
+import trio
+from sklearn.datasets import make_blobs
+
+import graphrag.utils as graph_utils
+import rag.raptor as raptor
+from rag.raptor import RecursiveAbstractiveProcessing4TreeOrganizedRetrieval as Raptor
+
+DIM = 16
+PROMPT = "Summarize: {cluster_content}"
+
+
+class FakeChatModel:
+    llm_name = "fake-chat"
+    max_length = 8192
+
+    def __init__(self):
+        self.calls = 0
+
+    async def async_chat(self, system, history, gen_conf):
+        self.calls += 1
+        return "summary of " + history[0]["content"][len("Summarize: "):].replace("\n", " | ")
+
+
+class FakeEmbeddingModel:
+    llm_name = "fake-embedding"
+
+    def encode(self, texts):
+        rng = np.random.default_rng(abs(hash(texts[0])) % (2 ** 32))
+        return rng.random((len(texts), DIM)).astype(np.float32), 1
+
+
+@pytest.fixture
+def redis(monkeypatch, redis):
+    monkeypatch.setattr(raptor, "REDIS_CONN", redis)
+    monkeypatch.setattr(graph_utils, "REDIS_CONN", redis)
+    return redis
+
+
+def make_chunks(n=30, centers=3):
+    X, _ = make_blobs(n_samples=n, centers=centers, n_features=DIM, random_state=0)
+    return [(f"chunk {i}", X[i].astype(np.float32)) for i in range(n)]
+
+
+def build(chat_mdl, chunks, prompt=PROMPT, tree_id="kb:doc"):
+    msgs = []
+    mdl = Raptor(8, chat_mdl, FakeEmbeddingModel(), prompt, max_token=64)
+    res = trio.run(lambda: mdl(list(chunks), 0, lambda prog=None, msg="": msgs.append(msg), tree_id))
+    return res, msgs
+
+
+class TestRaptor:
+    @pytest.mark.p1
+    def test_cluster_search_matches_exhaustive_bic(self):
+        mdl = Raptor(20, None, None, PROMPT)
+        for centers in (2, 4, 7):
+            X, _ = make_blobs(n_samples=120, centers=centers, n_features=8, cluster_std=0.5, random_state=centers)
+            n, gm = mdl._get_optimal_clusters(X, 0)
+            bics = {k: Raptor._fit(X, k, 0)[0] for k in range(1, 20)}
+            assert n == min(bics, key=bics.get)
+            assert gm.n_components == n
+
+    @pytest.mark.p1
+    def test_tree_key_follows_models_and_config(self):
+        base = Raptor(8, FakeChatModel(), FakeEmbeddingModel(), PROMPT)
+        key = base._tree_key("kb:doc", 0)
+        assert key.startswith("raptor_tree:kb:doc:")
+        assert Raptor(8, FakeChatModel(), FakeEmbeddingModel(), PROMPT)._tree_key("kb:doc", 0) == key
+        assert base._tree_key("kb:doc", 1) != key
+        assert Raptor(8, FakeChatModel(), FakeEmbeddingModel(), "Other: {cluster_content}")._tree_key("kb:doc", 0) != key
+        assert Raptor(9, FakeChatModel(), FakeEmbeddingModel(), PROMPT)._tree_key("kb:doc", 0) != key
+        assert Raptor(8, FakeChatModel(), FakeEmbeddingModel(), PROMPT, threshold=0.2)._tree_key("kb:doc", 0) != key
+
+    @pytest.mark.p1
+    def test_unchanged_tree_reuses_summaries(self, redis):
+        chunks = make_chunks()
+        first, _ = build(FakeChatModel(), chunks)
+        assert len(first) > len(chunks)
+        assert any(k.startswith("raptor_tree:kb:doc:") for k in redis.data)
+
+        second, msgs = build(FakeChatModel(), chunks)
+        assert [t for t, _ in second] == [t for t, _ in first]
+        assert any(m.startswith("Reused") for m in msgs)
+        assert any("(clustering reused)" in m for m in msgs)
+
+    @pytest.mark.p2
+    def test_changed_prompt_starts_a_fresh_tree(self, redis):
+        chunks = make_chunks()
+        build(FakeChatModel(), chunks)
+        _, msgs = build(FakeChatModel(), chunks, prompt="Other: {cluster_content}")
+        assert not any(m.startswith("Reused") for m in msgs)
+
+    @pytest.mark.p2
+    def test_new_chunk_joins_nearest_cluster(self):
+        X, y = make_blobs(n_samples=40, centers=3, n_features=DIM, random_state=1)
+        X = X / np.linalg.norm(X, axis=1, keepdims=True)
+        hashes = [f"h{i}" for i in range(len(X))]
+        centroids = [X[y == c].mean(axis=0).tolist() for c in range(3)]
+        layer = {"members": {h: int(c) for h, c in zip(hashes[:-1], y[:-1])}, "centroids": centroids}
+        lbls, n = Raptor._reuse_clusters(layer, hashes, X)
+        assert n == 3
+        assert lbls == [int(c) for c in y]
+        assert Raptor._reuse_clusters(layer, [f"new{i}" for i in range(len(X))], X) is None
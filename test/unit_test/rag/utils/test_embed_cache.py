@@ -0,0 +1,76 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import json
+
+import numpy as np
+import pytest
+import trio
+
+import graphrag.utils as graph_utils
+from rag.settings import EMBEDDING_CACHE_TTL
+from rag.utils.embedding_scheduler import EmbeddingScheduler
+from test_embedding_scheduler import FakeEmbeddingModel, make_texts, text_vector
+
+
+@pytest.fixture
+def cache_redis(monkeypatch, redis):
+    monkeypatch.setattr(graph_utils, "REDIS_CONN", redis)
+    return redis
+
+
+class TestEmbedCache:
+    @pytest.mark.p1
+    def test_vectors_are_stored_as_float32(self, cache_redis):
+        vec = np.random.rand(1024).astype(np.float32)
+        graph_utils.set_embed_cache("mdl", "text", vec)
+        stored = cache_redis.data[graph_utils.embed_cache_key("mdl", "text")]
+        assert len(stored) < len(json.dumps(vec.tolist())) / 3
+        np.testing.assert_array_equal(graph_utils.get_embed_cache("mdl", "text"), vec)
+
+    @pytest.mark.p2
+    def test_json_entries_are_still_read(self, cache_redis):
+        cache_redis.set(graph_utils.embed_cache_key("mdl", "text"), json.dumps([0.5, 0.25]))
+        np.testing.assert_array_equal(graph_utils.get_embed_cache("mdl", "text"), [0.5, 0.25])
+        assert graph_utils.get_embed_cache_batch("mdl", ["text", "missing"])[1] is None
+
+    @pytest.mark.p1
+    def test_batch_round_trip_and_ttl(self, cache_redis):
+        texts = ["a", "b", "c"]
+        vecs = np.random.rand(3, 16).astype(np.float32)
+        graph_utils.set_embed_cache_batch("mdl", texts, vecs, 60)
+        np.testing.assert_array_equal(np.stack(graph_utils.get_embed_cache_batch("mdl", texts)), vecs)
+        assert set(cache_redis.ttls.values()) == {60}
+
+    @pytest.mark.p1
+    def test_scheduler_serves_repeated_texts_from_cache(self, cache_redis):
+        texts = make_texts(20)
+        scheduler = EmbeddingScheduler(batch_size=4, concurrency=2)
+        mdl = FakeEmbeddingModel(max_delay=0)
+        first, _ = trio.run(scheduler.encode, mdl, texts, None, True)
+        assert set(cache_redis.ttls.values()) == {EMBEDDING_CACHE_TTL}
+        assert EMBEDDING_CACHE_TTL <= 24 * 3600
+
+        mdl = FakeEmbeddingModel(max_delay=0)
+        second, _ = trio.run(scheduler.encode, mdl, texts + ["a new chunk"], None, True)
+        assert mdl.calls == [["a new chunk"]]
+        np.testing.assert_array_equal(second[:-1], first)
+        np.testing.assert_array_equal(second[-1], text_vector("a new chunk"))
+
+    @pytest.mark.p2
+    def test_cache_is_off_by_default(self, cache_redis):
+        scheduler = EmbeddingScheduler(batch_size=4)
+        trio.run(scheduler.encode, FakeEmbeddingModel(max_delay=0), make_texts(4))
+        assert not cache_redis.data
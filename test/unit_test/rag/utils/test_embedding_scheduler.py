@@ -0,0 +1,149 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import random
+import threading
+import time
+
+import numpy as np
+import pytest
+import trio
+
+from rag.utils.embedding_scheduler import EmbeddingScheduler, is_rate_limited
+
+DIM = 8
+
+
+def text_vector(text):
+    rng = np.random.default_rng(abs(hash(text)) % (2 ** 32))
+    return rng.random(DIM).astype(np.float32)
+
+
+class FakeEmbeddingModel:
+    llm_name = "fake-embedding"
+    max_length = 512
+
+    def __init__(self, max_delay=0.02, failures=0, error="429 Too Many Requests"):
+        self.max_delay = max_delay
+        self.failures = failures
+        self.error = error
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    def encode(self, texts):
+        with self._lock:
+            self.calls.append(list(texts))
+            if self.failures > 0:
+                self.failures -= 1
+                raise Exception(self.error)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(random.uniform(0, self.max_delay))
+        with self._lock:
+            self.in_flight -= 1
+        return np.stack([text_vector(t) for t in texts]), sum(len(t) for t in texts)
+
+
+def make_texts(n, distinct=None):
+    distinct = distinct or n
+    return [f"chunk number {i % distinct}" for i in range(n)]
+
+
+class TestEmbeddingScheduler:
+    @pytest.mark.p1
+    def test_matrix_follows_input_order(self):
+        mdl = FakeEmbeddingModel()
+        scheduler = EmbeddingScheduler(batch_size=4, max_batch_size=16, concurrency=4)
+        texts = make_texts(100)
+        mat, tk_count = trio.run(scheduler.encode, mdl, texts, None, False)
+        assert mat.shape == (len(texts), DIM)
+        np.testing.assert_array_equal(mat, np.stack([text_vector(t) for t in texts]))
+        assert tk_count == sum(len(t) for t in texts)
+        assert 1 < mdl.max_in_flight <= 4
+
+    @pytest.mark.p1
+    def test_on_batch_receives_consecutive_runs(self):
+        mdl = FakeEmbeddingModel()
+        scheduler = EmbeddingScheduler(batch_size=3, max_batch_size=12, concurrency=3)
+        texts = make_texts(50)
+        received = []
+
+        async def on_batch(start, vts):
+            received.append((start, vts))
+
+        mat, _ = trio.run(scheduler.encode, mdl, texts, on_batch, False)
+        assert mat is None
+        pos = 0
+        for start, vts in received:
+            assert start == pos
+            pos += len(vts)
+        assert pos == len(texts)
+        np.testing.assert_array_equal(np.concatenate([vts for _, vts in received]),
+                                      np.stack([text_vector(t) for t in texts]))
+
+    @pytest.mark.p1
+    def test_identical_texts_are_encoded_once(self):
+        mdl = FakeEmbeddingModel(max_delay=0)
+        scheduler = EmbeddingScheduler(batch_size=8, concurrency=2)
+        texts = make_texts(40, distinct=10)
+        mat, _ = trio.run(scheduler.encode, mdl, texts, None, False)
+        sent = [t for call in mdl.calls for t in call]
+        assert sorted(sent) == sorted(set(texts))
+        np.testing.assert_array_equal(mat, np.stack([text_vector(t) for t in texts]))
+
+    @pytest.mark.p2
+    def test_batches_respect_token_budget(self):
+        scheduler = EmbeddingScheduler(batch_size=10)
+        lengths = [5, 5, 5, 40, 5, 5]
+        assert scheduler._next_batch_end(lengths, 0, 20) == 3
+        assert scheduler._next_batch_end(lengths, 3, 20) == 4
+        assert scheduler._next_batch_end(lengths, 4, 20) == 6
+
+    @pytest.mark.p1
+    def test_rate_limit_backs_off_and_retries(self):
+        mdl = FakeEmbeddingModel(max_delay=0, failures=2)
+        scheduler = EmbeddingScheduler(batch_size=8, concurrency=4, base_delay=0.01)
+        texts = make_texts(8)
+        mat, _ = trio.run(scheduler.encode, mdl, texts, None, False)
+        np.testing.assert_array_equal(mat, np.stack([text_vector(t) for t in texts]))
+        assert len(mdl.calls) == 3
+        assert scheduler.batch_size < 8
+        assert scheduler.limiter.total_tokens == 1
+
+    @pytest.mark.p2
+    def test_rate_limit_gives_up_after_max_retries(self):
+        mdl = FakeEmbeddingModel(max_delay=0, failures=10)
+        scheduler = EmbeddingScheduler(batch_size=4, concurrency=1, max_retries=2, base_delay=0.01)
+        with pytest.raises(ExceptionGroup) as exc_info:
+            trio.run(scheduler.encode, mdl, make_texts(4), None, False)
+        assert exc_info.group_contains(Exception, match="429")
+        assert len(mdl.calls) == 3
+
+    @pytest.mark.p2
+    def test_other_errors_are_not_retried(self):
+        mdl = FakeEmbeddingModel(max_delay=0, failures=1, error="invalid api key")
+        scheduler = EmbeddingScheduler(batch_size=4, concurrency=1, base_delay=0.01)
+        with pytest.raises(ExceptionGroup) as exc_info:
+            trio.run(scheduler.encode, mdl, make_texts(4), None, False)
+        assert exc_info.group_contains(Exception, match="invalid api key")
+        assert len(mdl.calls) == 1
+
+    @pytest.mark.p3
+    def test_is_rate_limited(self):
+        assert is_rate_limited(Exception("Error code: 429"))
+        assert is_rate_limited(Exception("TPM limit reached"))
+        assert not is_rate_limited(Exception("connection reset"))
@@ -0,0 +1,128 @@
+#
+#  Copyright 2025 The InfiniFlow Authors. All Rights Reserved.
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+#
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+import requests
+
+from rag.llm.embedding_model import HuggingFaceEmbed
+from rag.utils import http_session
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.server.connections.add(self.client_address)
+        self.server.cookies.append(self.headers.get("Cookie"))
+        if self.path == "/slow":
+            time.sleep(1)
+        body = b"[[0.5, 0.25]]" if self.path == "/embed" else b'{"ok": true}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Set-Cookie", "tenant=a; Path=/")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    server.connections = set()
+    server.cookies = []
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def sessions(monkeypatch):
+    monkeypatch.setattr(http_session, "_SESSIONS", type(http_session._SESSIONS)())
+    monkeypatch.setattr(http_session, "_HTTPX_CLIENTS", type(http_session._HTTPX_CLIENTS)())
+
+
+class TestHttpSession:
+    @pytest.mark.p1
+    def test_one_session_per_origin(self):
+        session = http_session.get_session("http://embed.local:8080/v1/embeddings")
+        assert http_session.get_session("http://embed.local:8080/v1/rerank") is session
+        assert http_session.get_session("embed.local:8080/v1") is session
+        assert http_session.get_session("https://embed.local:8080/v1") is not session
+        assert http_session.get_session("http://embed.local:8081/v1") is not session
+
+    @pytest.mark.p1
+    def test_connections_are_reused_without_cookies(self, server):
+        for _ in range(5):
+            assert http_session.post(f"{server.url}/v1/embeddings", json={"input": ["text"]}).json() == {"ok": True}
+        assert len(server.connections) == 1
+        assert server.cookies == [None] * 5
+        stats = http_session.pool_stats()[server.url]
+        assert (stats["requests"], stats["errors"], stats["in_flight"], stats["peak_in_flight"]) == (5, 0, 0, 1)
+
+    @pytest.mark.p1
+    def test_concurrent_requests_are_counted(self, server):
+        threads = [threading.Thread(target=http_session.post, args=(f"{server.url}/slow",)) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        stats = http_session.pool_stats()[server.url]
+        assert stats["requests"] == 4 and stats["in_flight"] == 0
+        assert 1 < stats["peak_in_flight"] <= 4
+        assert stats["utilization"] == stats["peak_in_flight"] / stats["pool_maxsize"]
+
+    @pytest.mark.p2
+    def test_default_timeout_and_errors(self, server, monkeypatch):
+        monkeypatch.setattr(http_session, "HTTP_READ_TIMEOUT", 0.2)
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            http_session.post(f"{server.url}/slow")
+        assert http_session.post(f"{server.url}/slow", timeout=5).status_code == 200
+        stats = http_session.pool_stats()[server.url]
+        assert (stats["requests"], stats["errors"]) == (2, 1)
+
+    @pytest.mark.p2
+    def test_evicted_sessions_stay_usable(self, server, monkeypatch):
+        monkeypatch.setattr(http_session, "HTTP_MAX_SESSIONS", 2)
+        session = http_session.get_session(server.url)
+        http_session.get_session("http://a.local")
+        http_session.get_session(server.url)
+        http_session.get_session("http://b.local")
+        assert list(http_session._SESSIONS) == [server.url, "http://b.local"]
+        http_session.get_session("http://c.local")
+        assert server.url not in http_session._SESSIONS
+        # A caller still holding the evicted session can keep using it.
+        assert session.post(f"{server.url}/v1").status_code == 200
+
+
+    @pytest.mark.p2
+    def test_model_providers_share_the_pool(self, server):
+        mdl = HuggingFaceEmbed("", "bge-m3", base_url=server.url)
+        vectors, _ = mdl.encode(["a", "b", "c"])
+        assert np.allclose(vectors, [[0.5, 0.25]] * 3)
+        assert np.allclose(mdl.encode_queries("q")[0], [0.5, 0.25])
+        assert len(server.connections) == 1
+        assert http_session.pool_stats()[server.url]["requests"] == 4